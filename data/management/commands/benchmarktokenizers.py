@@ -0,0 +1,57 @@
+import glob
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from radar.config import tokenizer_config
+from tokenizer.tokenizer import tokenize_source
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the tokenizing speed of the tokenizers in settings.TOKENIZERS"
+        " by tokenizing a sample source named after the tokenizer key, e.g. python.py."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tokenizer',
+            action='append',
+            help="Key of a tokenizer to measure, may be given several times. Defaults to all tokenizers.",
+        )
+        parser.add_argument(
+            '--samples',
+            default=os.path.join("tokenizer", "benchmark_sources"),
+            help="Directory of the sample sources",
+        )
+        parser.add_argument('--scale', type=int, default=10, help="Times the sample is repeated in the source")
+        parser.add_argument('--repeat', type=int, default=10, help="Times the source is tokenized")
+
+    def handle(self, *args, **options):
+        for key in options['tokenizer'] or settings.TOKENIZERS:
+            paths = sorted(glob.glob(os.path.join(options['samples'], glob.escape(key) + ".*")))
+            if not paths:
+                self.stderr.write("%s: no sample source" % key)
+                continue
+            with open(paths[0], encoding="utf-8") as f:
+                source = f.read() * options['scale']
+            t_config = tokenizer_config(key)
+
+            try:
+                # The first call also loads lexers and starts tokenizer processes
+                tokens, _ = tokenize_source(source, t_config) or (None, None)
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    tokenize_source(source, t_config)
+                elapsed = (time.perf_counter() - start) / options['repeat']
+            except Exception as e:
+                self.stderr.write("%s: failed to tokenize: %s" % (key, e))
+                continue
+
+            token_count = len(tokens or "")
+            self.stdout.write(
+                "%-8s %8d chars %7d tokens %9.2f ms/source %9.0f tokens/s"
+                % (key, len(source), token_count, elapsed * 1000, token_count / elapsed if elapsed > 0 else 0)
+            )
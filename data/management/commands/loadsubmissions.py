@@ -1,7 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.core.exceptions import ObjectDoesNotExist
 
-from provider.filesystem import load_submission_dir
+from provider.filesystem import load_submission_dirs
 from data.models import Course
 
 
@@ -23,6 +23,12 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('course/exercise', type=str)
         parser.add_argument('submission_path', nargs='+', type=str)
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            default=1,
+            help="Amount of submission directories read and tokenized concurrently",
+        )
 
     def handle(self, *args, **options):
         (course_key, exercise_key) = options['course/exercise'].split("/", 1)
@@ -47,7 +53,10 @@ class Command(BaseCommand):
             exercise.name = exercise_key
             exercise.save()
 
-        for path in options['submission_path']:
-            submission = load_submission_dir(exercise, path)
-            if submission is not None:
-                self.stdout.write("Saved submission %s" % (submission))
+        def progress(done, total):
+            self.stdout.write("Saved %d/%d submissions" % (done, total))
+
+        submissions = load_submission_dirs(
+            exercise, options['submission_path'], jobs=max(1, options['jobs']), progress=progress
+        )
+        self.stdout.write("Inserted %d submissions" % len(submissions))
@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 from data.models import Course
-from matcher.tasks import match_exercise
+from matcher.tasks import match_exercise, match_new_submissions
 
 
 class Command(BaseCommand):
@@ -10,6 +10,12 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('course/exercise', type=str)
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help="Match only the unmatched submissions against the already matched submissions,"
+                 " keeping all existing comparisons",
+        )
 
     def handle(self, *args, **options):
         (course_key, exercise_key) = options['course/exercise'].split("/", 1)
@@ -17,4 +23,7 @@ class Command(BaseCommand):
         exercise = course.get_exercise(exercise_key)
 
         self.stdout.write("Matching for exercise %s" % (exercise))
-        match_exercise(exercise.pk, False)
+        if options['incremental']:
+            match_new_submissions(exercise.pk)
+        else:
+            match_exercise(exercise.pk, False)
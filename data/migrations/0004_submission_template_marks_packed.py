@@ -0,0 +1,24 @@
+# Generated by Django 4.2.18 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0003_merge_20250729_1256"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="submission",
+            name="template_marks_packed",
+            field=models.BinaryField(
+                blank=True,
+                default=None,
+                help_text="Packed bitset of the tokens that have matched with the exercise template,"
+                " where the mark of token i is the bit i % 8 of byte i // 8.",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,109 @@
+import array
+import itertools
+import json
+import sys
+import zlib
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+# Copies of matchlib.util.pack_int_rows and unpack_int_rows as of this migration,
+# so that later changes to the packed format do not change this migration
+def pack_int_rows(rows, width):
+    deltas = array.array("i")
+    for column in range(width):
+        previous = 0
+        for row in rows:
+            deltas.append(row[column] - previous)
+            previous = row[column]
+    if sys.byteorder == "big":
+        deltas.byteswap()
+    return zlib.compress(deltas.tobytes())
+
+
+def unpack_int_rows(packed, width):
+    deltas = array.array("i")
+    deltas.frombytes(zlib.decompress(packed))
+    if sys.byteorder == "big":
+        deltas.byteswap()
+    count = len(deltas) // width
+    columns = (itertools.accumulate(deltas[c * count:(c + 1) * count]) for c in range(width))
+    return [list(row) for row in zip(*columns)]
+
+
+def _convert(queryset, source, target, convert):
+    batch = []
+    for obj in queryset.exclude(**{f"{source}__isnull": True}).only("id", source).iterator(chunk_size=BATCH_SIZE):
+        setattr(obj, target, convert(getattr(obj, source)))
+        batch.append(obj)
+        if len(batch) >= BATCH_SIZE:
+            queryset.model.objects.bulk_update(batch, [target])
+            batch = []
+    if batch:
+        queryset.model.objects.bulk_update(batch, [target])
+
+
+def _pack(width):
+    # Empty strings and JSON nulls are stored as empty lists
+    return lambda value: pack_int_rows(json.loads(value or "[]") or [], width)
+
+
+def _unpack(width):
+    return lambda value: json.dumps(unpack_int_rows(value, width))
+
+
+def pack_json(apps, schema_editor):
+    Submission = apps.get_model("data", "Submission")
+    Comparison = apps.get_model("data", "Comparison")
+    _convert(Submission.objects.all(), "indexes_json", "indexes_packed", _pack(2))
+    _convert(Comparison.objects.all(), "matches_json", "matches_packed", _pack(3))
+
+
+def unpack_json(apps, schema_editor):
+    Submission = apps.get_model("data", "Submission")
+    Comparison = apps.get_model("data", "Comparison")
+    _convert(Submission.objects.all(), "indexes_packed", "indexes_json", _unpack(2))
+    _convert(Comparison.objects.all(), "matches_packed", "matches_json", _unpack(3))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0004_submission_template_marks_packed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="submission",
+            name="indexes_packed",
+            field=models.BinaryField(
+                blank=True,
+                default=None,
+                help_text="Source indexes [start, end] of every token, packed with pack_int_rows.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="comparison",
+            name="matches_packed",
+            field=models.BinaryField(
+                blank=True,
+                default=None,
+                help_text="Array of 3-element arrays packed with pack_int_rows, containing the index mappings and"
+                " lengths of matches. E.g. [[i, j, n], ... ] where n is the match length, i starting index of the"
+                " match in submission_a, and j in submission_b.",
+                null=True,
+            ),
+        ),
+        migrations.RunPython(pack_json, unpack_json),
+        migrations.RemoveField(
+            model_name="submission",
+            name="indexes_json",
+        ),
+        migrations.RemoveField(
+            model_name="comparison",
+            name="matches_json",
+        ),
+    ]
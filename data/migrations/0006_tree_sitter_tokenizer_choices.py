@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+TOKENIZER_CHOICES = [
+    ("skip", "Skip"),
+    ("scala", "Scala"),
+    ("python", "Python"),
+    ("js", "JavaScript (ECMA 2016)"),
+    ("html", "HTML5"),
+    ("css", "CSS"),
+    ("c", "C"),
+    ("cpp", "C++"),
+    ("matlab", "MATLAB"),
+    ("java", "Java"),
+    ("c-ts", "C (tree-sitter)"),
+    ("cpp-ts", "C++ (tree-sitter)"),
+    ("js-ts", "JavaScript (tree-sitter)"),
+    ("py-ts", "Python (tree-sitter)"),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0005_packed_matches_and_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="course",
+            name="tokenizer",
+            field=models.CharField(
+                choices=TOKENIZER_CHOICES,
+                default="skip",
+                help_text="Tokenizer for the submission contents",
+                max_length=16,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="exercise",
+            name="override_tokenizer",
+            field=models.CharField(blank=True, choices=TOKENIZER_CHOICES, max_length=8, null=True),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0006_tree_sitter_tokenizer_choices"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MatchingRun",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "matching_start_time",
+                    models.CharField(
+                        help_text="Matching timestamp of the exercise when the run was started", max_length=50
+                    ),
+                ),
+                (
+                    "batches_expected",
+                    models.IntegerField(
+                        blank=True,
+                        default=None,
+                        help_text="Amount of result batches sent by the run, None until all batches are sent",
+                        null=True,
+                    ),
+                ),
+                (
+                    "batches_completed",
+                    models.IntegerField(
+                        default=0, help_text="Amount of result batches of the run that have been stored"
+                    ),
+                ),
+                (
+                    "exercise",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="matching_runs",
+                        to="data.exercise",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("exercise", "matching_start_time")},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0007_matchingrun"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TokenizedSource",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("source_hash", models.CharField(help_text="MD5 checksum of the source", max_length=32)),
+                ("tokenizer", models.CharField(help_text="Key of the tokenizer in TOKENIZERS", max_length=16)),
+                (
+                    "version",
+                    models.CharField(
+                        help_text="Checksum of the tokenizer version, its code and the versions of its packages",
+                        max_length=32,
+                    ),
+                ),
+                ("tokens", models.TextField()),
+                (
+                    "indexes_packed",
+                    models.BinaryField(
+                        help_text="Source indexes [start, end] of every token, packed with pack_int_rows."
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("source_hash", "tokenizer", "version")},
+            },
+        ),
+    ]
@@ -1,3 +1,4 @@
+import base64
 import datetime
 import json
 import logging
@@ -8,6 +9,7 @@ from django.core.exceptions import ValidationError, FieldError
 from django.db import models
 
 from aplus_client.django.models import NamespacedApiObject
+from matcher.greedy_string_tiling.matchlib.util import pack_int_rows, pack_marks, unpack_int_rows, unpack_marks
 from radar.config import choice_name, tokenizer_config
 from tokenizer.tokenizer import tokenize_source
 
@@ -506,6 +508,38 @@ class Exercise(models.Model):
         return "%s/%s (%s)" % (self.course.name, self.name, self.created)
 
 
+class MatchingRun(models.Model):
+    """
+    Result batch counters of a delayed matching run of an exercise.
+    The batches are counted with atomic updates of this row, which is deleted when the run is finalized.
+
+    """
+
+    exercise = models.ForeignKey(
+        Exercise, on_delete=models.CASCADE, related_name="matching_runs"
+    )
+    matching_start_time = models.CharField(
+        max_length=50, help_text="Matching timestamp of the exercise when the run was started"
+    )
+    batches_expected = models.IntegerField(
+        blank=True,
+        null=True,
+        default=None,
+        help_text="Amount of result batches sent by the run, None until all batches are sent",
+    )
+    batches_completed = models.IntegerField(
+        default=0, help_text="Amount of result batches of the run that have been stored"
+    )
+
+    class Meta:
+        unique_together = ("exercise", "matching_start_time")
+
+    def __str__(self):
+        return "%s: %s (%d/%s batches)" % (
+            self.exercise, self.matching_start_time, self.batches_completed, self.batches_expected
+        )
+
+
 # What's with the ForeignKey and unique_together with Course?
 # Why not ManyToMany to Course?
 class Student(models.Model):
@@ -569,9 +603,21 @@ class Submission(models.Model):
         default=None,
         help_text="MD5 checksum of all characters in the submission source",
     )
-    indexes_json = models.TextField(blank=True, null=True, default=None)
+    indexes_packed = models.BinaryField(
+        blank=True,
+        null=True,
+        default=None,
+        help_text="Source indexes [start, end] of every token, packed with pack_int_rows.",
+    )
     authored_token_count = models.IntegerField(blank=True, null=True, default=None)
     longest_authored_tile = models.IntegerField(blank=True, null=True, default=None)
+    template_marks_packed = models.BinaryField(
+        blank=True,
+        null=True,
+        default=None,
+        help_text="Packed bitset of the tokens that have matched with the exercise template,"
+                  " where the mark of token i is the bit i % 8 of byte i // 8.",
+    )
     max_similarity = models.FloatField(
         db_index=True, default=0.0, help_text="Maximum average similarity."
     )
@@ -614,16 +660,17 @@ class Submission(models.Model):
         """
         Return self in serializable format with minimal data needed to compute submission similarity.
         """
-        template_marks, authored_token_count, longest_authored_tile = (
-            self.template_marks()
-        )
+        if self.template_marks_packed is None:
+            # Submission was matched against the template before template marks were stored
+            self.set_template_marks(self.template_matches())
+            self.save(update_fields=["template_marks_packed", "authored_token_count", "longest_authored_tile"])
         return {
             "id": self.id,
             "tokens": self.tokens,
             "checksum": self.source_checksum,
-            "ignore_marks": template_marks,
-            "authored_token_count": authored_token_count,
-            "longest_authored_tile": longest_authored_tile,
+            "packed_ignore_marks": base64.b64encode(self.template_marks_packed).decode("ascii"),
+            "authored_token_count": self.authored_token_count,
+            "longest_authored_tile": self.longest_authored_tile,
         }
 
     @property
@@ -636,7 +683,22 @@ class Submission(models.Model):
         ct = self.template_comparison
         if ct is None:
             raise FieldError("Template matches requested before matching a submission")
-        return json.loads(ct.matches_json)
+        return ct.matches()
+
+    def indexes(self):
+        """
+        Return a list of the source indexes [start, end] of every token, or None if not tokenized.
+        """
+        if self.indexes_packed is None:
+            return None
+        return unpack_int_rows(self.indexes_packed, 2)
+
+    def set_indexes(self, indexes):
+        self.indexes_packed = pack_int_rows(indexes, 2)
+
+    @property
+    def indexes_json(self):
+        return json.dumps(self.indexes())
 
     def template_marks(self):
         """
@@ -645,22 +707,33 @@ class Submission(models.Model):
             - authored_count: Amount of unique, non-template tokens
             - longest_tile: Amount of tokens in the longest tile with non-template tokens
         """
+        if self.template_marks_packed is None:
+            self.set_template_marks(self.template_matches())
+        return (
+            unpack_marks(self.template_marks_packed, len(self.tokens)),
+            self.authored_token_count,
+            self.longest_authored_tile,
+        )
+
+    def set_template_marks(self, template_matches):
+        """
+        Compute the packed template marks, the amount of authored tokens and the longest authored tile
+        from a list of template matches sorted by the match start, without saving the submission.
+        """
         token_count = len(self.tokens)
-        marks = [False] * token_count
         authored_count = token_count
         longest_tile = 0
         s = 0
-        for m in self.template_matches():
+        for m in template_matches:
             match_start, match_len = m[0], m[2]
-            # Mark tokens that have matched with template
-            for i in range(match_start, match_start + match_len):
-                marks[i] = True
             # Template tokens have not been authored by the student
             authored_count -= match_len
             longest_tile = max(longest_tile, match_start - s)
             s = match_start + match_len
         longest_tile = max(longest_tile, token_count - s)
-        return ''.join(str(int(m)) for m in marks), authored_count, longest_tile
+        self.template_marks_packed = pack_marks(((m[0], m[2]) for m in template_matches), token_count)
+        self.authored_token_count = authored_count
+        self.longest_authored_tile = longest_tile
 
     def __str__(self):
         return (
@@ -701,13 +774,13 @@ class Comparison(models.Model):
         null=True,
         help_text="Similarity score resulting from the comparison of two submissions.",
     )
-    matches_json = models.TextField(
+    matches_packed = models.BinaryField(
         blank=True,
         null=True,
         default=None,
-        help_text="JSON-serialized array of 3-element arrays, containing the index mappings and lengths of matches."
-                  " E.g. [[i, j, n], ... ] where n is the match length, i starting index of the match in submission_a,"
-                  " and j in submission_b.",
+        help_text="Array of 3-element arrays packed with pack_int_rows, containing the index mappings and lengths"
+                  " of matches. E.g. [[i, j, n], ... ] where n is the match length, i starting index of the match"
+                  " in submission_a, and j in submission_b.",
     )
     review = models.IntegerField(choices=settings.REVIEW_CHOICES, default=0)
     objects = ComparisonManager()
@@ -718,6 +791,21 @@ class Comparison(models.Model):
             "-similarity",
         ]
 
+    def matches(self):
+        """
+        Return the list of matches [i, j, n], or None if not matched.
+        """
+        if self.matches_packed is None:
+            return None
+        return unpack_int_rows(self.matches_packed, 3)
+
+    def set_matches(self, matches):
+        self.matches_packed = pack_int_rows(matches, 3)
+
+    @property
+    def matches_json(self):
+        return json.dumps(self.matches())
+
     @property
     def review_options(self):
         return settings.REVIEWS
@@ -777,3 +865,26 @@ class TaskError(models.Model):
         return "Failed task in package {}, occurred at {}, with error {}".format(
             self.package, self.created, self.error_string
         )
+
+
+class TokenizedSource(models.Model):
+    """
+    Cached tokens of a submission source, so that identical sources, e.g. resubmissions and sources reloaded from
+    the provider, are not tokenized again. See tokenizer.tokenizer.tokenize_cached.
+    """
+
+    source_hash = models.CharField(max_length=32, help_text="MD5 checksum of the source")
+    tokenizer = models.CharField(max_length=16, help_text="Key of the tokenizer in TOKENIZERS")
+    version = models.CharField(
+        max_length=32, help_text="Checksum of the tokenizer version, its code and the versions of its packages"
+    )
+    tokens = models.TextField()
+    indexes_packed = models.BinaryField(
+        help_text="Source indexes [start, end] of every token, packed with pack_int_rows."
+    )
+
+    class Meta:
+        unique_together = ("source_hash", "tokenizer", "version")
+
+    def __str__(self):
+        return "%s %s (%s)" % (self.tokenizer, self.source_hash, self.version)
@@ -1,7 +1,13 @@
 from django.test import TestCase
+import os
 import random
+import tempfile
+from unittest import mock
 
-from data.models import Course, Submission, Comparison, Student
+from data.models import Course, Submission, Comparison, Student, TokenizedSource
+from provider.filesystem import load_submission_dirs
+from provider.insert import source_checksum
+from tokenizer import tokenizer
 from aplus_client.django.models import ApiNamespace
 
 
@@ -49,3 +55,66 @@ class TestExerciseTable(TestCase):
         )
 
         self.assertQuerySetEqual(sorted_comparison_set, exercise.top_comparisons(100))
+
+
+# Test for reusing the tokens of identical sources
+class TestTokenizedSourceCache(TestCase):
+    def test_identical_sources_are_tokenized_once(self):
+        source = "def f(x):\n    return x + 1\n"
+        with mock.patch("tokenizer.tokenizer.tokenize_source", wraps=tokenizer.tokenize_source) as tokenize:
+            tokens = tokenizer.tokenize_cached(source, "python")
+            # Cache hit
+            self.assertEqual(tokenizer.tokenize_cached(source, "python"), tokens)
+            self.assertEqual(tokenize.call_count, 1)
+            # Cache misses for another source and another tokenizer version
+            tokenizer.tokenize_cached(source + "f(1)\n", "python")
+            self.assertEqual(tokenize.call_count, 2)
+            TokenizedSource.objects.update(version="0" * 32)
+            self.assertEqual(tokenizer.tokenize_cached(source, "python"), tokens)
+            self.assertEqual(tokenize.call_count, 3)
+        self.assertEqual(TokenizedSource.objects.count(), 3)
+
+
+# Test for loading submission directories in bulk
+class TestLoadSubmissionDirs(TestCase):
+    def test_submissions_are_created_once_with_template_comparisons(self):
+        site = ApiNamespace(601)
+        site.save()
+        course = Course(id=601, api_id=601, namespace_id=601, tokenizer="python")
+        course.save()
+        exercise = course.get_exercise("TestExercise")
+        template = "def f(x):\n    return x + 1\n"
+        exercise.template_tokens = tokenizer.tokenize_source(template, tokenizer.tokenizer_config("python"))[0]
+        exercise.save()
+
+        with tempfile.TemporaryDirectory() as directory, self.settings(SUBMISSION_DIRECTORY=directory):
+            sources = {
+                "alice/1": template,
+                "bob/1": template + "def g(y):\n    return [y] * 2\n",
+                "carol/1": "x = 1\n",
+                "dave/1": "def f(:\n    \"\"\"unterminated",
+            }
+            paths = {}
+            for key, source in sources.items():
+                path = paths[key] = os.path.join(directory, "sources", key)
+                os.makedirs(path)
+                with open(os.path.join(path, "main.py"), "w") as f:
+                    f.write(source)
+            existing = Submission(key="carol/1", exercise=exercise, student=course.get_student("carol"))
+            existing.save()
+
+            submissions = load_submission_dirs(exercise, [*paths.values(), paths["bob/1"]], jobs=1)
+
+        # Duplicate and existing keys are skipped
+        self.assertEqual(sorted(s.key for s in submissions), ["alice/1", "bob/1", "dave/1"])
+        self.assertEqual(exercise.submissions.count(), 4)
+        alice, bob, dave = (Submission.objects.get(key=key) for key in ("alice/1", "bob/1", "dave/1"))
+        # The template comparisons are created
+        self.assertEqual(alice.template_comparison.similarity, 1.0)
+        self.assertLess(bob.template_comparison.similarity, 1.0)
+        self.assertFalse(bob.invalid)
+        self.assertEqual(bob.source_checksum, source_checksum(sources["bob/1"]))
+        # A submission that cannot be tokenized is saved as invalid without tokens
+        self.assertTrue(dave.invalid)
+        self.assertFalse(dave.tokens)
+        self.assertIsNone(dave.template_comparison)
@@ -1,6 +1,9 @@
 #ifndef GST_H
 #define GST_H
+#include <cstddef>
+#include <cstdint>
 #include <string>
+#include <utility>
 #include <vector>
 
 /*
@@ -48,6 +51,66 @@ struct Tile {
 typedef std::vector<Tile> Tiles;
 
 
+/*
+ * Non-owning view to the initial marks of a token string.
+ * Marks are either a string of ASCII zeros and ones, or a packed bitset,
+ * where the mark of token i is the bit i % 8 of byte i / 8.
+ * Tokens past the end of the marks are unmarked.
+ */
+struct MarksView {
+    const char* data;
+    std::size_t size;
+    bool packed;
+
+    inline bool is_marked(std::size_t i) const noexcept {
+        if (packed) {
+            return (i >> 3) < size and ((static_cast<unsigned char>(data[i >> 3]) >> (i & 7u)) & 1u);
+        }
+        return i < size and data[i] == '1';
+    }
+};
+
+
+/*
+ * Upper bounds for the work done when matching one pair of strings, zero meaning no bound.
+ * Probes are lookups of pattern substrings in the hash table of text substrings,
+ * and visits of text positions found by the lookups.
+ */
+struct MatchBudget {
+    std::uint64_t max_probes = 0;
+    std::uint64_t max_milliseconds = 0;
+};
+
+
+/*
+ * Match two token strings given as non-owning character arrays, without copying them into strings.
+ * See match_strings below.
+ * If the budget is exceeded, matching stops, partial is set to true,
+ * and the tiles found before exceeding the budget are returned.
+ */
+Tiles match_strings(
+        const char* pattern,
+        std::size_t pattern_length,
+        const char* text,
+        std::size_t text_length,
+        const match_length_t& init_search_length,
+        const MarksView& init_pattern_marks,
+        const MarksView& init_text_marks,
+        const MatchBudget& budget,
+        bool& partial);
+
+/*
+ * Same as above, without a budget.
+ */
+Tiles match_strings(
+        const char* pattern,
+        std::size_t pattern_length,
+        const char* text,
+        std::size_t text_length,
+        const match_length_t& init_search_length,
+        const MarksView& init_pattern_marks,
+        const MarksView& init_text_marks);
+
 /*
  * For two given strings, run Karp-Rabin Greedy String tiling and return a vector of Tiles that correspond to matching substrings of maximal length from both strings.
  * Initial search length denotes the threshold of a match; substrings shorter than init_search_length are not compared.
@@ -60,6 +123,38 @@ Tiles match_strings(
         const std::string& text,
         const match_length_t& init_search_length,
         const std::string& init_pattern_marks = "",
-        const std::string& init_text_marks = "") noexcept;
+        const std::string& init_text_marks = "");
+
+/*
+ * Non-owning view to a token string and its initial marks.
+ */
+struct TokenString {
+    const char* data;
+    std::size_t size;
+    MarksView marks;
+};
+
+typedef std::pair<std::size_t, std::size_t> StringPair;
+
+struct PairTiles {
+    Tiles tiles;
+    bool partial = false;
+};
+
+/*
+ * Match many pairs of token strings, given as index pairs (a, b) to strings, using up to thread_count native threads.
+ * Setting thread_count to 0 uses one thread for each hardware thread.
+ * The shorter string of each pair is used as the pattern, but the tiles of each pair are always given as
+ * (index in string a, index in string b, match length).
+ * The budget applies to each pair separately.
+ * Return a vector with the tiles of each pair, in the order of pairs.
+ * An exception thrown while matching in any thread, e.g. std::bad_alloc, is rethrown after all threads have stopped.
+ */
+std::vector<PairTiles> match_pairs(
+        const std::vector<TokenString>& strings,
+        const std::vector<StringPair>& pairs,
+        const match_length_t& init_search_length,
+        unsigned thread_count,
+        const MatchBudget& budget = MatchBudget());
 
 #endif // GST_H
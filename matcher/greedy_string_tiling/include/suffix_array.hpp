@@ -0,0 +1,66 @@
+#ifndef SUFFIX_ARRAY_H
+#define SUFFIX_ARRAY_H
+#include <cstddef>
+#include <cstdint>
+#include <vector>
+#include "gst.hpp"
+
+typedef std::vector<std::uint32_t> Symbols;
+
+/*
+ * Return the suffix array of a string of integer symbols, i.e. the starting positions of all suffixes in
+ * lexicographical order, using prefix doubling with radix sorting in O(n log n) time.
+ */
+std::vector<std::uint32_t> suffix_array(const Symbols& symbols);
+
+/*
+ * Return the LCP array of a string of integer symbols and its suffix array with Kasai's algorithm in O(n) time.
+ * Element k is the length of the longest common prefix of the suffixes at suffix_array[k - 1] and suffix_array[k],
+ * and element 0 is always 0.
+ */
+std::vector<std::uint32_t> lcp_array(const Symbols& symbols, const std::vector<std::uint32_t>& suffixes);
+
+/*
+ * Same as match_strings, but instead of running Karp-Rabin matching with repeated rehashing of the strings,
+ * the tiles are found from a generalized suffix array and LCP array of both strings.
+ * Each round builds the arrays of the unmarked parts of the strings in O(n log n) time,
+ * finds the longest match of each pattern position in linear time,
+ * and tiles the maximal matches greedily, longest first, skipping matches overlapping tiles of the same round.
+ * Rounds are repeated until no match of at least init_search_length remains.
+ * The tiles are maximal matches as with match_strings, but ties between equally long matches may be broken
+ * differently, so the tiles are not always the same.
+ */
+Tiles match_suffix_array(
+        const char* pattern,
+        std::size_t pattern_length,
+        const char* text,
+        std::size_t text_length,
+        const match_length_t& init_search_length,
+        const MarksView& init_pattern_marks,
+        const MarksView& init_text_marks);
+
+/*
+ * Tiles of a pair of token strings (a, b), a < b, given as (index in string a, index in string b, match length).
+ */
+struct IndexedPairTiles {
+    StringPair pair;
+    Tiles tiles;
+};
+
+/*
+ * Match all pairs of token strings at once using one generalized suffix array and LCP array of all strings.
+ * The maximal matches of at least init_search_length between all pairs are enumerated from the LCP intervals
+ * in time proportional to their amount, and each pair is then tiled greedily from its maximal matches,
+ * longest first, as with match_suffix_array.
+ * Only pairs (a, b) with a < first_count are matched, and only pairs with at least one tile are added to result.
+ * If more than max_matches maximal matches are found, matching stops and false is returned.
+ * Zero max_matches means no limit.
+ */
+bool match_all_suffix_array(
+        const std::vector<TokenString>& strings,
+        const match_length_t& init_search_length,
+        std::size_t first_count,
+        std::size_t max_matches,
+        std::vector<IndexedPairTiles>& result);
+
+#endif // SUFFIX_ARRAY_H
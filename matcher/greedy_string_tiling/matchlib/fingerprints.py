@@ -0,0 +1,103 @@
+"""
+Candidate pair selection using winnowed k-gram fingerprints [1].
+
+Every submission is reduced to a set of fingerprints, which are the minimum k-gram hashes of all windows
+of consecutive k-grams in the authored, i.e. unmarked, parts of the token string.
+The fingerprints are then collected into an inverted index and only pairs of submissions that share
+enough fingerprints are compared with greedy string tiling.
+
+If the window length w is chosen such that w + k - 1 is at most the minimum match length,
+every pair of token strings sharing an unmarked substring of at least the minimum match length
+will also share at least one fingerprint, i.e. no match found by greedy string tiling is lost.
+
+[1] Schleimer, S., Wilkerson, D.S. and Aiken, A., 2003. Winnowing: local algorithms for document fingerprinting.
+    In Proceedings of the 2003 ACM SIGMOD international conference on Management of data (pp. 76-85).
+"""
+import bisect
+import collections
+import re
+
+from ..matchlib.util import marks_of, unpack_marks
+
+UNMARKED_RUN = re.compile("0+")
+
+
+def unmarked_segments(tokens, marks):
+    """
+    Yield all maximal substrings of tokens that contain no marked tokens.
+    Tokens that have no mark in marks are assumed to be unmarked.
+    """
+    if isinstance(marks, str):
+        marks = marks[:len(tokens)].ljust(len(tokens), "0")
+    else:
+        marks = unpack_marks(marks, len(tokens))
+    for run in UNMARKED_RUN.finditer(marks):
+        yield tokens[run.start():run.end()]
+
+
+def window_length(kgram_length, minimum_match_length):
+    """
+    Return the longest winnowing window that still guarantees
+    every common substring of minimum_match_length to produce a shared fingerprint.
+    """
+    return max(1, minimum_match_length - kgram_length + 1)
+
+
+def winnow(tokens, marks, kgram_length, window):
+    """
+    Return the set of fingerprints for a token string, ignoring marked tokens.
+    """
+    fingerprints = set()
+    for segment in unmarked_segments(tokens, marks):
+        hashes = [hash(segment[i:i + kgram_length]) for i in range(len(segment) - kgram_length + 1)]
+        if not hashes:
+            continue
+        if len(hashes) <= window:
+            fingerprints.add(min(hashes))
+            continue
+        # Monotonic queue of hash indexes, the front of the queue is always the minimum of the current window
+        queue = collections.deque()
+        for i, h in enumerate(hashes):
+            while queue and hashes[queue[-1]] >= h:
+                queue.pop()
+            queue.append(i)
+            if queue[0] <= i - window:
+                queue.popleft()
+            if i >= window - 1:
+                fingerprints.add(hashes[queue[0]])
+    return fingerprints
+
+
+def candidate_pairs(string_data, minimum_match_length, kgram_length=5, minimum_shared=1):
+    """
+    Given a list of string data dicts, return a sorted list of index pairs (i, j), i < j,
+    of all string data pairs that share at least minimum_shared fingerprints.
+    """
+    kgram_length = max(1, min(kgram_length, minimum_match_length))
+    window = window_length(kgram_length, minimum_match_length)
+
+    # Inverted index from fingerprint to ascending indexes of the string data that contain the fingerprint
+    index = collections.defaultdict(list)
+    fingerprints = []
+    for i, data in enumerate(string_data):
+        fps = winnow(data["tokens"], marks_of(data), kgram_length, window)
+        fingerprints.append(fps)
+        for fp in fps:
+            index[fp].append(i)
+
+    pairs = []
+    for i, fps in enumerate(fingerprints):
+        # Consider only string data with a larger index to produce every pair once
+        postings = (index[fp] for fp in fps)
+        postings = (p[bisect.bisect_right(p, i):] for p in postings)
+        if minimum_shared <= 1:
+            others = set()
+            for p in postings:
+                others.update(p)
+        else:
+            shared = collections.Counter()
+            for p in postings:
+                shared.update(p)
+            others = (j for j, count in shared.items() if count >= minimum_shared)
+        pairs.extend((i, j) for j in sorted(others))
+    return pairs
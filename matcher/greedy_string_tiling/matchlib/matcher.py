@@ -1,207 +1,620 @@
 import celery
 import celery.utils.log
+import collections
+import concurrent.futures
+import contextlib
 import itertools
-from ..matchlib.matchers import greedy_string_tiling
-from ..matchlib.util import TokenMatchSet
+import math
+import os
+import queue
+from ..matchlib.matchers import greedy_string_tiling, greedy_string_tiling_pairs, suffix_array_tiling_all
+from ..matchlib.fingerprints import candidate_pairs
+from ..matchlib import paircache, prefilter
+from ..matchlib.util import TokenMatchSet, marks_of
 from multiprocessing import Pool
-from functools import partial
 
-from matcher.helper import swap_positions
 import time
 
-from data.models import Exercise, Submission, Comparison
+from django.db import transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from data.models import Exercise, MatchingRun, Submission
 from matcher import matcher
 
 logger = celery.utils.log.get_task_logger(__name__)
 
 # pylint: disable=inconsistent-return-statements
 # pylint: disable=logging-fstring-interpolation
-# pylint: disable=use-a-generator
 # pylint: disable=logging-not-lazy
 # pylint: disable=f-string-without-interpolation
 
 # The keys that will be returned in the result of the matching functions
 RESULT_KEYS = ["id_a", "id_b", "match_indexes", "similarity_a", "similarity_b"]
 
-def _match_all_multiprocessing(
-        config: dict[str, any], pairs_to_compare: tuple[dict[str, any], dict[str, any]]
+# String data and configuration of the current matching run in a pool worker,
+# set once per worker by _init_worker so that the tasks only need to carry index pairs
+_worker_config = None
+_worker_string_data = None
+
+
+def _init_worker(config: dict[str, any], string_data: list[dict[str, any]]):
+    """
+    Pool initializer, store the configuration and string data of the run in the worker.
+    With the fork start method the data is inherited from the parent process without pickling,
+    otherwise it is pickled once per worker instead of once per compared pair.
+    """
+    global _worker_config, _worker_string_data # pylint: disable=global-statement
+    _worker_config = config
+    _worker_string_data = string_data
+
+
+def _decode_marks(string_data: list[dict[str, any]]):
+    """
+    Decode the marks of all string data before they are shared with the workers,
+    so that each worker does not need to decode the marks again.
+    """
+    for data in string_data:
+        marks_of(data)
+
+
+def _equivalence_classes(string_data: list[dict[str, any]]):
+    """
+    Group string data with equal checksums, tokens and marks into classes.
+    The matches and similarities of a pair depend only on these, so the results of one representative pair
+    of two classes are also the results of all other pairs between the classes.
+    Return the list of representatives, i.e. the first string data of each class,
+    and a dict from the id of each representative to the ids of all string data in its class.
+    """
+    classes = {}
+    for data in string_data:
+        key = ("checksum" in data, data.get("checksum"), data["tokens"], marks_of(data))
+        classes.setdefault(key, []).append(data)
+    representatives = [members[0] for members in classes.values()]
+    member_ids = {members[0]["id"]: [data["id"] for data in members] for members in classes.values()}
+    return representatives, member_ids
+
+
+def _fan_out(results: list[list[any]], member_ids: dict[int, list[int]]):
+    """
+    Copy the matches of representative pairs to all pairs between the classes of the representatives.
+    """
+    for id_a, id_b, *result in results:
+        for a in member_ids[id_a]:
+            for b in member_ids[id_b]:
+                yield [a, b, *result]
+
+
+def _match_within_classes(
+        config: dict[str, any],
+        representatives: list[dict[str, any]],
+        member_ids: dict[int, list[int]]
     ):
     """
-    Compare all pairs and return an iterator over the matches.
+    Return the matches of all pairs within each class,
+    which are the same for all pairs of a class and thus compared only once by comparing the representative to itself.
     """
+    results = []
+    for data in representatives:
+        members = member_ids[data["id"]]
+        if len(members) < 2:
+            continue
+        for _, _, *result in _match_pairs(config, [data, dict(data)], [(0, 1)]):
+            results.extend([a, b, *result] for n, a in enumerate(members) for b in members[n + 1:])
+    return results
 
-    # Get the configuration values
-    minimum_match_length = config.get("minimum_match_length", 1)
+
+def _similar_match(config: dict[str, any], a, b, matches: TokenMatchSet, similarity_a: float, similarity_b: float):
+    """
+    Return the match of a pair of string data, or None if the pair is not similar enough.
+    """
     minimum_similarity = config.get("minimum_similarity", -1)
     similarity_precision = config.get("similarity_precision")
     optional_round = (lambda x: round(x, similarity_precision)) if similarity_precision is not None else (lambda x: x)
 
-    # Get the pair of submissions to compare
-    a = pairs_to_compare[0]
-    b = pairs_to_compare[1]
+    # If the similarity is above the minimum, return the match
+    if similarity_a > minimum_similarity or similarity_b > minimum_similarity:
+        return [a["id"], b["id"], matches.match_list(), optional_round(similarity_a), optional_round(similarity_b)]
+    return None
 
-    if min(a["longest_authored_tile"], b["longest_authored_tile"]) > minimum_match_length:
 
-        # Get the string pair that will be compared
-        tokens_a, tokens_b = a["tokens"], b["tokens"]
+def _compare_pairs(config: dict[str, any], string_data: list[dict[str, any]], index_pairs, threads: int = 1):
+    """
+    Compare the given index pairs of string data with the match algorithm and return a list of TokenMatchSets.
+    With greedy string tiling, all pairs are compared with a single call to the C++ extension,
+    using the given amount of native threads.
+    Other match algorithms configured with a dotted path in "match_algorithm" are called for each pair.
+    """
+    minimum_match_length = config.get("minimum_match_length", 1)
+    match_algorithm = import_string(config["match_algorithm"]) if "match_algorithm" in config else greedy_string_tiling
+
+    # Compare unique syntax tokens, ignoring marked tokens
+    # If no marks are given, assume no tokens are marked
+    if match_algorithm is greedy_string_tiling:
+        # Pass only the string data of the compared pairs to the extension
+        local_indexes = {}
+        for pair in index_pairs:
+            for i in pair:
+                local_indexes.setdefault(i, len(local_indexes))
+        return greedy_string_tiling_pairs(
+            [string_data[i]["tokens"] for i in local_indexes],
+            [marks_of(string_data[i]) for i in local_indexes],
+            [(local_indexes[i], local_indexes[j]) for i, j in index_pairs],
+            minimum_match_length,
+            threads,
+            max_probes=config.get("max_probes", 0),
+            max_milliseconds=config.get("max_milliseconds", 0),
+        )
+    return [
+        match_algorithm(
+            string_data[i]["tokens"],
+            marks_of(string_data[i]),
+            string_data[j]["tokens"],
+            marks_of(string_data[j]),
+            minimum_match_length,
+        )
+        for i, j in index_pairs
+    ]
 
-        # If the checksums match, we can skip the syntax token matching and create a full match of all tokens
-        if "checksum" in a and "checksum" in b and a["checksum"] == b["checksum"]:
-            # Skip syntax token matching and create a full match of all tokens
-            matches = TokenMatchSet.full_match_from_length(min(len(tokens_a), len(tokens_b)))
 
-            # Match of all tokens
-            similarity_a = 1.0
-            similarity_b = 1.0
-        else:
-            # Compare unique syntax tokens, ignoring marked tokens
-            # If no marks are given, assume no tokens are marked
-            marks_a = a.get("ignore_marks", '0' * len(tokens_a))
-            marks_b = b.get("ignore_marks", '0' * len(tokens_b))
-            matches = greedy_string_tiling(tokens_a, marks_a, tokens_b, marks_b, minimum_match_length)
-            similarity_a = matches.token_count() / a["authored_token_count"] if a["authored_token_count"] > 0 else 0
-            similarity_b = matches.token_count() / b["authored_token_count"] if b["authored_token_count"] > 0 else 0
+def _pair_cache(config: dict[str, any]):
+    """
+    Return the persistent pair cache configured with "pair_cache_path", or None if not configured.
+    """
+    if not config.get("pair_cache_path"):
+        return None
+    return paircache.open_cache(config["pair_cache_path"], config.get("pair_cache_max_entries", 0))
 
-        # If the similarity is above the minimum, return the match
-        if similarity_a > minimum_similarity or similarity_b > minimum_similarity:
-            match = [
-                a["id"], b["id"], matches.match_list(), optional_round(similarity_a), optional_round(similarity_b)
-            ]
-            return match
 
+def _compare_pairs_cached(config: dict[str, any], string_data: list[dict[str, any]], index_pairs, threads: int = 1):
+    """
+    Same as _compare_pairs, but look up the pairs compared in earlier runs from the persistent pair cache first,
+    and store the matches of the other pairs in it.
+    Partial matches of pairs that exceeded the work budget are not stored.
+    """
+    cache = _pair_cache(config)
+    if cache is None or not index_pairs:
+        return _compare_pairs(config, string_data, index_pairs, threads)
 
-def _match_all(config, pairs_to_compare):
+    minimum_match_length = config.get("minimum_match_length", 1)
+    algorithm = config.get("match_algorithm", "greedy_string_tiling")
+    keys = [
+        cache.key(string_data[i], string_data[j], minimum_match_length, algorithm)
+        for i, j in index_pairs
+    ]
+    cached = cache.get_many(keys)
+    missed = [n for n, key in enumerate(keys) if key not in cached]
+    missed_matches = _compare_pairs(config, string_data, [index_pairs[n] for n in missed], threads)
+    cache.put_many([(keys[n], matches) for n, matches in zip(missed, missed_matches) if not matches.partial])
+
+    pair_matches = [cached.get(key) for key in keys]
+    for n, matches in zip(missed, missed_matches):
+        pair_matches[n] = matches
+    return pair_matches
+
+
+def _match_pairs(
+        config: dict[str, any],
+        string_data: list[dict[str, any]],
+        index_pairs: list[tuple[int, int]],
+        threads: int = 1,
+        pair_matches: dict[tuple[int, int], TokenMatchSet] = None
+    ):
     """
-    Compare all pairs and return an iterator over the matches.
+    Compare the given index pairs of string data and return a list of the matches.
+    If pair_matches is given, the matches of the pairs are looked up from it instead, pairs without matches missing.
+    Otherwise the pairs are compared with _compare_pairs, using the persistent pair cache if configured.
     """
     minimum_match_length = config.get("minimum_match_length", 1)
-    minimum_similarity = config.get("minimum_similarity", -1)
-    similarity_precision = config.get("similarity_precision")
-    optional_round = (lambda x: round(x, similarity_precision)) if similarity_precision is not None else (lambda x: x)
 
-    for a, b, in pairs_to_compare:
-        if max(a["longest_authored_tile"], b["longest_authored_tile"]) < minimum_match_length:
-            # Skip pairs that have too few unique tokens
+    results = []
+    compared_pairs = []
+    for i, j in index_pairs:
+        a, b = string_data[i], string_data[j]
+        if min(a["longest_authored_tile"], b["longest_authored_tile"]) < minimum_match_length:
+            # Skip pairs where either one has no authored tile long enough to be matched
             continue
-        # Get the string pair that will be compared
-        tokens_a, tokens_b = a["tokens"], b["tokens"]
-
+        # If the checksums match, we can skip the syntax token matching and create a full match of all tokens
         if "checksum" in a and "checksum" in b and a["checksum"] == b["checksum"]:
-            # Skip syntax token matching and create a full match of all tokens
-            matches = TokenMatchSet.full_match_from_length(min(len(tokens_a), len(tokens_b)))
-            # Match of all tokens
-            similarity_a = 1.0
-            similarity_b = 1.0
-
+            matches = TokenMatchSet.full_match_from_length(min(len(a["tokens"]), len(b["tokens"])))
+            results.append(_similar_match(config, a, b, matches, 1.0, 1.0))
         else:
-            # Compare unique syntax tokens, ignoring marked tokens
-            # If no marks are given, assume no tokens are marked
-            marks_a = a.get("ignore_marks", '0' * len(tokens_a))
-            marks_b = b.get("ignore_marks", '0' * len(tokens_b))
-            matches = greedy_string_tiling(tokens_a, marks_a, tokens_b, marks_b, minimum_match_length)
-            similarity_a = matches.token_count() / a["authored_token_count"] if a["authored_token_count"] > 0 else 0
-            similarity_b = matches.token_count() / b["authored_token_count"] if b["authored_token_count"] > 0 else 0
-
-        # If the similarity is above the minimum, return the match
-        if similarity_a > minimum_similarity or similarity_b > minimum_similarity:
-            match = [
-                a["id"], b["id"], matches.match_list(), optional_round(similarity_a), optional_round(similarity_b)
-            ]
-            yield match
+            compared_pairs.append((i, j))
+
+    if pair_matches is not None:
+        pair_matches = [pair_matches.get(pair) or TokenMatchSet() for pair in compared_pairs]
+    else:
+        pair_matches = _compare_pairs_cached(config, string_data, compared_pairs, threads)
 
+    for (i, j), matches in zip(compared_pairs, pair_matches):
+        a, b = string_data[i], string_data[j]
+        if matches.partial:
+            logger.warning(
+                f"Matching submissions {a['id']} and {b['id']} exceeded the work budget, the matches are partial"
+            )
+        similarity_a = matches.token_count() / a["authored_token_count"] if a["authored_token_count"] > 0 else 0
+        similarity_b = matches.token_count() / b["authored_token_count"] if b["authored_token_count"] > 0 else 0
+        results.append(_similar_match(config, a, b, matches, similarity_a, similarity_b))
 
-def match_all_combinations(config: dict[str, any], string_data_iter: list[dict[str, any]], delay: bool = False):
+    return [match for match in results if match is not None]
+
+
+def _match_all(config, string_data, index_pairs):
     """
-    Given a configuration dict and an iterable of string data,
-    do string similarity comparisons for all 2-combinations without replacement for the input data.
-    Return an iterator over matches.
+    Compare all pairs in a single process and return an iterator over the matches.
+    The index pairs are consumed in batches, so that a list of all pairs is never built.
     """
+    index_pairs = iter(index_pairs)
+    batch_size = config.get("result_batch_size", 1000)
+    while True:
+        pairs = list(itertools.islice(index_pairs, batch_size))
+        if not pairs:
+            return
+        yield from _match_pairs(config, string_data, pairs)
 
-    # Get exercise for logging
-    exercise = Exercise.objects.get(pk=config["exercise_id"])
-    config["exercise_name"] = exercise.name
-    config["course_name"] = exercise.course.name
 
-    try:
-        logger.info("Multiprocessing: " + f"{exercise.name} | {exercise.course.name}")
+def _compares_all_pairs(config: dict[str, any]):
+    """
+    Return True if all 2-combinations of string data are compared, i.e. no pairs are filtered before matching.
+    """
+    return config.get("pair_selection", "all") != "fingerprint" and not _uses_prefilter(config)
 
-        # Create a pool of workers to do the comparisons in parallel
-        with Pool() as pool:
-            combinations = itertools.combinations(string_data_iter, 2)
 
-            if delay:
-                #Get length of combinations for logging
-                chunk_size = round(sum(1 for _ in itertools.combinations(string_data_iter, 2)) * 0.1)
-                logger.info(f"Submissions pairs: {chunk_size * 10}")
-                logger.info(f"Splitting pairs into chunks of size: {chunk_size}")
+def _uses_prefilter(config: dict[str, any]):
+    """
+    Return True if the pairs to compare are filtered by the upper bounds of their similarities.
+    The filter is useless if no pair would be discarded after matching.
+    """
+    return (
+        config.get("similarity_prefilter", False)
+        and config.get("minimum_similarity", -1) >= 0
+        and prefilter.available()
+    )
 
-                tasks_results = []
-                results = []
 
-                # Process combinations in chunks
-                for index, result in enumerate(
-                        pool.imap(partial(_match_all_multiprocessing, config), combinations, chunksize=chunk_size)
-                    ):
-                    # Collect non-None results
-                    if result is not None:
-                        results.append(result)
+def _pairs_to_compare(config: dict[str, any], string_data: list[dict[str, any]]):
+    """
+    Return the amount of pairs to compare and an iterator over the index pairs of string data to compare.
+    If the configured pair selection is 'fingerprint', only pairs that share enough winnowed fingerprints
+    are compared, otherwise all 2-combinations without replacement are compared.
+    If the similarity pre-filter is enabled, pairs that cannot be more similar than the minimum similarity
+    are not compared.
+    """
+    all_pairs_count = len(string_data) * (len(string_data) - 1) // 2
+    if config.get("similarity_prefilter", False) and not prefilter.available():
+        logger.warning("NumPy and SciPy are required for the similarity pre-filter, comparing pairs without it")
+    if _compares_all_pairs(config):
+        return all_pairs_count, itertools.combinations(range(len(string_data)), 2)
+
+    index_pairs = None
+    if config.get("pair_selection", "all") == "fingerprint":
+        index_pairs = candidate_pairs(
+            string_data,
+            config.get("minimum_match_length", 1),
+            kgram_length=config.get("fingerprint_kgram_length", 5),
+            minimum_shared=config.get("fingerprint_minimum_shared", 1),
+        )
+        logger.info(f"Fingerprint index selected {len(index_pairs)} of {all_pairs_count} submission pairs")
+    if _uses_prefilter(config):
+        similar_pairs = prefilter.similar_pairs(
+            string_data,
+            config.get("minimum_match_length", 1),
+            config["minimum_similarity"],
+            ngram_length=config.get("prefilter_ngram_length", 5),
+        )
+        if index_pairs is not None:
+            similar_pairs = sorted(set(similar_pairs).intersection(index_pairs))
+        logger.info(
+            f"Similarity pre-filter selected {len(similar_pairs)} of "
+            f"{all_pairs_count if index_pairs is None else len(index_pairs)} submission pairs"
+        )
+        index_pairs = similar_pairs
+    return len(index_pairs), iter(index_pairs)
 
-                    # If we have enough results, send them to Celery
-                    if len(results) >= chunk_size:
-                        tasks_results.append(handle_celery_match_result.delay(results, config))
-                        results = []
 
-                    # Log progress
-                    if (index + 1) % chunk_size == 0:
-                        logger.info(f"Processed {index + 1} submission pairs...")
+def _block_size(config: dict[str, any], string_data_count: int, processes: int):
+    """
+    Return the amount of submissions on each side of a block of pairs.
+    The blocks are made small enough that there are several blocks for each worker process to balance the load,
+    but never larger than the configured block size.
+    """
+    # A grid of k * k blocks has k * (k + 1) / 2 blocks on or above the diagonal, aim for at least 4 per process
+    blocks_per_side = math.ceil(math.sqrt(8 * processes))
+    return max(1, min(config.get("block_size", 64), math.ceil(string_data_count / blocks_per_side)))
 
-                # Handle any remaining results
-                if len(results) > 0:
-                    tasks_results.append(handle_celery_match_result.delay(results, config))
 
-                logger.info(f"Processed {chunk_size * 10} submission pairs in total.")
+def _pair_blocks(config: dict[str, any], string_data: list[dict[str, any]], processes: int):
+    """
+    Split the pairs to compare into row/column blocks of the pair matrix.
+    Return the amount of pairs to compare and a list of blocks ordered by estimated cost, most expensive first,
+    so that a long block never starts last and holds up the whole run.
+    A block is a tuple (rows, cols, pairs), where pairs is the list of index pairs of the block,
+    or None if all pairs (i, j), i < j, with i in rows and j in cols are compared.
+    """
+    n = len(string_data)
+    lengths = [len(data["tokens"]) for data in string_data]
+    size = _block_size(config, n, processes)
+    pair_count, index_pairs = _pairs_to_compare(config, string_data)
+
+    def block_range(index):
+        return range(index * size, min((index + 1) * size, n))
+
+    costs_and_blocks = []
+    if _compares_all_pairs(config):
+        # Estimate the cost of comparing all pairs of two blocks by the sum of products of the token string lengths
+        sums = [sum(lengths[i] for i in block_range(b)) for b in range(math.ceil(n / size))]
+        squares = [sum(lengths[i] ** 2 for i in block_range(b)) for b in range(len(sums))]
+        for row, row_sum in enumerate(sums):
+            # Pairs within a block on the diagonal
+            costs_and_blocks.append(((row_sum ** 2 - squares[row]) // 2, (block_range(row), block_range(row), None)))
+            for col in range(row + 1, len(sums)):
+                costs_and_blocks.append((row_sum * sums[col], (block_range(row), block_range(col), None)))
+    else:
+        return pair_count, _index_pair_blocks(string_data, index_pairs, size)
+
+    costs_and_blocks.sort(key=lambda cost_and_block: cost_and_block[0], reverse=True)
+    return pair_count, [block for _, block in costs_and_blocks]
+
 
-                # Wait for all Celery tasks to finish
-                tasks_done = False
+def _index_pair_blocks(string_data: list[dict[str, any]], index_pairs, size: int):
+    """
+    Group the given index pairs into blocks of size * size submissions of the pair matrix.
+    Return a list of blocks (rows, cols, pairs) ordered by estimated cost, most expensive first.
+    """
+    n = len(string_data)
+    lengths = [len(data["tokens"]) for data in string_data]
 
-                wait_for = 60
+    def block_range(index):
+        return range(index * size, min((index + 1) * size, n))
 
-                while not tasks_done:
-                    tasks_done = all([x.ready() for x in tasks_results])
-                    if not tasks_done:
-                        logger.info(f"Waiting for handle_celery_match_result:" +
-                                    f" {exercise.name} | {exercise.course.name} to finish...")
-                        time.sleep(wait_for)
+    grouped = collections.defaultdict(list)
+    for i, j in index_pairs:
+        grouped[(i // size, j // size)].append((i, j))
+    costs_and_blocks = []
+    for (row, col), pairs in grouped.items():
+        cost = sum(lengths[i] * lengths[j] for i, j in pairs)
+        costs_and_blocks.append((cost, (block_range(row), block_range(col), pairs)))
 
-            else:
-                # Non-delayed processing, get all results at once
-                results = pool.map(partial(_match_all_multiprocessing, config), combinations)
+    costs_and_blocks.sort(key=lambda cost_and_block: cost_and_block[0], reverse=True)
+    return [block for _, block in costs_and_blocks]
+
+
+def _block_pairs(block: tuple[range, range, list[tuple[int, int]]]):
+    """
+    Return the list of index pairs of a block.
+    """
+    rows, cols, pairs = block
+    if pairs is None:
+        pairs = [(i, j) for i in rows for j in cols if i < j]
+    return pairs
 
-                # Filter out None results
-                results = filter(lambda x: x is not None, results)
+
+def _compare_block(config: dict[str, any], string_data: list[dict[str, any]], block, threads: int = 1):
+    """
+    Compare all pairs of a block of string data.
+    Return the amount of compared pairs and a list of the matches.
+    """
+    pairs = _block_pairs(block)
+    return len(pairs), _match_pairs(config, string_data, pairs, threads)
+
+
+def _match_block(block: tuple[range, range, list[tuple[int, int]]]):
+    """
+    Compare all pairs of a block of the string data shared with the worker.
+    """
+    return _compare_block(_worker_config, _worker_string_data, block)
+
+
+def _index_matches(config: dict[str, any], string_data: list[dict[str, any]], blocks: list):
+    """
+    Match all pairs of string data in the blocks with one generalized suffix array of all string data.
+    Return a dict from index pairs to their matches, or None if there were more maximal matches than configured.
+    """
+    # Pairs (i, j) with no row of any block at i need not be matched
+    first_count = max((block[0].stop for block in blocks), default=0)
+    max_matches = config.get("index_max_matches", 0)
+    pair_matches = suffix_array_tiling_all(
+        [data["tokens"] for data in string_data],
+        [marks_of(data) for data in string_data],
+        config.get("minimum_match_length", 1),
+        first_count,
+        max_matches,
+    )
+    if pair_matches is None:
+        logger.warning(
+            f"Submissions have more than {max_matches} maximal matches, comparing the pairs separately instead"
+        )
+    return pair_matches
+
+
+def _bounded_unordered(submit, blocks: list, window: int):
+    """
+    Submit the blocks with submit(block, completed), keeping at most window blocks in flight,
+    and yield their results in the order of completion.
+    submit must put the result of the block, or the exception raised when comparing it, into the queue completed.
+    Unlike Pool.imap_unordered, which submits all blocks at once, the results wait in the queue only
+    until the next block is submitted.
+    """
+    completed = queue.SimpleQueue()
+    blocks = iter(blocks)
+    in_flight = 0
+    for block in itertools.islice(blocks, window):
+        submit(block, completed)
+        in_flight += 1
+    while in_flight > 0:
+        result = completed.get()
+        in_flight -= 1
+        if isinstance(result, BaseException):
+            raise result
+        for block in itertools.islice(blocks, 1):
+            submit(block, completed)
+            in_flight += 1
+        yield result
+
+
+def _compare_blocks(config: dict[str, any], string_data: list[dict[str, any]], blocks: list, processes: int):
+    """
+    Compare the pairs of all blocks using the configured backend
+    and yield the amount of compared pairs and a list of the matches for each block, in the order of completion.
+    The backend 'process' compares the blocks in a pool of worker processes,
+    the backend 'thread' compares the blocks in a pool of threads sharing the string data without any copies,
+    and the backend 'native' compares each block in this process on native threads of the C++ extension.
+    The backend 'suffix_array' matches all pairs at once from one generalized suffix array of all string data,
+    falling back to the backend 'native' if the string data has too many maximal matches.
+    """
+    backend = config.get("backend", "process")
+    if backend == "suffix_array":
+        pair_matches = _index_matches(config, string_data, blocks)
+        if pair_matches is not None:
+            for block in blocks:
+                pairs = _block_pairs(block)
+                yield len(pairs), _match_pairs(config, string_data, pairs, pair_matches=pair_matches)
+            return
+        backend = "native"
+    # At most two blocks per worker are in flight,
+    # so that completed blocks do not pile up in memory when their matches are consumed slowly
+    window = 2 * processes
+    if backend == "thread":
+        # The extension does not hold the GIL while matching, so the threads can use all cores
+        with concurrent.futures.ThreadPoolExecutor(processes) as executor:
+            def submit(block, completed):
+                future = executor.submit(_compare_block, config, string_data, block)
+                future.add_done_callback(lambda f: completed.put(f.exception() or f.result()))
+
+            yield from _bounded_unordered(submit, blocks, window)
+    elif backend == "native":
+        for block in blocks:
+            yield _compare_block(config, string_data, block, config.get("native_threads", 0))
+    elif backend == "process":
+        # The workers receive the string data once and the tasks carry only blocks of index pairs
+        with Pool(processes, initializer=_init_worker, initargs=(config, string_data)) as pool:
+            def submit(block, completed):
+                pool.apply_async(_match_block, (block,), callback=completed.put, error_callback=completed.put)
+
+            yield from _bounded_unordered(submit, blocks, window)
+    else:
+        raise ValueError(f"Unknown matching backend '{backend}'")
+
+
+def result_batches(config: dict[str, any], string_data_iter: list[dict[str, any]]):
+    """
+    Given a configuration dict and a list of string data,
+    do string similarity comparisons for all 2-combinations without replacement for the input data,
+    or for the candidate pairs selected by the fingerprint index if config["pair_selection"] is 'fingerprint'.
+    String data with equal checksums, tokens and marks are compared only once
+    and their results are copied to all of them.
+    Yield the matches in batches of about config["result_batch_size"] matches, in the order of completion,
+    such that only a few blocks of matches are held in memory at a time regardless of the amount of string data.
+    If comparing in parallel fails before any batch is yielded, the pairs are compared in a single process instead.
+    """
+    result_batch_size = config.get("result_batch_size", 1000)
+    yielded = False
+
+    try:
+        logger.info("Multiprocessing: " + f"{config.get('exercise_name')} | {config.get('course_name')}")
+
+        _decode_marks(string_data_iter)
+
+        # Identical submissions are compared only once and their results are copied to all of them
+        representatives, member_ids = _equivalence_classes(string_data_iter)
+        logger.info(f"Distinct submissions: {len(representatives)} of {len(string_data_iter)}")
+
+        # Do the comparisons in parallel
+        processes = os.cpu_count() or 1
+        pair_count, blocks = _pair_blocks(config, representatives, processes)
+        logger.info(f"Submissions pairs: {pair_count}")
+        logger.info(f"Comparing pairs in {len(blocks)} blocks")
+        pair_cache = _pair_cache(config)
+        cache_stats = pair_cache.stats() if pair_cache is not None else None
+        progress_step = max(1, pair_count // 10)
+
+        # Closing the generator of completed blocks also shuts down the worker pool
+        with contextlib.closing(_compare_blocks(config, representatives, blocks, processes)) as completed_blocks:
+            results = _match_within_classes(config, representatives, member_ids)
+            processed = 0
+
+            for block_pair_count, block_results in completed_blocks:
+                results.extend(_fan_out(block_results, member_ids))
+
+                # If we have enough results, hand them over
+                if len(results) >= result_batch_size:
+                    yielded = True
+                    yield results
+                    results = []
+
+                # Log progress
+                if (processed + block_pair_count) // progress_step > processed // progress_step:
+                    logger.info(f"Processed {processed + block_pair_count} submission pairs...")
+                processed += block_pair_count
+
+        # Handle any remaining results
+        if len(results) > 0:
+            yielded = True
+            yield results
+
+        logger.info(f"Processed {pair_count} submission pairs in total.")
+
+        if pair_cache is not None:
+            # The counters are shared by all workers and runs, log only the lookups of this run
+            stats = pair_cache.stats()
+            logger.info(
+                f"Pair cache: {stats['hits'] - cache_stats['hits']} hits, "
+                f"{stats['misses'] - cache_stats['misses']} misses, {stats['entries']} cached pairs"
+            )
 
     except Exception as e:
+        if yielded:
+            # Comparing all pairs again would duplicate the results that were already handed over
+            raise
         print(f"Error during multiprocessing: {e}")
         print("Matching in single process.")
 
         # Fallback to single-process matching in case of error
-        results = _match_all(config, itertools.combinations(string_data_iter, 2))
+        _, combinations = _pairs_to_compare(config, string_data_iter)
+        results = []
+        for match in _match_all(config, string_data_iter, combinations):
+            results.append(match)
+            if len(results) >= result_batch_size:
+                yield results
+                results = []
+        if len(results) > 0:
+            yield results
 
-        if delay:
-            handle_celery_match_result.delay(list(results), config)
 
-    if delay:
-        # Set zero max similarity for all submissions that were not in results but were expecting results
-        (
-            exercise.submissions.filter(matching_start_time__isnull=False)
-            .filter(matching_start_time=exercise.matching_start_time)
-            .update(max_similarity=0, matched=True, matching_start_time=None)
-        )
-        exercise.matching_start_time = None
-        exercise.save()
+def match_all_combinations(config: dict[str, any], string_data_iter: list[dict[str, any]], delay: bool = False):
+    """
+    Compare all pairs of string data as in result_batches.
+    If delay is True, send each batch of matches to handle_celery_match_result as soon as it is completed,
+    otherwise return a list of all matches.
+    """
 
-    else:
-        return results
+    # Get exercise for logging
+    exercise = Exercise.objects.get(pk=config["exercise_id"])
+    config["exercise_name"] = exercise.name
+    config["course_name"] = exercise.course.name
+
+    if not delay:
+        return [match for results in result_batches(config, string_data_iter) for match in results]
+
+    # Count the completed result batches so that the exercise is finalized as soon as the last batch is stored,
+    # replacing the counters of earlier runs of the exercise
+    MatchingRun.objects.filter(exercise_id=config["exercise_id"]).delete()
+    MatchingRun.objects.create(exercise_id=config["exercise_id"], matching_start_time=config["matching_start_time"])
+    batch_count = 0
+
+    for results in result_batches(config, string_data_iter):
+        handle_celery_match_result.delay(results, config)
+        batch_count += 1
+
+    # The last completed batch finalizes the exercise, or this call if all batches are already completed
+    logger.info(f"Sent {batch_count} result batches: {exercise.name} | {exercise.course.name}")
+    if not _update_run(config, batches_expected=batch_count):
+        logger.warning(
+            f"Matching run {config['matching_start_time']} has no batch counter, it was replaced by a newer run"
+            + f" | {exercise.name} | {exercise.course.name}"
+        )
+        return
+    _finalize_if_completed(config)
 
 
 def match_to_others(
@@ -211,24 +624,136 @@ def match_to_others(
     ) -> list[list[any]]:
     """
     Compare one string data object to all other objects in other_data_iter.
-    Return an iterator over matches.
+    If comparing in parallel fails, the pairs are compared in a single process instead.
+    Return a list of matches.
     """
 
-    # Create a pool of workers to do the comparisons in parallel
-    with Pool() as pool:
-        results = pool.map(partial(_match_all_multiprocessing, config),
-                           ((string_data, other_data) for other_data in other_data_iter))
+    other_data = list(other_data_iter)
+    _decode_marks([string_data] + other_data)
+    # Identical others are compared only once and their results are copied to all of them
+    others, member_ids = _equivalence_classes(other_data)
+    member_ids[string_data["id"]] = [string_data["id"]]
+
+    # The string data is placed first, followed by the distinct others
+    all_data = [string_data]
+    all_data.extend(others)
+
+    # Split the others into blocks to balance the load between the workers
+    processes = os.cpu_count() or 1
+    size = _block_size(config, len(all_data), processes)
+    blocks = [(range(1), range(j, min(j + size, len(all_data))), None) for j in range(1, len(all_data), size)]
+
+    try:
+        results = []
+        with contextlib.closing(_compare_blocks(config, all_data, blocks, processes)) as completed_blocks:
+            for _, block_results in completed_blocks:
+                results.extend(_fan_out(block_results, member_ids))
+        return results
+    except Exception as e:
+        logger.warning(f"Error during multiprocessing: {e}, matching in single process")
+        index_pairs = [(0, j) for j in range(1, len(all_data))]
+        return list(_fan_out(list(_match_all(config, all_data, index_pairs)), member_ids))
 
-    # Filter out None results
-    return filter(lambda x: x is not None, results)
+
+def match_new_to_others(
+    config: dict[str, any],
+    new_data_iter: list[dict[str, any]],
+    other_data_iter: list[dict[str, any]],
+    groups: dict[int, any] = None
+    ) -> list[list[any]]:
+    """
+    Compare each new string data object to all objects in other_data_iter and to the new objects before it.
+    Pairs of objects in the same group, given by the dict groups from ids to group keys, e.g. submissions
+    of the same student, are not compared.
+    All pairs are compared in one run of the configured backend, so that e.g. the worker pool is started only once
+    for all new objects. If comparing in parallel fails, the pairs are compared in a single process instead.
+    Return a list of matches.
+    """
+    other_data = list(other_data_iter)
+    string_data = other_data + list(new_data_iter)
+    _decode_marks(string_data)
+    groups = groups or {}
+
+    def same_group(a, b):
+        group = groups.get(a["id"])
+        return group is not None and group == groups.get(b["id"])
+
+    index_pairs = [
+        (j, i)
+        for i in range(len(other_data), len(string_data))
+        for j in range(i)
+        if not same_group(string_data[j], string_data[i])
+    ]
+    processes = os.cpu_count() or 1
+    blocks = _index_pair_blocks(string_data, index_pairs, _block_size(config, len(string_data), processes))
+    try:
+        results = []
+        with contextlib.closing(_compare_blocks(config, string_data, blocks, processes)) as completed_blocks:
+            for _, block_results in completed_blocks:
+                results.extend(block_results)
+        return results
+    except Exception as e:
+        logger.warning(f"Error during multiprocessing: {e}, matching in single process")
+        return list(_match_all(config, string_data, index_pairs))
+
+
+def _update_run(config: dict[str, any], **fields):
+    """
+    Update the batch counters of the matching run of config.
+    Return the amount of updated runs, i.e. 0 if the run has been finalized or replaced by a newer run.
+    """
+    return (
+        MatchingRun.objects.filter(
+            exercise_id=config["exercise_id"], matching_start_time=config["matching_start_time"]
+        )
+        .update(**fields)
+    )
+
+
+def _finalize_if_completed(config: dict[str, any]):
+    """
+    Finalize the matching run of the exercise if all of its result batches have been stored.
+    Set zero max similarity for all submissions that were not in results but were expecting results,
+    and clear the matching timestamp of the exercise.
+    Safe to call several times and concurrently, only the first call after the completion finalizes the run.
+    Return True if this call finalized the run.
+    """
+    timestamp = config["matching_start_time"]
+    with transaction.atomic():
+        # Deleting the completed counter row succeeds only once, even for concurrent calls
+        deleted, _ = (
+            MatchingRun.objects.filter(
+                exercise_id=config["exercise_id"],
+                matching_start_time=timestamp,
+                batches_expected__isnull=False,
+                batches_completed__gte=F("batches_expected"),
+            )
+            .delete()
+        )
+        if not deleted:
+            return False
+        # Filtering by the timestamp makes results of stale runs no-ops
+        finalized = (
+            Exercise.objects.filter(pk=config["exercise_id"], matching_start_time=timestamp)
+            .update(matching_start_time=None)
+        )
+        if finalized:
+            (
+                Submission.objects.filter(exercise_id=config["exercise_id"], matching_start_time=timestamp)
+                .update(max_similarity=0, matched=True, matching_start_time=None)
+            )
+    if finalized:
+        logger.info(
+            f"Matching finished | {config.get('exercise_name')} | {config.get('course_name')}"
+        )
+    return bool(finalized)
 
 
 @celery.shared_task()
 def handle_celery_match_result(matches: list[list[any]], config: dict[str, any]):
     """
     Create Comparison instances from matchlib results and update max similarities of the submission pairs.
-    If the exercise with an id given in 'matches' has a different timestamp than the 'matches' object,
-    all results will be discarded.
+    The batch that completes last finalizes the matching run of the exercise.
     """
 
     exercise_name = config.get("exercise_name")
@@ -239,41 +764,30 @@ def handle_celery_match_result(matches: list[list[any]], config: dict[str, any])
         f" | {exercise_name} | {course_name}"
     )
 
-    for match in matches:
-        # Get keys for the matchlib results
-        id_a = match[0]
-        id_b = match[1]
-        matches_json = match[2]
-        similarity_a = match[3]
-        similarity_b = match[4]
-
-        a = Submission.objects.get(pk=id_a)
-        b = Submission.objects.get(pk=id_b)
-        if a != b and a.student != b.student:
+    start = time.perf_counter()
+    try:
+        submissions_updated = matcher.store_match_results(matches)
+        elapsed = time.perf_counter() - start
 
-            logger.info(
-                f"Handling match result for: {a.id} & {b.id}" +
+        logger.info(
+            f"Match results processed for {len(submissions_updated)} submissions" +
+            f" | {exercise_name} | {course_name}"
+        )
+        if elapsed > config.get("slow_batch_seconds", 60):
+            logger.warning(
+                f"Storing a batch of {len(matches)} match results took {elapsed:.1f} seconds" +
                 f" | {exercise_name} | {course_name}"
             )
-
-            # Create Comparison instances for both submissions
-            Comparison.objects.create(
-                submission_a=a,
-                submission_b=b,
-                similarity=similarity_a,
-                matches_json=matches_json,
-            )
-            Comparison.objects.create(
-                submission_a=b,
-                submission_b=a,
-                similarity=similarity_b,
-                matches_json=swap_positions(matches_json),
+    finally:
+        # A failed batch is counted as well, so that the matching run is not left unfinished
+        if _update_run(config, batches_completed=F("batches_completed") + 1):
+            _finalize_if_completed(config)
+        else:
+            logger.warning(
+                f"Matching run {config['matching_start_time']} has no batch counter, not counting this result batch"
+                + f" | {exercise_name} | {course_name}"
             )
 
-            # Update max similarity for both submissions
-            matcher.update_submission(a, similarity_a, b)
-            matcher.update_submission(b, similarity_b, a)
-
 
 #https://stackoverflow.com/questions/312443/how-do-i-split-a-list-into-equally-sized-chunks
 def chunks(lst, n):
@@ -1,16 +1,22 @@
-from gst import match as match_c_ext
+from gst import (
+    match as match_c_ext,
+    match_all as match_all_c_ext,
+    match_packed as match_packed_c_ext,
+    match_pairs as match_pairs_c_ext,
+    match_suffix_array as match_suffix_array_c_ext,
+)
 
-from ..matchlib.util import TokenMatch, TokenMatchSet
+from ..matchlib.util import TokenMatchSet, pack_mark_string
 
 
 def greedy_string_tiling(tokens_a, marks_a, tokens_b, marks_b, min_length):
     """
     Wrapper of the C++ extension gst.match,
     which implements the Running Karp-Rabin Greedy String Tiling algorithm by Michael J. Wise.
+    Marks can be given either as strings of ASCII zeros and ones, or as packed bitsets.
     """
-    matches = TokenMatchSet()
     if len(tokens_a) < min_length or len(tokens_b) < min_length:
-        return matches
+        return TokenMatchSet()
 
     # Choose the shorter token string to be the pattern and the longer as text
     reverse = len(tokens_b) < len(tokens_a)
@@ -19,11 +25,89 @@ def greedy_string_tiling(tokens_a, marks_a, tokens_b, marks_b, min_length):
     pattern_marks = marks_b if reverse else marks_a
     text_marks = marks_a if reverse else marks_b
 
-    match_list = match_c_ext(pattern, pattern_marks, text, text_marks, min_length)
+    if isinstance(pattern_marks, str) and isinstance(text_marks, str):
+        match_list = match_c_ext(pattern, pattern_marks, text, text_marks, min_length)
+    else:
+        if isinstance(pattern_marks, str):
+            pattern_marks = pack_mark_string(pattern_marks)
+        if isinstance(text_marks, str):
+            text_marks = pack_mark_string(text_marks)
+        match_list = match_packed_c_ext(pattern, pattern_marks, text, text_marks, min_length)
 
     if reverse:
-        matches.store = [TokenMatch(match[1], match[0], match[2]) for match in match_list]
-    else:
-        matches.store = [TokenMatch(*match) for match in match_list]
+        return TokenMatchSet(value for match in match_list for value in (match[1], match[0], match[2]))
+    return TokenMatchSet(value for match in match_list for value in match)
+
+
+def suffix_array_tiling(tokens_a, marks_a, tokens_b, marks_b, min_length):
+    """
+    Wrapper of the C++ extension gst.match_suffix_array,
+    which finds greedy string tiles from a suffix array and LCP array of both token strings
+    instead of repeated Karp-Rabin hashing passes.
+    Takes the same arguments and returns the same kind of TokenMatchSet as greedy_string_tiling.
+    """
+    if len(tokens_a) < min_length or len(tokens_b) < min_length:
+        return TokenMatchSet()
+
+    if isinstance(marks_a, str):
+        marks_a = pack_mark_string(marks_a)
+    if isinstance(marks_b, str):
+        marks_b = pack_mark_string(marks_b)
+    match_list = match_suffix_array_c_ext(tokens_a, marks_a, tokens_b, marks_b, min_length)
+    return TokenMatchSet(value for match in match_list for value in match)
+
+
+def greedy_string_tiling_pairs(tokens, marks, pairs, min_length, threads=1, max_probes=0, max_milliseconds=0):
+    """
+    Wrapper of the C++ extension gst.match_pairs, which matches many pairs of token strings with a single call.
+    The pairs are matched without holding the GIL on the given amount of native threads, 0 using all cores.
+    Given lists of token strings and their marks, and a list of index pairs (i, j) to the token strings,
+    return a list of TokenMatchSets with the matches of each pair, where the first index of a match is in tokens[i].
+    Matching a pair stops after max_probes hash table probes or max_milliseconds, if non-zero,
+    in which case the TokenMatchSet of the pair contains the matches found so far and is flagged partial.
+    """
+    packed_marks = [pack_mark_string(m) if isinstance(m, str) else m for m in marks]
+    counts, tiles, partial = match_pairs_c_ext(
+        tokens, packed_marks, pairs, min_length, threads, max_probes, max_milliseconds
+    )
+    # The extension returns the tile count of each pair and the tiles of all pairs as native uint32 triples
+    counts = memoryview(counts).cast("I")
+    tiles = memoryview(tiles).cast("I")
+
+    pair_matches = []
+    begin = 0
+    for count, is_partial in zip(counts, partial):
+        end = begin + 3 * count
+        matches = TokenMatchSet.from_buffer(tiles[begin:end])
+        matches.partial = bool(is_partial)
+        pair_matches.append(matches)
+        begin = end
+    return pair_matches
+
+
+def suffix_array_tiling_all(tokens, marks, min_length, first_count=None, max_matches=0):
+    """
+    Wrapper of the C++ extension gst.match_all, which matches all pairs of token strings at once
+    from one generalized suffix array of all token strings instead of comparing each pair separately.
+    Given lists of token strings and their marks, return a dict from index pairs (i, j), i < j and i < first_count,
+    to TokenMatchSets with the matches of the pair, where the first index of a match is in tokens[i].
+    Pairs without matches are left out.
+    Return None if there were more than max_matches maximal matches between the token strings, if non-zero.
+    """
+    packed_marks = [pack_mark_string(m) if isinstance(m, str) else m for m in marks]
+    if first_count is None:
+        first_count = len(tokens)
+    result = match_all_c_ext(tokens, packed_marks, min_length, first_count, max_matches)
+    if result is None:
+        return None
+    # The extension returns the pairs as native uint32 triples (i, j, tile count) and the tiles of all pairs
+    pairs = memoryview(result[0]).cast("I")
+    tiles = memoryview(result[1]).cast("I")
 
-    return matches
+    pair_matches = {}
+    begin = 0
+    for k in range(0, len(pairs), 3):
+        end = begin + 3 * pairs[k + 2]
+        pair_matches[(pairs[k], pairs[k + 1])] = TokenMatchSet.from_buffer(tiles[begin:end])
+        begin = end
+    return pair_matches
@@ -0,0 +1,177 @@
+"""
+Persistent cache of the matches of submission pairs across matching runs.
+
+The matches of a pair of token strings depend only on the tokens and marks of both token strings,
+the minimum match length and the match algorithm.
+The matches are stored in an SQLite file under a key derived from these,
+so that a pair is not compared again when the submissions of an exercise are recompared,
+e.g. after adding a new submission or after clearing all matches of the exercise.
+Similarities are not stored, since they are computed from the matches and the authored token counts.
+
+The cache holds at most a given amount of pairs, evicting the least recently used pairs first,
+and counts the hits and misses of all lookups. Lookups only read the database,
+their counters and usage times are written together with the next stored pairs.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from ..matchlib.util import TokenMatchSet, marks_of, pack_mark_string
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pairs (key BLOB PRIMARY KEY, tiles BLOB NOT NULL, used REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS pairs_used ON pairs (used);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO counters (name, value) VALUES ('hits', 0), ('misses', 0);
+"""
+
+# Amount of keys in one query, below the default limit of SQLite host parameters
+QUERY_SIZE = 500
+
+# Open caches by path, the connections are opened separately in each thread and process
+_caches = {}
+
+
+def content_digest(string_data):
+    """
+    Return the SHA-256 digest of the tokens and marks of a string data dict, stored in the dict for later calls.
+    Marks given as strings or as packed bitsets give the same digest.
+    """
+    digest = string_data.get("content_digest")
+    if digest is None:
+        marks = marks_of(string_data)
+        if isinstance(marks, str):
+            marks = pack_mark_string(marks)
+        tokens = string_data["tokens"].encode("utf-8")
+        content = hashlib.sha256(len(tokens).to_bytes(8, "little"))
+        content.update(tokens)
+        # Trailing zero bytes mark no tokens
+        content.update(bytes(marks).rstrip(b"\0"))
+        digest = string_data["content_digest"] = content.digest()
+    return digest
+
+
+def open_cache(path, max_entries):
+    """
+    Return the pair cache stored in the SQLite file at path, holding at most max_entries pairs if non-zero.
+    """
+    cache = _caches.get(path)
+    if cache is None or cache.max_entries != max_entries:
+        cache = _caches[path] = PairCache(path, max_entries)
+    return cache
+
+
+class PairCache:
+
+    def __init__(self, path, max_entries=0):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _connection(self):
+        # SQLite connections must not be shared between threads or inherited by forked worker processes
+        if getattr(self._local, "pid", None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit mode, transactions are started explicitly
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            # Concurrent workers can read while one of them is writing
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            # Pairs are counted in the counters table, which is initialized once from the pairs of an older cache
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                if connection.execute("SELECT 1 FROM counters WHERE name = 'entries'").fetchone() is None:
+                    connection.execute("INSERT INTO counters (name, value) SELECT 'entries', COUNT(*) FROM pairs")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+            # Lookups not yet written by put_many
+            self._local.used, self._local.hits, self._local.misses = [], 0, 0
+        return self._local.connection
+
+    @staticmethod
+    def key(string_data_a, string_data_b, minimum_match_length, algorithm):
+        """
+        Return the cache key of comparing string data a to string data b.
+        """
+        key = hashlib.sha256(content_digest(string_data_a))
+        key.update(content_digest(string_data_b))
+        key.update(f"{minimum_match_length}:{algorithm}".encode("utf-8"))
+        return key.digest()
+
+    def get_many(self, keys):
+        """
+        Return a dict from the keys found in the cache to their TokenMatchSets.
+        The hits and misses are counted and the found pairs marked used only by the next put_many of this thread,
+        so that looking up pairs does not take the write lock of the database.
+        """
+        found = {}
+        connection = self._connection()
+        for begin in range(0, len(keys), QUERY_SIZE):
+            chunk = keys[begin:begin + QUERY_SIZE]
+            parameters = ",".join("?" * len(chunk))
+            for key, tiles in connection.execute(f"SELECT key, tiles FROM pairs WHERE key IN ({parameters})", chunk):
+                found[key] = _decode_tiles(tiles)
+        self._local.used.extend(found)
+        self._local.hits += len(found)
+        self._local.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """
+        Store the TokenMatchSets of a list of (key, TokenMatchSet) pairs, update the pairs used and the counters
+        of the lookups since the last call, and evict the least recently used pairs exceeding the maximum amount
+        of pairs.
+        """
+        local = self._local
+        connection = self._connection()
+        if not items and not local.used and not local.misses:
+            return
+        now = time.time()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            for begin in range(0, len(local.used), QUERY_SIZE):
+                chunk = local.used[begin:begin + QUERY_SIZE]
+                parameters = ",".join("?" * len(chunk))
+                connection.execute(f"UPDATE pairs SET used = ? WHERE key IN ({parameters})", (now, *chunk))
+            # The tiles of a key never change, so existing pairs are kept
+            inserted = connection.executemany(
+                "INSERT OR IGNORE INTO pairs (key, tiles, used) VALUES (?, ?, ?)",
+                ((key, _encode_tiles(matches), now) for key, matches in items),
+            ).rowcount
+            connection.executemany(
+                "UPDATE counters SET value = value + ? WHERE name = ?",
+                ((local.hits, "hits"), (local.misses, "misses"), (inserted, "entries")),
+            )
+            if self.max_entries > 0:
+                excess = self._count(connection, "entries") - self.max_entries
+                if excess > 0:
+                    # Evict a tenth more than needed, so that pairs are not evicted on every call
+                    deleted = connection.execute(
+                        "DELETE FROM pairs WHERE key IN (SELECT key FROM pairs ORDER BY used LIMIT ?)",
+                        (excess + self.max_entries // 10,),
+                    ).rowcount
+                    connection.execute("UPDATE counters SET value = value - ? WHERE name = 'entries'", (deleted,))
+        local.used, local.hits, local.misses = [], 0, 0
+
+    def stats(self):
+        """
+        Return a dict with the total amount of hits and misses, and the amount of cached pairs.
+        The lookups are counted once the thread has stored its next pairs.
+        """
+        return dict(self._connection().execute("SELECT name, value FROM counters"))
+
+    @staticmethod
+    def _count(connection, name):
+        return connection.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+
+
+def _encode_tiles(matches):
+    return matches.tiles.tobytes()
+
+
+def _decode_tiles(tiles):
+    return TokenMatchSet.from_buffer(tiles)
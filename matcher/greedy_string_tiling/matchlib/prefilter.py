@@ -0,0 +1,103 @@
+"""
+Similarity pre-filter using sparse n-gram count vectors.
+
+Greedy string tiling only tiles authored, i.e. unmarked, tokens with tiles of at least the minimum match length m.
+Every tile of length L contains L - n + 1 n-grams of a token string and the same n-grams of the other token string,
+so the amount of tiled tokens T of a pair is bounded by the amount of shared n-gram occurrences S:
+
+    T <= S * m / (m - n + 1),  where  S = sum over n-grams g of min(count_a(g), count_b(g)),  n <= m
+
+S is computed for all pairs at once as a sparse matrix product.
+Every n-gram g that occurs c times in a token string is a column (g, t) for each level t = 1..c,
+such that the dot product of the binary rows of two token strings is exactly the sum of minimum counts.
+
+Pairs whose bound of similarity cannot exceed the minimum similarity would be discarded after matching,
+so they need not be matched at all.
+NumPy and SciPy are optional, without them no pairs are filtered.
+"""
+import collections
+
+from ..matchlib.fingerprints import unmarked_segments
+from ..matchlib.util import marks_of
+
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
+
+
+def available():
+    """
+    Return True if NumPy and SciPy are installed.
+    """
+    return numpy is not None
+
+
+def ngram_counts(tokens, marks, ngram_length):
+    """
+    Return a Counter of all n-grams in the unmarked parts of a token string.
+    """
+    counts = collections.Counter()
+    for segment in unmarked_segments(tokens, marks):
+        counts.update(segment[i:i + ngram_length] for i in range(len(segment) - ngram_length + 1))
+    return counts
+
+
+def shared_token_bounds(string_data, minimum_match_length, ngram_length=5):
+    """
+    Given a list of string data dicts, return a sparse upper triangular matrix in COO format,
+    where the element (i, j), i < j, is an upper bound of the amount of tokens greedy string tiling can match
+    between string data i and j. Pairs without elements have no matches.
+    """
+    ngram_length = max(1, min(ngram_length, minimum_match_length))
+    columns = {}
+    rows = []
+    cols = []
+    for row, data in enumerate(string_data):
+        for ngram, count in ngram_counts(data["tokens"], marks_of(data), ngram_length).items():
+            for level in range(count):
+                rows.append(row)
+                cols.append(columns.setdefault((ngram, level), len(columns)))
+    levels = scipy.sparse.csr_matrix(
+        (numpy.ones(len(rows), dtype=numpy.int32), (rows, cols)),
+        shape=(len(string_data), len(columns)),
+    )
+    shared = scipy.sparse.triu(levels @ levels.T, k=1).tocoo()
+
+    # Every tile of length L >= m contains L - n + 1 shared n-grams
+    authored = numpy.array([data["authored_token_count"] for data in string_data], dtype=numpy.int64)
+    bounds = numpy.minimum(
+        shared.data.astype(numpy.int64) * minimum_match_length // (minimum_match_length - ngram_length + 1),
+        numpy.minimum(authored[shared.row], authored[shared.col]),
+    )
+    return scipy.sparse.coo_matrix((bounds, (shared.row, shared.col)), shape=shared.shape)
+
+
+def similar_pairs(string_data, minimum_match_length, minimum_similarity, ngram_length=5):
+    """
+    Given a list of string data dicts, return a sorted list of index pairs (i, j), i < j,
+    of all string data pairs that might be more similar than minimum_similarity after greedy string tiling.
+    Pairs with equal checksums are always included, since they are given a full match without tiling.
+    """
+    bounds = shared_token_bounds(string_data, minimum_match_length, ngram_length)
+    authored = numpy.array([data["authored_token_count"] for data in string_data], dtype=numpy.float64)
+
+    # Same comparison as for the similarities of matched pairs, the similarity of no authored tokens being 0
+    def bound_similarity(index):
+        counts = authored[index]
+        return numpy.divide(bounds.data, counts, out=numpy.zeros(len(counts)), where=counts > 0)
+
+    similar_a = bound_similarity(bounds.row) > minimum_similarity
+    similar_b = bound_similarity(bounds.col) > minimum_similarity
+    similar = similar_a | similar_b
+    pairs = set(zip(bounds.row[similar].tolist(), bounds.col[similar].tolist()))
+
+    by_checksum = collections.defaultdict(list)
+    for i, data in enumerate(string_data):
+        if "checksum" in data:
+            by_checksum[data["checksum"]].append(i)
+    for indexes in by_checksum.values():
+        pairs.update((i, j) for n, i in enumerate(indexes) for j in indexes[n + 1:])
+
+    return sorted(pairs)
@@ -0,0 +1,104 @@
+"""
+Content-addressed token store for sharing string data between Radar and matchlib workers.
+
+Instead of sending the string data of all submissions in the message of a matching task,
+the string data of every submission is written once into a blob named by its checksum
+in a directory that is shared by Radar and the matchlib workers.
+Each matching run has a manifest listing its blobs, and the task message carries only a reference to the manifest.
+Blobs of unchanged submissions are reused by later matching runs.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+
+def _write_atomic(path, content):
+    """
+    Write bytes into path, such that concurrent readers never see a partially written file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _blob_path(directory, digest):
+    return os.path.join(directory, "blobs", digest[:2], digest + ".json")
+
+
+def _manifest_path(reference):
+    run_key = reference["matching_start_time"].replace(":", "-")
+    return os.path.join(reference["directory"], "runs", str(reference["exercise_id"]), run_key + ".json")
+
+
+def write_run(directory, exercise_id, matching_start_time, string_data):
+    """
+    Write string data of a matching run into the store and return a JSON serializable reference to the run.
+    """
+    digests = []
+    for data in string_data:
+        content = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(content).hexdigest()
+        path = _blob_path(directory, digest)
+        if os.path.exists(path):
+            # Refresh the modification time to prevent pruning a blob that is still in use
+            os.utime(path)
+        else:
+            _write_atomic(path, content)
+        digests.append(digest)
+    reference = {
+        "directory": directory,
+        "exercise_id": exercise_id,
+        "matching_start_time": matching_start_time,
+    }
+    _write_atomic(_manifest_path(reference), json.dumps(digests).encode("utf-8"))
+    return reference
+
+
+def read_run(reference):
+    """
+    Return the list of string data of a matching run written with write_run.
+    """
+    with open(_manifest_path(reference), "rb") as f:
+        digests = json.load(f)
+    string_data = []
+    for digest in digests:
+        with open(_blob_path(reference["directory"], digest), "rb") as f:
+            string_data.append(json.load(f))
+    return string_data
+
+
+def delete_run(reference):
+    """
+    Delete the manifest of a matching run. The blobs are left for later runs and removed by prune_blobs.
+    """
+    try:
+        os.unlink(_manifest_path(reference))
+    except FileNotFoundError:
+        pass
+
+
+def prune_blobs(directory, max_age):
+    """
+    Delete all blobs that have not been written or reused in max_age seconds.
+    Return the amount of deleted blobs.
+    """
+    deleted = 0
+    oldest_allowed = time.time() - max_age
+    for root, _, file_names in os.walk(os.path.join(directory, "blobs")):
+        for file_name in file_names:
+            path = os.path.join(root, file_name)
+            try:
+                if os.stat(path).st_mtime < oldest_allowed:
+                    os.unlink(path)
+                    deleted += 1
+            except FileNotFoundError:
+                continue
+    return deleted
@@ -1,5 +1,5 @@
 import celery
-from ..matchlib import matcher
+from ..matchlib import matcher, store
 
 logger = celery.utils.log.get_task_logger(__name__)
 
@@ -7,10 +7,18 @@ logger = celery.utils.log.get_task_logger(__name__)
 
 @celery.shared_task
 def match_all_combinations(config, string_data_iter, delay=False):
+    """
+    Match all combinations of string data.
+    If string_data_iter is None, the string data is read from the token store referenced by config["token_store"].
+    """
     logger.info("Got match all combinations task")
 
     matches = []
 
+    if string_data_iter is None:
+        string_data_iter = store.read_run(config["token_store"])
+        store.delete_run(config["token_store"])
+
     if delay:
         matcher.match_all_combinations(config, string_data_iter, delay=delay)
     else:
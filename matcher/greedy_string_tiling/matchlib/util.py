@@ -1,55 +1,189 @@
-import json
+import array
+import base64
+import bisect
+import itertools
+import operator
+import sys
+import zlib
+
+
+def pack_marks(spans, length):
+    """
+    Return a packed bitset of token marks for a token string of given length,
+    where all tokens in the (start, span_length) pairs of spans are marked.
+    The mark of token i is the bit i % 8 of byte i // 8.
+    """
+    bits = 0
+    for start, span_length in spans:
+        bits |= ((1 << span_length) - 1) << start
+    return bits.to_bytes((length + 7) // 8, "little")
+
+
+def pack_mark_string(marks):
+    """
+    Return a packed bitset of token marks given as a string of ASCII zeros and ones.
+    """
+    return int(marks[::-1] or "0", 2).to_bytes((len(marks) + 7) // 8, "little")
+
+
+def unpack_marks(packed, length):
+    """
+    Return a packed bitset of token marks as a string of ASCII zeros and ones for a token string of given length.
+    """
+    return format(int.from_bytes(packed, "little"), "b")[::-1].ljust(length, "0")[:length]
+
+
+def pack_int_rows(rows, width):
+    """
+    Return a compact bitstring of a list of rows of width integers,
+    e.g. [start, end] source indexes of tokens or [a, b, length] matches.
+    Each column is delta encoded, since the indexes are mostly increasing,
+    and the columns are stored one after another as little-endian 32-bit integers compressed with zlib.
+    """
+    deltas = array.array("i")
+    for column in range(width):
+        previous = 0
+        for row in rows:
+            deltas.append(row[column] - previous)
+            previous = row[column]
+    if sys.byteorder == "big":
+        deltas.byteswap()
+    return zlib.compress(deltas.tobytes())
+
+
+def unpack_int_rows(packed, width):
+    """
+    Return the list of rows of width integers packed with pack_int_rows.
+    """
+    deltas = array.array("i")
+    deltas.frombytes(zlib.decompress(packed))
+    if sys.byteorder == "big":
+        deltas.byteswap()
+    count = len(deltas) // width
+    columns = (itertools.accumulate(deltas[c * count:(c + 1) * count]) for c in range(width))
+    return [list(row) for row in zip(*columns)]
+
+
+def marks_of(string_data):
+    """
+    Return the ignore marks of a string data dict, either as a packed bitset or as a string of ASCII zeros and ones.
+    Base64 encoded packed marks are decoded in place.
+    If the string data has no marks, return an empty string, i.e. no tokens are marked.
+    """
+    packed = string_data.get("packed_ignore_marks")
+    if packed is None:
+        return string_data.get("ignore_marks", "")
+    if isinstance(packed, str):
+        packed = string_data["packed_ignore_marks"] = base64.b64decode(packed)
+    return packed
 
 
 class TokenMatchSet:
+    """
+    Matches of a pair of token strings, stored as a flat array of unsigned (a, b, length) triples
+    instead of an object for each match.
+    The matches of greedy string tiling never overlap, so overlaps with the matches are checked
+    by binary searches over the matches sorted by their starts in either token string.
+    """
+    __slots__ = ("tiles", "partial", "_intervals")
+
+    def __init__(self, tiles=()):
+        self.tiles = array.array("I", tiles)
+        # True if matching was stopped by a work budget before all matches were found
+        self.partial = False
+        # Sorted starts and ends of the matches in both token strings, built when first needed
+        self._intervals = None
 
-    def __init__(self):
-        self.store = []
+    @classmethod
+    def from_buffer(cls, buffer):
+        """
+        Return a TokenMatchSet of the (a, b, length) triples in a buffer of native unsigned 32-bit integers.
+        """
+        matches = cls()
+        matches.tiles.frombytes(memoryview(buffer).cast("B"))
+        return matches
 
     def extend(self, match_set):
-        self.store.extend(match_set.store)
+        self.tiles.extend(match_set.tiles)
+        self._intervals = None
 
     def add(self, match):
-        self.store.append(match)
+        self.tiles.extend((match.a, match.b, match.length))
+        self._intervals = None
 
     def add_non_overlapping(self, match):
-        if any(match.overlaps(m) for m in self.store):
+        if self._intervals is None:
+            self._intervals = (
+                _SortedIntervals(self.tiles[0::3], self.tiles[2::3]),
+                _SortedIntervals(self.tiles[1::3], self.tiles[2::3]),
+            )
+        intervals_a, intervals_b = self._intervals
+        if intervals_a.overlaps(match.a, match.length) or intervals_b.overlaps(match.b, match.length):
             return False
-        self.store.append(match)
+        intervals_a.insert(match.a, match.length)
+        intervals_b.insert(match.b, match.length)
+        self.tiles.extend((match.a, match.b, match.length))
         return True
 
     def clear(self):
-        del self.store[:]
+        del self.tiles[:]
+        self._intervals = None
 
     def all(self):
-        return self.store
+        return [TokenMatch(*match) for match in self._triples()]
 
     def reverse(self):
-        r = TokenMatchSet()
-        r.store.extend(m.reversed() for m in self.store)
+        r = TokenMatchSet(self.tiles)
+        r.tiles[0::3], r.tiles[1::3] = self.tiles[1::3], self.tiles[0::3]
         return r
 
     def match_count(self):
-        return len(self.store)
+        return len(self.tiles) // 3
 
     def token_count(self):
-        return sum(m.length for m in self.store)
+        return sum(self.tiles[2::3])
 
     def json(self):
-        sorted_match_list = [[m.a, m.b, m.length] for m in sorted(self.store, key=lambda m: m.a)]
-        return json.dumps(sorted_match_list, separators=(",", ":"))
+        return "[" + ",".join(f"[{a},{b},{length}]" for a, b, length in self._sorted_triples()) + "]"
 
     def match_list(self):
-        return [[m.a, m.b, m.length] for m in sorted(self.store, key=lambda m: m.a)]
+        return [list(match) for match in self._sorted_triples()]
+
+    def _triples(self):
+        return zip(self.tiles[0::3], self.tiles[1::3], self.tiles[2::3])
+
+    def _sorted_triples(self):
+        return sorted(self._triples(), key=operator.itemgetter(0))
 
     @classmethod
     def full_match_from_length(cls, length):
-        ms = cls()
-        ms.add_non_overlapping(TokenMatch(0, 0, length))
-        return ms
+        return cls((0, 0, length))
+
+
+class _SortedIntervals:
+    """
+    Non-overlapping intervals of tokens in one token string, sorted by their starts.
+    """
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, starts, lengths):
+        intervals = sorted(zip(starts, lengths))
+        self.starts = [start for start, _ in intervals]
+        self.ends = [start + length for start, length in intervals]
+
+    def overlaps(self, start, length):
+        i = bisect.bisect_right(self.starts, start)
+        # Only the intervals starting just before and after the start can overlap
+        return (i > 0 and self.ends[i - 1] > start) or (i < len(self.starts) and self.starts[i] < start + length)
+
+    def insert(self, start, length):
+        i = bisect.bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, start + length)
 
 
 class TokenMatch:
+    __slots__ = ("a", "b", "length")
 
     def __init__(self, a, b, length):
         self.a = a
@@ -57,9 +191,9 @@ class TokenMatch:
         self.length = length
 
     def overlaps(self, another):
-        return ((self.a > another.a - self.length and self.a < another.a + self.length)
+        return ((self.a < another.a + another.length and another.a < self.a + self.length)
                 or
-                (self.b > another.b - self.length and self.b < another.b + self.length))
+                (self.b < another.b + another.length and another.b < self.b + self.length))
 
     def reversed(self):
         return TokenMatch(self.b, self.a, self.length)
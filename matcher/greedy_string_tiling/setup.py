@@ -63,6 +63,7 @@ gstmodule = setuptools.Extension(
     sources=[
         # Implementation
         os.path.join('src', 'gst.cpp'),
+        os.path.join('src', 'suffix_array.cpp'),
         # CPython wrapper
         os.path.join('src', 'gstmodule.cpp'),
     ],
@@ -70,13 +71,14 @@ gstmodule = setuptools.Extension(
         "include",
         os.path.join(THIRD_PARTY_DIR, "rollinghashcpp")
     ],
-    extra_compile_args=["--std=c++14"],
+    extra_compile_args=["--std=c++14", "-pthread"],
+    extra_link_args=["-pthread"],
 )
 
 
 setuptools.setup(
     name='greedy_string_tiling',
-    version='0.13.0',
+    version='0.17.0',
     description='C++ implementation of the Greedy String Tiling string matching algorithm.',
     long_description=readme_file_contents,
     url='https://github.com/apluslms/greedy-string-tiling',
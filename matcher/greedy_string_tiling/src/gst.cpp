@@ -1,5 +1,12 @@
 #include <algorithm>
-#include <unordered_map>
+#include <atomic>
+#include <chrono>
+#include <cstdint>
+#include <exception>
+#include <limits>
+#include <mutex>
+#include <system_error>
+#include <thread>
 #include "gst.hpp"
 #include "cyclichash.h"
 
@@ -14,6 +21,11 @@ inline bool is_a_match(const Token& pattern_tok, const Token& text_tok) noexcept
 }
 
 
+inline bool have_equal_chars(const Token& pattern_tok, const Token& text_tok) noexcept {
+    return pattern_tok.chr == text_tok.chr;
+}
+
+
 inline bool all_tokens_match(const Match& match) noexcept {
     auto pattern_it = match.pattern_it;
     auto text_it = match.text_it;
@@ -26,8 +38,163 @@ inline bool all_tokens_match(const Match& match) noexcept {
 }
 
 
+/*
+ * Reusable, flat open-addressing hash table from hash values of text substrings to their starting positions.
+ * Positions with equal hash values are chained in the order of insertion.
+ * The table is cleared in constant time by invalidating all slots with a new generation number,
+ * and its memory is reused when matching the next search length or the next pair of strings.
+ */
 template<class T>
-inline T scanpatterns(Tokens& pattern_marks, Tokens& text_marks, Matches& matches, const T& search_length) noexcept {
+class PositionTable {
+public:
+    static constexpr std::uint32_t npos = std::numeric_limits<std::uint32_t>::max();
+
+    /*
+     * Remove all positions and make room for position_count positions.
+     */
+    void reset(std::size_t position_count) {
+        // Keep the load factor at most 1/2 to keep the probe sequences short
+        std::size_t capacity = slots.empty() ? 16u : slots.size();
+        while (capacity < 2 * position_count) {
+            capacity <<= 1;
+        }
+        if (capacity != slots.size()) {
+            slots.assign(capacity, Slot());
+            generation = 0;
+            shift = 64u;
+            for (auto c = capacity; c > 1; c >>= 1) {
+                --shift;
+            }
+        }
+        if (next_positions.size() < position_count) {
+            next_positions.resize(position_count);
+        }
+        if (++generation == 0) {
+            // Generation number wrapped around, invalidate all slots explicitly
+            std::fill(slots.begin(), slots.end(), Slot());
+            generation = 1;
+        }
+    }
+
+    void insert(const T& hash, std::uint32_t position) noexcept {
+        auto& slot = slots[find_slot(hash)];
+        if (slot.generation != generation) {
+            slot = { hash, generation, position, position };
+        } else {
+            next_positions[slot.last] = position;
+            slot.last = position;
+        }
+        next_positions[position] = npos;
+    }
+
+    /*
+     * Return the first position with the given hash value, or npos if there are none.
+     */
+    std::uint32_t first(const T& hash) const noexcept {
+        const auto& slot = slots[find_slot(hash)];
+        return slot.generation == generation ? slot.first : npos;
+    }
+
+    /*
+     * Return the position following the given position with the same hash value, or npos if there are none.
+     */
+    std::uint32_t next(std::uint32_t position) const noexcept {
+        return next_positions[position];
+    }
+
+private:
+    struct Slot {
+        T hash = 0;
+        std::uint32_t generation = 0;
+        std::uint32_t first = npos;
+        std::uint32_t last = npos;
+    };
+
+    std::vector<Slot> slots;
+    std::vector<std::uint32_t> next_positions;
+    std::uint32_t generation = 0;
+    unsigned shift = 64u;
+
+    /*
+     * Return the index of the slot of the given hash value, or the index of a free slot if the hash value is not found.
+     */
+    std::size_t find_slot(const T& hash) const noexcept {
+        // Fibonacci hashing spreads the hash values over the slots, linear probing resolves collisions
+        const std::size_t mask = slots.size() - 1;
+        std::size_t i = static_cast<std::size_t>((static_cast<std::uint64_t>(hash) * 0x9E3779B97F4A7C15ull) >> shift);
+        while (slots[i].generation == generation and slots[i].hash != hash) {
+            i = (i + 1) & mask;
+        }
+        return i;
+    }
+};
+
+
+/*
+ * Memory reused by all calls to match_strings in the same thread.
+ */
+struct Workspace {
+    PositionTable<match_length_t> text_positions;
+    // Amount of marked tokens before each position, for checking in constant time if a substring has marked tokens
+    std::vector<std::uint32_t> pattern_marked_before;
+    std::vector<std::uint32_t> text_marked_before;
+};
+
+
+/*
+ * Keeps track of the work spent on matching one pair of strings against a MatchBudget.
+ */
+class WorkLimit {
+public:
+    explicit WorkLimit(const MatchBudget& budget) :
+        budget(budget),
+        deadline(std::chrono::steady_clock::now() + std::chrono::milliseconds(budget.max_milliseconds)) {}
+
+    /*
+     * Spend the given amount of hash table probes and return false if the budget has been exceeded.
+     */
+    inline bool spend(std::uint64_t probe_count) noexcept {
+        probes += probe_count;
+        if (budget.max_probes > 0 and probes > budget.max_probes) {
+            exhausted = true;
+        } else if (budget.max_milliseconds > 0 and probes >= next_clock_check) {
+            // Reading the clock is expensive compared to a probe, so it is read only every 1024 probes
+            next_clock_check = probes + 1024u;
+            exhausted = exhausted or std::chrono::steady_clock::now() >= deadline;
+        }
+        return not exhausted;
+    }
+
+    inline bool is_exhausted() const noexcept {
+        return exhausted;
+    }
+
+private:
+    const MatchBudget budget;
+    const std::chrono::steady_clock::time_point deadline;
+    std::uint64_t probes = 0;
+    std::uint64_t next_clock_check = 0;
+    bool exhausted = false;
+};
+
+
+inline void count_marks(const Tokens& tokens, std::vector<std::uint32_t>& marked_before) {
+    marked_before.resize(tokens.size() + 1);
+    marked_before[0] = 0;
+    for (std::size_t i = 0; i < tokens.size(); ++i) {
+        marked_before[i + 1] = marked_before[i] + (tokens[i].mark ? 1u : 0u);
+    }
+}
+
+
+template<class T>
+inline T scanpatterns(
+        Tokens& pattern_marks,
+        Tokens& text_marks,
+        Matches& matches,
+        const T& search_length,
+        Workspace& workspace,
+        WorkLimit& limit) {
 
     // Create rolling hashers for pattern and text substrings of length search_length,
     // with hash value type T, hash value size of 32 bits,
@@ -35,92 +202,87 @@ inline T scanpatterns(Tokens& pattern_marks, Tokens& text_marks, Matches& matche
     CyclicHash<T> pattern_hasher(search_length, 1u, 2u, 32u);
     CyclicHash<T> text_hasher(search_length, 1u, 2u, 32u);
 
-    // Create a hash map of all text substring hashes,
-    // enabling constant time validation of pattern and text substring mismatches
-    std::unordered_map<T, std::vector<typename Tokens::iterator> > text_hash_to_positions;
-
     T maxmatch = 0;
 
-    // Forward to first unmarked text position
-    auto text_it_begin = std::find_if(text_marks.begin(), text_marks.end(), is_unmarked);
-
-    if (text_it_begin + search_length > text_marks.end()) {
-        // Too close to end of text, cannot create a match here
+    if (text_marks.size() < search_length or pattern_marks.size() < search_length) {
+        // Too short strings, cannot create a match here
         return maxmatch;
     }
 
+    // Count marks before each position, such that a substring [i, i + search_length) contains no marked tokens
+    // if and only if the counts at both ends are equal
+    count_marks(text_marks, workspace.text_marked_before);
+    count_marks(pattern_marks, workspace.pattern_marked_before);
+    const auto& text_marked_before = workspace.text_marked_before;
+    const auto& pattern_marked_before = workspace.pattern_marked_before;
+
+    // Create a hash table of all text substring hashes,
+    // enabling constant time validation of pattern and text substring mismatches
+    auto& text_positions = workspace.text_positions;
+    const std::size_t text_substring_count = text_marks.size() - search_length + 1;
+    text_positions.reset(text_substring_count);
+
     // Compute hash value for each possible unmarked substring of search_length in text and store its starting position
-    for (auto text_it = text_it_begin; text_it + search_length - 1 < text_marks.end(); ++text_it) {
-        if (text_it == text_it_begin) {
+    for (std::size_t i = 0; i < text_substring_count; ++i) {
+        if (i == 0) {
             // Initialize hash using first text range
-            for (auto it = text_it; it != text_it + search_length; ++it) {
-                text_hasher.eat(it->chr);
+            for (std::size_t j = 0; j < search_length; ++j) {
+                text_hasher.eat(text_marks[j].chr);
             }
         } else {
             // Update rolling hash
-            text_hasher.update((text_it - 1)->chr, (text_it + search_length - 1)->chr);
+            text_hasher.update(text_marks[i - 1].chr, text_marks[i + search_length - 1].chr);
         }
 
         // Skip all strings with at least 1 marked token
-        if (not std::all_of(text_it, text_it + search_length, is_unmarked)) {
+        if (text_marked_before[i + search_length] != text_marked_before[i]) {
             continue;
         }
 
-        const auto& text_hash_it = text_hash_to_positions.find(text_hasher.hashvalue);
-
-        if (text_hash_it == text_hash_to_positions.end()) {
-            // Hash value does not exist, create new vector with text iterator
-            std::vector<typename Tokens::iterator> v_it = { text_it };
-            text_hash_to_positions.emplace(text_hasher.hashvalue, v_it);
-        } else {
-            // Hash value exists, add new starting point for hashed substring
-            text_hash_it->second.push_back(text_it);
-        }
+        text_positions.insert(text_hasher.hashvalue, static_cast<std::uint32_t>(i));
     }
 
     // For each unmarked pattern character, try to find the longest matching substring
+    const std::size_t pattern_substring_count = pattern_marks.size() - search_length + 1;
+    for (std::size_t i = 0; i < pattern_substring_count; ++i) {
 
-    // Forward to first unmarked pattern position
-    auto pattern_it_begin = std::find_if(pattern_marks.begin(), pattern_marks.end(), is_unmarked);
-
-    if (pattern_it_begin + search_length > pattern_marks.end()) {
-        // Too close to end of pattern, cannot create a match here
-        return maxmatch;
-    }
-
-    // Starting at the first unmarked pattern character, iterate over rest of the pattern
-    for (auto pattern_it = pattern_it_begin; pattern_it + search_length - 1 < pattern_marks.end(); ++pattern_it) {
-
-        if (pattern_it == pattern_it_begin) {
+        if (i == 0) {
             // Initialize hash using first pattern range
-            pattern_hasher.reset();
-            for (auto it = pattern_it; it != pattern_it + search_length; ++it) {
-                pattern_hasher.eat(it->chr);
+            for (std::size_t j = 0; j < search_length; ++j) {
+                pattern_hasher.eat(pattern_marks[j].chr);
             }
         } else {
             // Update rolling hash
-            pattern_hasher.update((pattern_it - 1)->chr, (pattern_it + search_length - 1)->chr);
+            pattern_hasher.update(pattern_marks[i - 1].chr, pattern_marks[i + search_length - 1].chr);
         }
 
         // Skip all strings with at least 1 marked token
-        if (not std::all_of(pattern_it, pattern_it + search_length, is_unmarked)) {
+        if (pattern_marked_before[i + search_length] != pattern_marked_before[i]) {
             continue;
         }
 
-        // Check if there is a matching text range
-        const auto& text_hash_it = text_hash_to_positions.find(pattern_hasher.hashvalue);
-        if (text_hash_it == text_hash_to_positions.end()) {
-            // Mismatching hashes, no string match here
-            continue;
+        if (not limit.spend(1)) {
+            // Out of budget, return the matches found so far
+            return maxmatch;
         }
 
+        const auto pattern_it = pattern_marks.begin() + i;
+
         // Iterate over all text positions that share the hash value of current pattern hash
-        for (const auto& hash_it : text_hash_it->second) {
-            // As an optimization, assume there are no hash collisions and skip
-            // all characters in range [0, search_length)
-            // This assumption will be validated later in markarrays
+        for (auto position = text_positions.first(pattern_hasher.hashvalue);
+                position != PositionTable<T>::npos;
+                position = text_positions.next(position)) {
+            if (not limit.spend(1)) {
+                return maxmatch;
+            }
+            const auto text_it = text_marks.begin() + position;
+            // Different substrings may have equal hash values, skip the text position if the substrings differ.
+            // Both substrings are known to be unmarked.
+            if (not std::equal(pattern_it, pattern_it + search_length, text_it, have_equal_chars)) {
+                continue;
+            }
             auto pattern_jt = pattern_it + search_length;
-            auto text_jt = hash_it + search_length;
+            auto text_jt = text_it + search_length;
             T matching_chars = search_length;
 
             // Count the amount of consequtive, unmarked, matching characters
@@ -138,7 +300,7 @@ inline T scanpatterns(Tokens& pattern_marks, Tokens& text_marks, Matches& matche
                 return matching_chars;
             } else {
                 // Record a match
-                matches.push_back({ pattern_it, hash_it, matching_chars });
+                matches.push_back({ pattern_it, text_it, matching_chars });
                 maxmatch = std::max(maxmatch, matching_chars);
             }
         }
@@ -174,14 +336,19 @@ inline T markarrays(Tokens& pattern_marks, Tokens& text_marks, Matches& matches,
 
 
 Tiles match_strings(
-        const std::string& pattern,
-        const std::string& text,
+        const char* pattern,
+        std::size_t pattern_length,
+        const char* text,
+        std::size_t text_length,
         const match_length_t& init_search_length,
-        const std::string& init_pattern_marks,
-        const std::string& init_text_marks) noexcept {
+        const MarksView& init_pattern_marks,
+        const MarksView& init_text_marks,
+        const MatchBudget& budget,
+        bool& partial) {
 
     Tiles tiles;
-    if (pattern.size() < init_search_length || text.size() < init_search_length) {
+    partial = false;
+    if (pattern_length < init_search_length || text_length < init_search_length) {
         // Too short threshold for creating matches
         return tiles;
     }
@@ -189,33 +356,41 @@ Tiles match_strings(
     // Construct token strings with initial marks, assuming missing marks to be false
 
     Tokens pattern_marks;
-    pattern_marks.reserve(pattern.size());
-    for (auto i = 0u; i < pattern.size(); ++i) {
-        const auto& init_mark = (i < init_pattern_marks.size() and init_pattern_marks[i] == '1');
-        pattern_marks.push_back({ pattern[i], init_mark });
+    pattern_marks.reserve(pattern_length);
+    for (auto i = 0u; i < pattern_length; ++i) {
+        pattern_marks.push_back({ pattern[i], init_pattern_marks.is_marked(i) });
     }
 
     Tokens text_marks;
-    text_marks.reserve(text.size());
-    for (auto i = 0u; i < text.size(); ++i) {
-        const auto& init_mark = (i < init_text_marks.size() and init_text_marks[i] == '1');
-        text_marks.push_back({ text[i], init_mark });
+    text_marks.reserve(text_length);
+    for (auto i = 0u; i < text_length; ++i) {
+        text_marks.push_back({ text[i], init_text_marks.is_marked(i) });
     }
 
-    match_length_t length_of_tokens_tiled = 0u;
     match_length_t search_length = init_search_length;
 
-    // FIXME hack, for terminating loops on some pairs of input that cause infinite loops
-    match_length_t prev_length_of_tokens_tiled = 1u;
-    unsigned tiled_count_repeats = 0;
+    // Hash table and mark counts reused by all searches in this thread
+    static thread_local Workspace workspace;
+    WorkLimit limit(budget);
 
     Matches matches;
 
-    // Search for all matches of maximal length and longer than search_length
+    // Search for all matches of maximal length and longer than search_length.
+    // The loop terminates, since every match found by scanpatterns has been verified to be a real match of unmarked
+    // tokens: after increasing search_length to the length of a very long match, the next scan finds that match
+    // again and either increases search_length further, at most to the string length, or creates at least one tile.
+    // New tiles mark at least one unmarked token, and without new tiles search_length only decreases.
     while (search_length > 0 and search_length >= init_search_length) {
         matches.clear();
         // Find all matching substrings and their lengths, and push the data to matches
-        match_length_t maxmatch = scanpatterns(pattern_marks, text_marks, matches, search_length);
+        match_length_t maxmatch = scanpatterns(pattern_marks, text_marks, matches, search_length, workspace, limit);
+
+        if (limit.is_exhausted()) {
+            // Out of budget, keep the tiles of the verified matches found so far and stop
+            markarrays<match_length_t>(pattern_marks, text_marks, matches, tiles);
+            partial = true;
+            break;
+        }
 
         if (maxmatch > 2 * search_length) {
             // Found a very long match,
@@ -224,14 +399,8 @@ Tiles match_strings(
             continue;
         }
 
-        prev_length_of_tokens_tiled = length_of_tokens_tiled;
         // Create new tiles by marking all unmarked tokens that participate in a maximal match
-        length_of_tokens_tiled += markarrays<match_length_t>(pattern_marks, text_marks, matches, tiles);
-
-        // FIXME hack, terminate loop if the amount of tokens tiled stays the same for 10 iterations
-        if (length_of_tokens_tiled == prev_length_of_tokens_tiled && ++tiled_count_repeats > 10) {
-            break;
-        }
+        markarrays<match_length_t>(pattern_marks, text_marks, matches, tiles);
 
         if (search_length > 2 * init_search_length) {
             search_length >>= 1;
@@ -246,3 +415,109 @@ Tiles match_strings(
 }
 
 
+Tiles match_strings(
+        const char* pattern,
+        std::size_t pattern_length,
+        const char* text,
+        std::size_t text_length,
+        const match_length_t& init_search_length,
+        const MarksView& init_pattern_marks,
+        const MarksView& init_text_marks) {
+    bool partial;
+    return match_strings(
+            pattern, pattern_length,
+            text, text_length,
+            init_search_length,
+            init_pattern_marks,
+            init_text_marks,
+            MatchBudget(),
+            partial);
+}
+
+
+Tiles match_strings(
+        const std::string& pattern,
+        const std::string& text,
+        const match_length_t& init_search_length,
+        const std::string& init_pattern_marks,
+        const std::string& init_text_marks) {
+    return match_strings(
+            pattern.data(), pattern.size(),
+            text.data(), text.size(),
+            init_search_length,
+            { init_pattern_marks.data(), init_pattern_marks.size(), false },
+            { init_text_marks.data(), init_text_marks.size(), false });
+}
+
+
+std::vector<PairTiles> match_pairs(
+        const std::vector<TokenString>& strings,
+        const std::vector<StringPair>& pairs,
+        const match_length_t& init_search_length,
+        unsigned thread_count,
+        const MatchBudget& budget) {
+
+    std::vector<PairTiles> pair_tiles(pairs.size());
+    // Index of the next pair to match, shared by all threads
+    std::atomic<std::size_t> next_pair(0);
+    // The first exception thrown in any thread, rethrown in the calling thread after all threads have stopped,
+    // since an exception escaping a std::thread would terminate the process
+    std::exception_ptr error;
+    std::mutex error_mutex;
+
+    auto match_remaining_pairs = [&]() {
+        try {
+            for (auto k = next_pair++; k < pairs.size(); k = next_pair++) {
+                const auto& a = strings[pairs[k].first];
+                const auto& b = strings[pairs[k].second];
+                auto& result = pair_tiles[k];
+                if (b.size < a.size) {
+                    // Use the shorter string as pattern and swap the tile indexes back
+                    const auto tiles = match_strings(
+                            b.data, b.size, a.data, a.size, init_search_length, b.marks, a.marks, budget,
+                            result.partial);
+                    result.tiles.reserve(tiles.size());
+                    for (const auto& tile : tiles) {
+                        result.tiles.push_back({ tile.text_index, tile.pattern_index, tile.match_length });
+                    }
+                } else {
+                    result.tiles = match_strings(
+                            a.data, a.size, b.data, b.size, init_search_length, a.marks, b.marks, budget,
+                            result.partial);
+                }
+            }
+        } catch (...) {
+            std::lock_guard<std::mutex> lock(error_mutex);
+            if (!error) {
+                error = std::current_exception();
+            }
+            // Stop the other threads from taking new pairs
+            next_pair = pairs.size();
+        }
+    };
+
+    if (thread_count == 0) {
+        thread_count = std::max(1u, std::thread::hardware_concurrency());
+    }
+    thread_count = static_cast<unsigned>(std::min<std::size_t>(thread_count, pairs.size()));
+
+    // The calling thread matches pairs as well, so thread_count - 1 new threads are needed
+    std::vector<std::thread> threads;
+    for (auto i = 1u; i < thread_count; ++i) {
+        try {
+            threads.emplace_back(match_remaining_pairs);
+        } catch (const std::system_error&) {
+            // Could not start more threads, match the remaining pairs with the threads already running
+            break;
+        }
+    }
+    match_remaining_pairs();
+    for (auto& thread : threads) {
+        thread.join();
+    }
+    if (error) {
+        std::rethrow_exception(error);
+    }
+
+    return pair_tiles;
+}
@@ -1,4 +1,8 @@
+#include <cstdint>
+#include <cstring>
+#include <new>
 #include "gst.hpp"
+#include "suffix_array.hpp"
 // Enforce internal, signed size-type over unsigned size_t
 // https://www.python.org/dev/peps/pep-0353
 #define PY_SSIZE_T_CLEAN
@@ -6,10 +10,108 @@
 
 #define GSTMODULE_DOCSTRING "This module implements a pattern matching function for str and bytes objects."
 
-#define GST_MATCH_DOCSTRING "Takes 5 arguments: pattern (ascii str/bytes), pattern_marks (ascii (1 or 0) str/bytes), text (ascii str/bytes), text_marks (ascii (1 or 0) str/bytes), minimum_match_length (uint)"
+#define GST_MATCH_DOCSTRING "Takes 5 arguments: pattern (ascii str/bytes-like), pattern_marks (ascii (1 or 0) str/bytes-like), text (ascii str/bytes-like), text_marks (ascii (1 or 0) str/bytes-like), minimum_match_length (uint). Does not hold the GIL while matching"
+
+#define GST_MATCH_PACKED_DOCSTRING "Same as match, but pattern_marks and text_marks are bytes-like packed bitsets, where the mark of token i is the bit i % 8 of byte i // 8"
+
+#define GST_MATCH_SUFFIX_ARRAY_DOCSTRING "Same as match_packed, but finds the tiles from a suffix array and LCP array of both strings in O(n log n) time for each tiling round instead of Karp-Rabin matching. The tiles are maximal matches as with match_packed, but ties between equally long matches may be broken differently"
+
+#define GST_MATCH_PAIRS_DOCSTRING "Takes 5 arguments: strings (sequence of ascii str/bytes-like), marks (sequence of bytes-like packed bitsets, one for each string), pairs (sequence of index pairs (a, b) to strings), minimum_match_length (uint), threads (uint, optional, default 1, 0 uses one thread for each hardware thread), max_probes (uint, optional, default 0), max_milliseconds (uint, optional, default 0). Matches all pairs without holding the GIL and returns a 3-tuple of bytes: the tile count of each pair as uint32, the tiles of all pairs in order as uint32 triples (index in string a, index in string b, match length), and a flag for each pair as a byte, which is 1 if matching the pair exceeded max_probes hash table probes or max_milliseconds and the tiles are partial. Zero max_probes or max_milliseconds means no limit"
+
+#define GST_MATCH_ALL_DOCSTRING "Takes 3 arguments: strings (sequence of ascii str/bytes-like), marks (sequence of bytes-like packed bitsets, one for each string), minimum_match_length (uint), first_count (uint, optional, default len(strings)), max_matches (uint, optional, default 0). Matches all pairs (a, b), a < b and a < first_count, of strings at once from one generalized suffix array of all strings, without holding the GIL. Returns a 2-tuple of bytes: the pairs with at least one tile as uint32 triples (a, b, tile count), and the tiles of these pairs in order as uint32 triples (index in string a, index in string b, match length). Returns None if there were more than max_matches maximal matches between the strings. Zero max_matches means no limit"
 
 static PyObject* MatchError;
 
+/*
+ * Build a list of 3-tuples from tiles.
+ */
+static PyObject*
+tiles_to_list(const Tiles& tiles)
+{
+    PyObject* py_list_matches;
+    Py_ssize_t py_matches_len = (Py_ssize_t)tiles.size();
+    // Note that on successful creation, py_list_matches owns one reference to the new list
+    py_list_matches = PyList_New(py_matches_len);
+    if (py_list_matches == (PyObject*)NULL) {
+        // Could not create list, exit with errors
+        return (PyObject*)NULL;
+    }
+
+    Py_ssize_t i = 0;
+    for (const auto& tile : tiles) {
+        // Build a Python 3-tuple from a Tile object, which consists of 3 unsigned longs
+        PyObject* py_tuple_match = Py_BuildValue("(kkk)",
+                tile.pattern_index,
+                tile.text_index,
+                tile.match_length);
+        if (py_tuple_match == (PyObject*)NULL) {
+            // Unable to build tuple, release reference to the list and exit with errors
+            Py_DECREF(py_list_matches);
+            return (PyObject*)NULL;
+        }
+        PyList_SET_ITEM(py_list_matches, i++, py_tuple_match);
+    }
+
+    return py_list_matches;
+}
+
+typedef Tiles (*MatchFunction)(
+        const char*, std::size_t, const char*, std::size_t, const match_length_t&, const MarksView&, const MarksView&);
+
+/*
+ * Parse the arguments of match, match_packed, or match_suffix_array and match the given buffers with match_function.
+ * The buffers are read in place, i.e. they are not copied into strings before matching.
+ * Both match_strings and match_suffix_array may throw std::bad_alloc, which is raised as MemoryError.
+ */
+static PyObject*
+match_buffers(PyObject* args, const char* format, bool packed_marks, MatchFunction match_function)
+{
+    Py_buffer pattern;
+    Py_buffer pattern_marks;
+    Py_buffer text;
+    Py_buffer text_marks;
+    unsigned long minimum_match_length;
+
+    if (!PyArg_ParseTuple(args, format,
+            &pattern,
+            &pattern_marks,
+            &text,
+            &text_marks,
+            &minimum_match_length)) {
+        PyErr_SetString(MatchError, "Invalid arguments, please see docstring");
+        return (PyObject*)NULL;
+    }
+
+    Tiles tiles;
+    bool out_of_memory = false;
+    // It is impossible to find a match in a text that is shorter than the minimum match length
+    if (text.len >= (Py_ssize_t)minimum_match_length) {
+        // The strings are only read through the acquired buffers, so other Python threads can run while matching
+        Py_BEGIN_ALLOW_THREADS
+        try {
+            tiles = match_function(
+                    static_cast<const char*>(pattern.buf), pattern.len,
+                    static_cast<const char*>(text.buf), text.len,
+                    minimum_match_length,
+                    { static_cast<const char*>(pattern_marks.buf), (std::size_t)pattern_marks.len, packed_marks },
+                    { static_cast<const char*>(text_marks.buf), (std::size_t)text_marks.len, packed_marks });
+        } catch (const std::bad_alloc&) {
+            out_of_memory = true;
+        }
+        Py_END_ALLOW_THREADS
+    }
+
+    PyBuffer_Release(&pattern);
+    PyBuffer_Release(&pattern_marks);
+    PyBuffer_Release(&text);
+    PyBuffer_Release(&text_marks);
+
+    if (out_of_memory) {
+        return PyErr_NoMemory();
+    }
+    return tiles_to_list(tiles);
+}
+
 /*
  * Corresponding Python function definition
  * def gst.match(pattern: str/bytes, pattern_marks: str/bytes, text: str/bytes, text_marks: str/bytes, minimum_match_length: uint):
@@ -19,71 +121,320 @@ static PyObject* MatchError;
 static PyObject*
 gst_match(PyObject* self, PyObject* args)
 {
-    const char* pattern_c_str;
-    Py_ssize_t pattern_length;
+    return match_buffers(args, "s*s*s*s*k", false, match_strings);
+}
+
+/*
+ * Corresponding Python function definition
+ * def gst.match_packed(pattern: str/bytes, pattern_marks: bytes, text: str/bytes, text_marks: bytes, minimum_match_length: uint):
+ *     #stuff
+ *     return [(pattern_begin, text_begin, match_length) for ... in matches]
+ */
+static PyObject*
+gst_match_packed(PyObject* self, PyObject* args)
+{
+    return match_buffers(args, "s*y*s*y*k", true, match_strings);
+}
+
+/*
+ * Corresponding Python function definition
+ * def gst.match_suffix_array(pattern: str/bytes, pattern_marks: bytes, text: str/bytes, text_marks: bytes,
+ *                            minimum_match_length: uint):
+ *     #stuff
+ *     return [(pattern_begin, text_begin, match_length) for ... in matches]
+ */
+static PyObject*
+gst_match_suffix_array(PyObject* self, PyObject* args)
+{
+    return match_buffers(args, "s*y*s*y*k", true, match_suffix_array);
+}
+
+
+/*
+ * Owns the buffers acquired while parsing the arguments of match_pairs and releases them when going out of scope.
+ * Must be destroyed while holding the GIL.
+ */
+struct BufferList {
+    std::vector<Py_buffer> buffers;
+
+    ~BufferList() {
+        for (auto& buffer : buffers) {
+            PyBuffer_Release(&buffer);
+        }
+    }
+
+    const Py_buffer* acquire(PyObject* object, const char* format) {
+        Py_buffer buffer;
+        if (!PyArg_Parse(object, format, &buffer)) {
+            return (const Py_buffer*)NULL;
+        }
+        buffers.push_back(buffer);
+        return &buffers.back();
+    }
+};
+
+/*
+ * Parse a sequence of token strings and a sequence of their packed marks into token strings
+ * pointing into the buffers acquired into buffers.
+ */
+static bool
+parse_token_strings(PyObject* py_strings, PyObject* py_marks, BufferList& buffers, std::vector<TokenString>& strings)
+{
+    PyObject* strings_seq = PySequence_Fast(py_strings, "strings must be a sequence");
+    if (strings_seq == (PyObject*)NULL) {
+        return false;
+    }
+    PyObject* marks_seq = PySequence_Fast(py_marks, "marks must be a sequence");
+    if (marks_seq == (PyObject*)NULL) {
+        Py_DECREF(strings_seq);
+        return false;
+    }
 
-    const char* pattern_marks;
-    Py_ssize_t pattern_marks_length;
+    const Py_ssize_t string_count = PySequence_Fast_GET_SIZE(strings_seq);
+    // The buffer list must not reallocate, since the token strings point into the buffers
+    buffers.buffers.reserve(2 * string_count);
+    strings.reserve(string_count);
 
-    const char* text_c_str;
-    Py_ssize_t text_length;
+    bool parsed = PySequence_Fast_GET_SIZE(marks_seq) == string_count;
+    if (!parsed) {
+        PyErr_SetString(MatchError, "strings and marks must have the same length");
+    }
+    for (Py_ssize_t i = 0; parsed && i < string_count; ++i) {
+        const Py_buffer* string = buffers.acquire(PySequence_Fast_GET_ITEM(strings_seq, i), "s*");
+        const Py_buffer* marks = string ? buffers.acquire(PySequence_Fast_GET_ITEM(marks_seq, i), "y*") : NULL;
+        if (string == (const Py_buffer*)NULL || marks == (const Py_buffer*)NULL) {
+            parsed = false;
+            break;
+        }
+        strings.push_back({
+                static_cast<const char*>(string->buf), (std::size_t)string->len,
+                { static_cast<const char*>(marks->buf), (std::size_t)marks->len, true }});
+    }
+    Py_DECREF(strings_seq);
+    Py_DECREF(marks_seq);
+    return parsed;
+}
 
-    const char* text_marks;
-    Py_ssize_t text_marks_length;
+/*
+ * Parse a sequence of index pairs, each index being less than string_count.
+ */
+static bool
+parse_pairs(PyObject* py_pairs, std::size_t string_count, std::vector<StringPair>& pairs)
+{
+    PyObject* pairs_seq = PySequence_Fast(py_pairs, "pairs must be a sequence");
+    if (pairs_seq == (PyObject*)NULL) {
+        return false;
+    }
+    const Py_ssize_t pair_count = PySequence_Fast_GET_SIZE(pairs_seq);
+    pairs.reserve(pair_count);
+    for (Py_ssize_t k = 0; k < pair_count; ++k) {
+        PyObject* pair_seq = PySequence_Fast(PySequence_Fast_GET_ITEM(pairs_seq, k), "pairs must contain sequences");
+        if (pair_seq == (PyObject*)NULL) {
+            Py_DECREF(pairs_seq);
+            return false;
+        }
+        Py_ssize_t a = -1;
+        Py_ssize_t b = -1;
+        if (PySequence_Fast_GET_SIZE(pair_seq) == 2) {
+            a = PyLong_AsSsize_t(PySequence_Fast_GET_ITEM(pair_seq, 0));
+            b = PyLong_AsSsize_t(PySequence_Fast_GET_ITEM(pair_seq, 1));
+        }
+        Py_DECREF(pair_seq);
+        if (a < 0 || b < 0 || (std::size_t)a >= string_count || (std::size_t)b >= string_count) {
+            Py_DECREF(pairs_seq);
+            if (!PyErr_Occurred()) {
+                PyErr_SetString(MatchError, "pairs must contain index pairs to strings");
+            }
+            return false;
+        }
+        pairs.push_back({ (std::size_t)a, (std::size_t)b });
+    }
+    Py_DECREF(pairs_seq);
+    return true;
+}
 
+/*
+ * Corresponding Python function definition
+ * def gst.match_pairs(strings: list, marks: list, pairs: list, minimum_match_length: uint, threads: uint = 1,
+ *                     max_probes: uint = 0, max_milliseconds: uint = 0):
+ *     #stuff
+ *     return (tile_counts: bytes, tiles: bytes, partial: bytes)
+ */
+static PyObject*
+gst_match_pairs(PyObject* self, PyObject* args)
+{
+    PyObject* py_strings;
+    PyObject* py_marks;
+    PyObject* py_pairs;
     unsigned long minimum_match_length;
+    unsigned int thread_count = 1;
+    MatchBudget budget;
+    unsigned long long max_probes = 0;
+    unsigned long long max_milliseconds = 0;
 
-    if (!PyArg_ParseTuple(args, "s#s#s#s#k",
-            &pattern_c_str, &pattern_length,
-            &pattern_marks, &pattern_marks_length,
-            &text_c_str, &text_length,
-            &text_marks, &text_marks_length,
-            &minimum_match_length)) {
+    if (!PyArg_ParseTuple(args, "OOOk|IKK",
+            &py_strings,
+            &py_marks,
+            &py_pairs,
+            &minimum_match_length,
+            &thread_count,
+            &max_probes,
+            &max_milliseconds)) {
         PyErr_SetString(MatchError, "Invalid arguments, please see docstring");
         return (PyObject*)NULL;
     }
 
-    // It is impossible to find a match in a text that is shorter than the minimum match length
-    if (text_length < (Py_ssize_t)minimum_match_length) {
-        return PyList_New(0); // Return an empty list
+    std::vector<StringPair> pairs;
+    std::vector<TokenString> strings;
+    BufferList buffers;
+    if (!parse_token_strings(py_strings, py_marks, buffers, strings)
+            || !parse_pairs(py_pairs, strings.size(), pairs)) {
+        return (PyObject*)NULL;
+    }
+
+    budget.max_probes = max_probes;
+    budget.max_milliseconds = max_milliseconds;
+
+    std::vector<PairTiles> pair_tiles;
+    bool out_of_memory = false;
+    // The strings are only read through the acquired buffers, so other Python threads can run while matching
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        pair_tiles = match_pairs(strings, pairs, minimum_match_length, thread_count, budget);
+    } catch (const std::bad_alloc&) {
+        out_of_memory = true;
+    }
+    Py_END_ALLOW_THREADS
+    if (out_of_memory) {
+        return PyErr_NoMemory();
     }
 
-    // TODO: replace with c++17 string_view to avoid copying the const char*
-    const std::string pattern(pattern_c_str, pattern_length);
-    const std::string text(text_c_str, text_length);
+    // Write the results into compact buffers of native uint32 values and partial flags
+    std::size_t tile_count = 0;
+    for (const auto& result : pair_tiles) {
+        tile_count += result.tiles.size();
+    }
+    PyObject* py_counts = PyBytes_FromStringAndSize(NULL, (Py_ssize_t)(pair_tiles.size() * sizeof(std::uint32_t)));
+    PyObject* py_tiles = PyBytes_FromStringAndSize(NULL, (Py_ssize_t)(3 * tile_count * sizeof(std::uint32_t)));
+    PyObject* py_partial = PyBytes_FromStringAndSize(NULL, (Py_ssize_t)pair_tiles.size());
+    if (py_counts == (PyObject*)NULL || py_tiles == (PyObject*)NULL || py_partial == (PyObject*)NULL) {
+        Py_XDECREF(py_counts);
+        Py_XDECREF(py_tiles);
+        Py_XDECREF(py_partial);
+        return (PyObject*)NULL;
+    }
+    char* counts_out = PyBytes_AS_STRING(py_counts);
+    char* tiles_out = PyBytes_AS_STRING(py_tiles);
+    char* partial_out = PyBytes_AS_STRING(py_partial);
+    for (const auto& result : pair_tiles) {
+        const std::uint32_t count = (std::uint32_t)result.tiles.size();
+        std::memcpy(counts_out, &count, sizeof(count));
+        counts_out += sizeof(count);
+        *partial_out++ = result.partial ? 1 : 0;
+        for (const auto& tile : result.tiles) {
+            const std::uint32_t values[3] = {
+                (std::uint32_t)tile.pattern_index,
+                (std::uint32_t)tile.text_index,
+                (std::uint32_t)tile.match_length,
+            };
+            std::memcpy(tiles_out, values, sizeof(values));
+            tiles_out += sizeof(values);
+        }
+    }
 
-    const std::string pattern_marks_str(pattern_marks, pattern_marks_length);
-    const std::string text_marks_str(text_marks, text_marks_length);
+    // "N" steals the references to the bytes objects
+    return Py_BuildValue("(NNN)", py_counts, py_tiles, py_partial);
+}
 
-    const auto& matches = match_strings(pattern, text, minimum_match_length, pattern_marks_str, text_marks_str);
+/*
+ * Corresponding Python function definition
+ * def gst.match_all(strings: list, marks: list, minimum_match_length: uint, first_count: uint = len(strings),
+ *                   max_matches: uint = 0):
+ *     #stuff
+ *     return (pairs: bytes, tiles: bytes) or None
+ */
+static PyObject*
+gst_match_all(PyObject* self, PyObject* args)
+{
+    PyObject* py_strings;
+    PyObject* py_marks;
+    unsigned long minimum_match_length;
+    Py_ssize_t first_count = -1;
+    unsigned long long max_matches = 0;
 
-    // Build a list of 3-tuples from matches and return it
+    if (!PyArg_ParseTuple(args, "OOk|nK",
+            &py_strings,
+            &py_marks,
+            &minimum_match_length,
+            &first_count,
+            &max_matches)) {
+        PyErr_SetString(MatchError, "Invalid arguments, please see docstring");
+        return (PyObject*)NULL;
+    }
 
-    PyObject* py_list_matches;
-    Py_ssize_t py_matches_len = (Py_ssize_t)matches.size();
-    // Note that on successful creation, py_list_matches owns one reference to the new list
-    py_list_matches = PyList_New(py_matches_len);
-    if (py_list_matches == (PyObject*)NULL) {
-        // Could not create list, exit with errors
+    std::vector<TokenString> strings;
+    BufferList buffers;
+    if (!parse_token_strings(py_strings, py_marks, buffers, strings)) {
         return (PyObject*)NULL;
     }
+    if (first_count < 0) {
+        first_count = (Py_ssize_t)strings.size();
+    }
 
-    Py_ssize_t i = 0;
-    for (const auto& match : matches) {
-        // Build a Python 3-tuple from a Match object, which consists of 3 unsigned longs
-        PyObject* py_tuple_match = Py_BuildValue("(kkk)",
-                match.pattern_index,
-                match.text_index,
-                match.match_length);
-        if (py_tuple_match == (PyObject*)NULL) {
-            // Unable to build tuple, release reference to the list and exit with errors
-            Py_DECREF(py_list_matches);
-            return (PyObject*)NULL;
+    std::vector<IndexedPairTiles> pair_tiles;
+    bool complete = false;
+    bool out_of_memory = false;
+    // The strings are only read through the acquired buffers, so other Python threads can run while matching
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        complete = match_all_suffix_array(
+                strings, minimum_match_length, (std::size_t)first_count, (std::size_t)max_matches, pair_tiles);
+    } catch (const std::bad_alloc&) {
+        out_of_memory = true;
+    }
+    Py_END_ALLOW_THREADS
+    if (out_of_memory) {
+        return PyErr_NoMemory();
+    }
+    if (!complete) {
+        Py_RETURN_NONE;
+    }
+
+    // Write the results into compact buffers of native uint32 values
+    std::size_t tile_count = 0;
+    for (const auto& result : pair_tiles) {
+        tile_count += result.tiles.size();
+    }
+    PyObject* py_pairs = PyBytes_FromStringAndSize(NULL, (Py_ssize_t)(3 * pair_tiles.size() * sizeof(std::uint32_t)));
+    PyObject* py_tiles = PyBytes_FromStringAndSize(NULL, (Py_ssize_t)(3 * tile_count * sizeof(std::uint32_t)));
+    if (py_pairs == (PyObject*)NULL || py_tiles == (PyObject*)NULL) {
+        Py_XDECREF(py_pairs);
+        Py_XDECREF(py_tiles);
+        return (PyObject*)NULL;
+    }
+    char* pairs_out = PyBytes_AS_STRING(py_pairs);
+    char* tiles_out = PyBytes_AS_STRING(py_tiles);
+    for (const auto& result : pair_tiles) {
+        const std::uint32_t pair[3] = {
+            (std::uint32_t)result.pair.first,
+            (std::uint32_t)result.pair.second,
+            (std::uint32_t)result.tiles.size(),
+        };
+        std::memcpy(pairs_out, pair, sizeof(pair));
+        pairs_out += sizeof(pair);
+        for (const auto& tile : result.tiles) {
+            const std::uint32_t values[3] = {
+                (std::uint32_t)tile.pattern_index,
+                (std::uint32_t)tile.text_index,
+                (std::uint32_t)tile.match_length,
+            };
+            std::memcpy(tiles_out, values, sizeof(values));
+            tiles_out += sizeof(values);
         }
-        PyList_SET_ITEM(py_list_matches, i++, py_tuple_match);
     }
 
-    return py_list_matches;
+    // "N" steals the references to the bytes objects
+    return Py_BuildValue("(NN)", py_pairs, py_tiles);
 }
 
 
@@ -91,6 +442,10 @@ gst_match(PyObject* self, PyObject* args)
 
 static PyMethodDef module_methods[] = {
     {"match", gst_match, METH_VARARGS, GST_MATCH_DOCSTRING},
+    {"match_packed", gst_match_packed, METH_VARARGS, GST_MATCH_PACKED_DOCSTRING},
+    {"match_suffix_array", gst_match_suffix_array, METH_VARARGS, GST_MATCH_SUFFIX_ARRAY_DOCSTRING},
+    {"match_pairs", gst_match_pairs, METH_VARARGS, GST_MATCH_PAIRS_DOCSTRING},
+    {"match_all", gst_match_all, METH_VARARGS, GST_MATCH_ALL_DOCSTRING},
     {NULL, NULL, 0, NULL} // Sentinel
 };
 
@@ -0,0 +1,583 @@
+#include <algorithm>
+#include <limits>
+#include <map>
+#include <numeric>
+#include <queue>
+#include <tuple>
+#include "suffix_array.hpp"
+
+
+std::vector<std::uint32_t> suffix_array(const Symbols& symbols) {
+    const std::size_t n = symbols.size();
+    std::vector<std::uint32_t> suffixes(n);
+    std::iota(suffixes.begin(), suffixes.end(), 0u);
+    if (n == 0) {
+        return suffixes;
+    }
+
+    // Rank all suffixes by their first symbol
+    std::sort(suffixes.begin(), suffixes.end(), [&symbols](std::uint32_t a, std::uint32_t b) {
+        return symbols[a] < symbols[b];
+    });
+    std::vector<std::uint32_t> rank(n);
+    rank[suffixes[0]] = 0;
+    for (std::size_t k = 1; k < n; ++k) {
+        rank[suffixes[k]] = rank[suffixes[k - 1]] + (symbols[suffixes[k]] != symbols[suffixes[k - 1]] ? 1u : 0u);
+    }
+
+    std::vector<std::uint32_t> by_second_key(n);
+    std::vector<std::uint32_t> next_rank(n);
+    std::vector<std::uint32_t> counts;
+
+    // Sort the suffixes by their first 2 * length symbols, given they are sorted by their first length symbols
+    for (std::size_t length = 1; rank[suffixes[n - 1]] < n - 1; length <<= 1) {
+        // Order by the rank of the suffix starting length symbols later,
+        // suffixes shorter than length have an empty second half and come first
+        std::size_t i = 0;
+        for (std::size_t p = n - length; p < n; ++p) {
+            by_second_key[i++] = static_cast<std::uint32_t>(p);
+        }
+        for (std::size_t k = 0; k < n; ++k) {
+            if (suffixes[k] >= length) {
+                by_second_key[i++] = static_cast<std::uint32_t>(suffixes[k] - length);
+            }
+        }
+
+        // Stable counting sort by the rank of the first half
+        counts.assign(rank[suffixes[n - 1]] + 2, 0u);
+        for (std::size_t p = 0; p < n; ++p) {
+            ++counts[rank[p] + 1];
+        }
+        std::partial_sum(counts.begin(), counts.end(), counts.begin());
+        for (std::size_t k = 0; k < n; ++k) {
+            const auto p = by_second_key[k];
+            suffixes[counts[rank[p]]++] = p;
+        }
+
+        // Rank the suffixes by both halves
+        auto second_rank = [&](std::uint32_t p) -> std::int64_t {
+            return p + length < n ? static_cast<std::int64_t>(rank[p + length]) : -1;
+        };
+        next_rank[suffixes[0]] = 0;
+        for (std::size_t k = 1; k < n; ++k) {
+            const auto a = suffixes[k - 1];
+            const auto b = suffixes[k];
+            const bool same = rank[a] == rank[b] and second_rank(a) == second_rank(b);
+            next_rank[b] = next_rank[a] + (same ? 0u : 1u);
+        }
+        rank.swap(next_rank);
+    }
+
+    return suffixes;
+}
+
+
+std::vector<std::uint32_t> lcp_array(const Symbols& symbols, const std::vector<std::uint32_t>& suffixes) {
+    const std::size_t n = symbols.size();
+    std::vector<std::uint32_t> rank(n);
+    for (std::size_t k = 0; k < n; ++k) {
+        rank[suffixes[k]] = static_cast<std::uint32_t>(k);
+    }
+    std::vector<std::uint32_t> lcp(n, 0u);
+    std::size_t h = 0;
+    for (std::size_t p = 0; p < n; ++p) {
+        if (rank[p] == 0) {
+            h = 0;
+            continue;
+        }
+        const std::size_t q = suffixes[rank[p] - 1];
+        while (p + h < n and q + h < n and symbols[p + h] == symbols[q + h]) {
+            ++h;
+        }
+        lcp[rank[p]] = static_cast<std::uint32_t>(h);
+        if (h > 0) {
+            --h;
+        }
+    }
+    return lcp;
+}
+
+
+namespace {
+
+/*
+ * Maximal match of a pattern position with some text position.
+ */
+struct Candidate {
+    std::uint32_t pattern_index;
+    std::uint32_t text_index;
+    std::uint32_t length;
+};
+
+
+/*
+ * Non-overlapping intervals tiled during one round.
+ */
+class Intervals {
+public:
+    bool overlaps(std::uint32_t begin, std::uint32_t end) const {
+        // The last interval starting before end is the only one that can overlap [begin, end)
+        auto it = intervals.lower_bound(end);
+        if (it == intervals.begin()) {
+            return false;
+        }
+        --it;
+        return it->second > begin;
+    }
+
+    void insert(std::uint32_t begin, std::uint32_t end) {
+        intervals.emplace(begin, end);
+    }
+
+private:
+    std::map<std::uint32_t, std::uint32_t> intervals;
+};
+
+
+// Symbols of characters are their byte values, all other symbols are unique and never match anything
+constexpr std::uint32_t first_unique_symbol = 256u;
+
+
+/*
+ * Maximal match between positions of two different token strings.
+ */
+struct PairMatch {
+    std::uint32_t a;
+    std::uint32_t b;
+    std::uint32_t a_index;
+    std::uint32_t b_index;
+    std::uint32_t length;
+};
+
+
+/*
+ * Suffixes of an LCP interval, grouped by the symbol preceding the suffix.
+ * All unique preceding symbols, i.e. marked tokens, separators, and the start of the symbols, share one group,
+ * since they differ from every other preceding symbol.
+ */
+struct SuffixGroups {
+    std::vector<std::pair<std::uint32_t, std::vector<std::uint32_t>>> groups;
+    std::size_t size = 0;
+
+    std::vector<std::uint32_t>& group(std::uint32_t left) {
+        for (auto& group : groups) {
+            if (group.first == left) {
+                return group.second;
+            }
+        }
+        groups.emplace_back(left, std::vector<std::uint32_t>());
+        return groups.back().second;
+    }
+
+    void clear() {
+        groups.clear();
+        size = 0;
+    }
+};
+
+
+/*
+ * Enumerates the maximal matches between different token strings from a generalized suffix array.
+ */
+class MaximalMatches {
+public:
+    MaximalMatches(
+            const Symbols& symbols,
+            const std::vector<std::uint32_t>& owners,
+            std::uint32_t minimum_length,
+            std::size_t first_count,
+            std::size_t max_matches) :
+        symbols(symbols),
+        owners(owners),
+        minimum_length(minimum_length),
+        first_count(first_count),
+        max_matches(max_matches) {}
+
+    /*
+     * Traverse the LCP intervals bottom up and return false if there were more than max_matches maximal matches.
+     */
+    bool enumerate(const std::vector<std::uint32_t>& suffixes, const std::vector<std::uint32_t>& lcp) {
+        constexpr auto leaf_depth = std::numeric_limits<std::uint32_t>::max();
+        const std::size_t n = suffixes.size();
+        // Stack of intervals with their depth, leaves are intervals deeper than any LCP
+        std::vector<std::pair<std::uint32_t, SuffixGroups>> stack;
+        stack.emplace_back(0u, SuffixGroups());
+        for (std::size_t k = 0; k <= n; ++k) {
+            const std::uint32_t depth = (k == 0 or k == n) ? 0u : lcp[k];
+            // Close all intervals deeper than the LCP of the previous and the current suffix
+            SuffixGroups last;
+            bool has_last = false;
+            while (stack.back().first > depth) {
+                auto node = std::move(stack.back());
+                stack.pop_back();
+                if (has_last and not merge(node.second, last, node.first)) {
+                    return false;
+                }
+                last = std::move(node.second);
+                has_last = true;
+            }
+            if (has_last) {
+                if (stack.back().first < depth) {
+                    stack.emplace_back(depth, std::move(last));
+                } else if (not merge(stack.back().second, last, depth)) {
+                    return false;
+                }
+            }
+            if (k < n) {
+                SuffixGroups leaf;
+                leaf.group(left_symbol(suffixes[k])).push_back(suffixes[k]);
+                leaf.size = 1;
+                stack.emplace_back(leaf_depth, std::move(leaf));
+            }
+        }
+        return true;
+    }
+
+    std::vector<PairMatch> matches;
+
+private:
+    const Symbols& symbols;
+    const std::vector<std::uint32_t>& owners;
+    const std::uint32_t minimum_length;
+    const std::size_t first_count;
+    const std::size_t max_matches;
+
+    std::uint32_t left_symbol(std::uint32_t position) const {
+        if (position == 0 or symbols[position - 1] >= first_unique_symbol) {
+            return first_unique_symbol;
+        }
+        return symbols[position - 1];
+    }
+
+    /*
+     * Merge the suffixes of a child interval into its parent interval at the given depth,
+     * adding the maximal matches between the suffixes of the child and the other suffixes of the parent.
+     */
+    bool merge(SuffixGroups& parent, SuffixGroups& child, std::uint32_t depth) {
+        if (depth < minimum_length) {
+            // All enclosing intervals are even shallower, so their suffixes cannot match anymore
+            parent.clear();
+            child.clear();
+            return true;
+        }
+        // Iterate the smaller interval and move its suffixes into the larger one
+        if (parent.size < child.size) {
+            std::swap(parent, child);
+        }
+        for (const auto& child_group : child.groups) {
+            for (const auto& parent_group : parent.groups) {
+                if (child_group.first == parent_group.first and child_group.first != first_unique_symbol) {
+                    // Equal preceding symbols, the match extends to the left
+                    continue;
+                }
+                for (const auto p : child_group.second) {
+                    for (const auto q : parent_group.second) {
+                        if (not add_match(p, q, depth)) {
+                            return false;
+                        }
+                    }
+                }
+            }
+        }
+        for (auto& child_group : child.groups) {
+            auto& group = parent.group(child_group.first);
+            group.insert(group.end(), child_group.second.begin(), child_group.second.end());
+        }
+        parent.size += child.size;
+        child.clear();
+        return true;
+    }
+
+    bool add_match(std::uint32_t p, std::uint32_t q, std::uint32_t length) {
+        auto a = owners[p];
+        auto b = owners[q];
+        if (a == b) {
+            return true;
+        }
+        if (b < a) {
+            std::swap(a, b);
+            std::swap(p, q);
+        }
+        if (a >= first_count) {
+            return true;
+        }
+        if (max_matches > 0 and matches.size() >= max_matches) {
+            return false;
+        }
+        matches.push_back({ a, b, p, q, length });
+        return true;
+    }
+};
+
+
+/*
+ * Greedily tile a pair of token strings from their maximal matches, longest first.
+ * A maximal match overlapping earlier tiles is split into its untiled parts,
+ * which are tiled later if they are still long enough.
+ * The match indexes are positions in the symbols and the tiles are indexes to the token strings.
+ */
+Tiles tile_pair(
+        std::vector<PairMatch>::const_iterator begin,
+        std::vector<PairMatch>::const_iterator end,
+        std::uint32_t a_begin,
+        std::uint32_t b_begin,
+        std::uint32_t minimum_length,
+        std::vector<bool>& tiled) {
+    // Longest first, ties broken by the earliest position in string a
+    typedef std::tuple<std::uint32_t, std::int64_t, std::int64_t> Candidate;
+    std::priority_queue<Candidate> candidates;
+    for (auto it = begin; it != end; ++it) {
+        candidates.emplace(
+                it->length, -static_cast<std::int64_t>(it->a_index), -static_cast<std::int64_t>(it->b_index));
+    }
+
+    Tiles tiles;
+    while (not candidates.empty()) {
+        const auto length = std::get<0>(candidates.top());
+        const auto a_index = static_cast<std::uint32_t>(-std::get<1>(candidates.top()));
+        const auto b_index = static_cast<std::uint32_t>(-std::get<2>(candidates.top()));
+        candidates.pop();
+
+        std::uint32_t run_begin = 0;
+        bool split = false;
+        for (std::uint32_t i = 0; i <= length; ++i) {
+            if (i < length and not tiled[a_index + i] and not tiled[b_index + i]) {
+                continue;
+            }
+            if (i < length) {
+                split = true;
+            }
+            if (split and i - run_begin >= minimum_length) {
+                candidates.emplace(i - run_begin, -static_cast<std::int64_t>(a_index + run_begin),
+                                   -static_cast<std::int64_t>(b_index + run_begin));
+            }
+            run_begin = i + 1;
+        }
+        if (split) {
+            continue;
+        }
+        for (std::uint32_t i = 0; i < length; ++i) {
+            tiled[a_index + i] = true;
+            tiled[b_index + i] = true;
+        }
+        tiles.push_back({ a_index - a_begin, b_index - b_begin, length });
+    }
+
+    // Reset the tiled positions for the next pair
+    for (const auto& tile : tiles) {
+        for (std::uint32_t i = 0; i < tile.match_length; ++i) {
+            tiled[a_begin + tile.pattern_index + i] = false;
+            tiled[b_begin + tile.text_index + i] = false;
+        }
+    }
+    return tiles;
+}
+
+
+/*
+ * Find the longest match of every pattern position in the text.
+ * The symbols are the pattern, a separator, and the text.
+ * Return the candidates that cannot be extended to the left, with a length of at least minimum_length.
+ */
+std::vector<Candidate> find_candidates(
+        const Symbols& symbols,
+        std::size_t pattern_length,
+        std::uint32_t minimum_length) {
+    const auto suffixes = suffix_array(symbols);
+    const auto lcp = lcp_array(symbols, suffixes);
+    const std::size_t n = symbols.size();
+    const std::size_t text_begin = pattern_length + 1;
+    constexpr auto none = std::numeric_limits<std::uint32_t>::max();
+
+    std::vector<std::uint32_t> best_length(pattern_length, 0u);
+    std::vector<std::uint32_t> best_text_index(pattern_length, none);
+
+    // The longest match of a pattern suffix is with the closest text suffix before or after it in the suffix array,
+    // and its length is the minimum LCP between them
+    auto visit = [&](std::size_t k, std::uint32_t& common_length, std::uint32_t& text_index) {
+        const auto p = suffixes[k];
+        if (p >= text_begin) {
+            text_index = static_cast<std::uint32_t>(p - text_begin);
+            common_length = none;
+        } else if (p < pattern_length and text_index != none and common_length > best_length[p]) {
+            best_length[p] = common_length;
+            best_text_index[p] = text_index;
+        }
+    };
+    std::uint32_t common_length = none;
+    std::uint32_t text_index = none;
+    for (std::size_t k = 0; k < n; ++k) {
+        if (k > 0) {
+            common_length = std::min(common_length, lcp[k]);
+        }
+        visit(k, common_length, text_index);
+    }
+    common_length = none;
+    text_index = none;
+    for (std::size_t k = n; k-- > 0;) {
+        if (k + 1 < n) {
+            common_length = std::min(common_length, lcp[k + 1]);
+        }
+        visit(k, common_length, text_index);
+    }
+
+    std::vector<Candidate> candidates;
+    for (std::size_t i = 0; i < pattern_length; ++i) {
+        const auto length = best_length[i];
+        const auto j = best_text_index[i];
+        if (length < minimum_length or j == none) {
+            continue;
+        }
+        if (i > 0 and j > 0 and symbols[i - 1] == symbols[text_begin + j - 1]) {
+            // Contained in the match of the previous pattern position
+            continue;
+        }
+        candidates.push_back({ static_cast<std::uint32_t>(i), j, length });
+    }
+    return candidates;
+}
+
+} // namespace
+
+
+Tiles match_suffix_array(
+        const char* pattern,
+        std::size_t pattern_length,
+        const char* text,
+        std::size_t text_length,
+        const match_length_t& init_search_length,
+        const MarksView& init_pattern_marks,
+        const MarksView& init_text_marks) {
+
+    Tiles tiles;
+    if (init_search_length == 0 or pattern_length < init_search_length or text_length < init_search_length) {
+        return tiles;
+    }
+    const auto minimum_length = static_cast<std::uint32_t>(init_search_length);
+
+    std::vector<bool> pattern_marked(pattern_length);
+    for (std::size_t i = 0; i < pattern_length; ++i) {
+        pattern_marked[i] = init_pattern_marks.is_marked(i);
+    }
+    std::vector<bool> text_marked(text_length);
+    for (std::size_t i = 0; i < text_length; ++i) {
+        text_marked[i] = init_text_marks.is_marked(i);
+    }
+
+    Symbols symbols(pattern_length + 1 + text_length);
+    const std::size_t text_begin = pattern_length + 1;
+
+    while (true) {
+        // Marked tokens and the separator get unique symbols, so that no match contains them
+        std::uint32_t next_unique_symbol = first_unique_symbol;
+        for (std::size_t i = 0; i < pattern_length; ++i) {
+            symbols[i] = pattern_marked[i] ? next_unique_symbol++ : static_cast<unsigned char>(pattern[i]);
+        }
+        symbols[pattern_length] = next_unique_symbol++;
+        for (std::size_t i = 0; i < text_length; ++i) {
+            symbols[text_begin + i] = text_marked[i] ? next_unique_symbol++ : static_cast<unsigned char>(text[i]);
+        }
+
+        auto candidates = find_candidates(symbols, pattern_length, minimum_length);
+        if (candidates.empty()) {
+            break;
+        }
+        std::stable_sort(candidates.begin(), candidates.end(), [](const Candidate& a, const Candidate& b) {
+            return a.length > b.length;
+        });
+
+        // Tile the longest candidates first, candidates overlapping the new tiles are shortened in the next round
+        Intervals pattern_tiles;
+        Intervals text_tiles;
+        bool overlapped = false;
+        for (const auto& c : candidates) {
+            const auto pattern_end = c.pattern_index + c.length;
+            const auto text_end = c.text_index + c.length;
+            if (pattern_tiles.overlaps(c.pattern_index, pattern_end) or text_tiles.overlaps(c.text_index, text_end)) {
+                overlapped = true;
+                continue;
+            }
+            pattern_tiles.insert(c.pattern_index, pattern_end);
+            text_tiles.insert(c.text_index, text_end);
+            for (auto i = c.pattern_index; i < pattern_end; ++i) {
+                pattern_marked[i] = true;
+            }
+            for (auto i = c.text_index; i < text_end; ++i) {
+                text_marked[i] = true;
+            }
+            tiles.push_back({ c.pattern_index, c.text_index, c.length });
+        }
+
+        if (not overlapped) {
+            // All remaining matches were tiled
+            break;
+        }
+    }
+
+    return tiles;
+}
+
+
+bool match_all_suffix_array(
+        const std::vector<TokenString>& strings,
+        const match_length_t& init_search_length,
+        std::size_t first_count,
+        std::size_t max_matches,
+        std::vector<IndexedPairTiles>& result) {
+
+    result.clear();
+    if (init_search_length == 0) {
+        return true;
+    }
+    const auto minimum_length = static_cast<std::uint32_t>(init_search_length);
+
+    // Concatenate all strings, each followed by a unique separator, and remember the string of each position
+    std::size_t total_length = 0;
+    for (const auto& string : strings) {
+        total_length += string.size + 1;
+    }
+    Symbols symbols;
+    std::vector<std::uint32_t> owners;
+    std::vector<std::uint32_t> begins;
+    symbols.reserve(total_length);
+    owners.reserve(total_length);
+    std::uint32_t next_unique_symbol = first_unique_symbol;
+    for (std::size_t s = 0; s < strings.size(); ++s) {
+        const auto& string = strings[s];
+        begins.push_back(static_cast<std::uint32_t>(symbols.size()));
+        for (std::size_t i = 0; i < string.size; ++i) {
+            symbols.push_back(
+                string.marks.is_marked(i) ? next_unique_symbol++ : static_cast<unsigned char>(string.data[i]));
+            owners.push_back(static_cast<std::uint32_t>(s));
+        }
+        symbols.push_back(next_unique_symbol++);
+        owners.push_back(static_cast<std::uint32_t>(s));
+    }
+
+    MaximalMatches maximal_matches(symbols, owners, minimum_length, first_count, max_matches);
+    {
+        const auto suffixes = suffix_array(symbols);
+        const auto lcp = lcp_array(symbols, suffixes);
+        if (not maximal_matches.enumerate(suffixes, lcp)) {
+            return false;
+        }
+    }
+
+    auto& matches = maximal_matches.matches;
+    std::sort(matches.begin(), matches.end(), [](const PairMatch& x, const PairMatch& y) {
+        return x.a < y.a or (x.a == y.a and x.b < y.b);
+    });
+    std::vector<bool> tiled(symbols.size());
+    for (auto begin = matches.cbegin(); begin != matches.cend();) {
+        auto end = begin;
+        while (end != matches.cend() and end->a == begin->a and end->b == begin->b) {
+            ++end;
+        }
+        auto tiles = tile_pair(begin, end, begins[begin->a], begins[begin->b], minimum_length, tiled);
+        if (not tiles.empty()) {
+            result.push_back({ { begin->a, begin->b }, std::move(tiles) });
+        }
+        begin = end;
+    }
+    return true;
+}
@@ -1,3 +1,4 @@
+import array
 import unittest
 import string
 
@@ -13,8 +14,15 @@ from hypothesis import strategies, settings, given
 # varying minmatch length
 
 
+def pack_marks(marked_indexes):
+    marks = 0
+    for i in marked_indexes:
+        marks |= 1 << i
+    return marks.to_bytes((marks.bit_length() + 7) // 8, "little")
+
+
 EDGE_CASES = (
-    # Causes unterminated loop in gst.cpp match_strings #FIXME
+    # Caused an unterminated loop in gst.cpp match_strings before hash collisions were verified
     (
         """
         09ggg2cgtrrdd27a2ckjnkjnknokjnnkjnjnnkjnkjnjnjnjnjnjnjnjnjnnkjnnjnmnjnjnjnjnjnjnjnjnhnjnkjnjnjnjnjno
@@ -41,6 +49,26 @@ class TestCase(unittest.TestCase):
         self.assertEqual(pattern[pattern_start:pattern_start + match_len],
                          text[text_start:text_start + match_len])
 
+    def assertMaximalTiling(self, pattern, pattern_marked, text, text_marked, min_match_length, matches):
+        for match in matches:
+            self.assertCorrectMatchSubstringMapping(pattern, text, match)
+            self.assertGreaterEqual(match[2], min_match_length)
+        # Tiles do not overlap each other or marked tokens
+        pattern_tiled = [i for i, _, n in matches for i in range(i, i + n)]
+        text_tiled = [j for _, j, n in matches for j in range(j, j + n)]
+        self.assertEqual(len(pattern_tiled), len(set(pattern_tiled) - pattern_marked))
+        self.assertEqual(len(text_tiled), len(set(text_tiled) - text_marked))
+        # No common substring of minimum match length is left untiled
+        pattern_blocked = set(pattern_tiled) | pattern_marked
+        text_blocked = set(text_tiled) | text_marked
+        pattern_substrings = {
+            pattern[i:i + min_match_length] for i in range(len(pattern) - min_match_length + 1)
+            if pattern_blocked.isdisjoint(range(i, i + min_match_length))
+        }
+        for j in range(len(text) - min_match_length + 1):
+            if text_blocked.isdisjoint(range(j, j + min_match_length)):
+                self.assertNotIn(text[j:j + min_match_length], pattern_substrings)
+
 
 
 class Test1Simple(TestCase):
@@ -158,5 +186,104 @@ class Test3RandomInputLongStrings(TestCase):
             self.assertCorrectMatchSubstringMapping(pattern, text, match)
 
 
+class Test4MatchPairs(TestCase):
+
+    @settings(max_examples=50)
+    @given(
+        texts=strategies.lists(strategies.text(alphabet="abc", max_size=60), min_size=1, max_size=6),
+        min_match_length=strategies.integers(min_value=1, max_value=5),
+        threads=strategies.integers(min_value=0, max_value=3))
+    def test1_same_as_match(self, texts, min_match_length, threads):
+        pairs = [(a, b) for a in range(len(texts)) for b in range(len(texts)) if a != b]
+        counts, tiles, partial = gst.match_pairs(texts, [b''] * len(texts), pairs, min_match_length, threads)
+        self.assertEqual(partial, bytes(len(pairs)))
+        counts = array.array("I", counts)
+        tiles = array.array("I", tiles)
+        self.assertEqual(len(counts), len(pairs))
+        self.assertEqual(len(tiles), 3 * sum(counts))
+        begin = 0
+        for (a, b), count in zip(pairs, counts):
+            pair_tiles = [tuple(tiles[k:k + 3]) for k in range(begin, begin + 3 * count, 3)]
+            begin += 3 * count
+            # The shorter string is used as the pattern
+            if len(texts[b]) < len(texts[a]):
+                expected = [(i, j, n) for j, i, n in gst.match(texts[b], '', texts[a], '', min_match_length)]
+            else:
+                expected = gst.match(texts[a], '', texts[b], '', min_match_length)
+            self.assertEqual(pair_tiles, expected)
+            for match in pair_tiles:
+                self.assertCorrectMatchSubstringMapping(texts[a], texts[b], match)
+
+    def test2_work_budget(self):
+        # Long runs of a repeating token broken by marks produce a quadratic amount of candidate matches
+        text = "a" * 3000
+        marks_a = pack_marks(i for i in range(len(text)) if i % 9 == 0)
+        marks_b = pack_marks(i for i in range(len(text)) if i % 7 == 0)
+        counts, tiles, partial = gst.match_pairs([text, text], [marks_a, marks_b], [(0, 1)], 3, 1, 10000)
+        self.assertEqual(partial, b'\x01')
+        tiles = array.array("I", tiles)
+        self.assertEqual(len(tiles), 3 * array.array("I", counts)[0])
+        _, unlimited_tiles, unlimited_partial = gst.match_pairs([text, text], [marks_a, marks_b], [(0, 1)], 3)
+        self.assertEqual(unlimited_partial, b'\x00')
+        self.assertLess(len(tiles), len(unlimited_tiles))
+
+    def test3_invalid_pairs(self):
+        with self.assertRaises(gst.MatchError):
+            gst.match_pairs(["abc"], [b''], [(0, 1)], 1)
+        with self.assertRaises(gst.MatchError):
+            gst.match_pairs(["abc", "abc"], [b''], [(0, 1)], 1)
+
+
+class Test5MatchSuffixArray(TestCase):
+
+    def test1_single_full_match(self):
+        pattern = b"hello"
+        text = b"how delightful, hello there"
+        matches = gst.match_suffix_array(pattern, b'', text, b'', len(pattern))
+        self.assertEqual(matches, [(0, 16, 5)])
+
+    @settings(max_examples=200)
+    @given(
+        pattern=strategies.text(alphabet="abc", max_size=60),
+        text=strategies.text(alphabet="abc", max_size=60),
+        pattern_marked=strategies.sets(strategies.integers(min_value=0, max_value=59)),
+        text_marked=strategies.sets(strategies.integers(min_value=0, max_value=59)),
+        min_match_length=strategies.integers(min_value=1, max_value=5))
+    def test2_maximal_tiling(self, pattern, text, pattern_marked, text_marked, min_match_length):
+        matches = gst.match_suffix_array(
+                pattern, pack_marks(pattern_marked), text, pack_marks(text_marked), min_match_length)
+        self.assertMaximalTiling(pattern, pattern_marked, text, text_marked, min_match_length, matches)
+
+
+class Test6MatchAll(TestCase):
+
+    @settings(max_examples=50)
+    @given(
+        texts=strategies.lists(strategies.text(alphabet="abc", max_size=40), max_size=6),
+        min_match_length=strategies.integers(min_value=1, max_value=5))
+    def test1_maximal_tiling_of_all_pairs(self, texts, min_match_length):
+        pairs, tiles = gst.match_all(texts, [b''] * len(texts), min_match_length)
+        pairs = array.array("I", pairs)
+        tiles = array.array("I", tiles)
+        self.assertEqual(len(tiles), 3 * sum(pairs[2::3]))
+        pair_tiles = {}
+        begin = 0
+        for k in range(0, len(pairs), 3):
+            a, b, count = pairs[k:k + 3]
+            pair_tiles[(a, b)] = [tuple(tiles[t:t + 3]) for t in range(begin, begin + 3 * count, 3)]
+            begin += 3 * count
+        for a in range(len(texts)):
+            for b in range(a + 1, len(texts)):
+                matches = pair_tiles.pop((a, b), [])
+                self.assertMaximalTiling(texts[a], set(), texts[b], set(), min_match_length, matches)
+        self.assertEqual(pair_tiles, {})
+
+    def test2_first_count_and_max_matches(self):
+        texts = ["abcabc", "abcxyz", "xyzabc"]
+        pairs, _ = gst.match_all(texts, [b''] * 3, 3, 1)
+        self.assertEqual(array.array("I", pairs).tolist(), [0, 1, 1, 0, 2, 1])
+        self.assertIsNone(gst.match_all(texts, [b''] * 3, 3, 3, 1))
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -4,8 +4,11 @@
 #include <iostream>
 #include <limits>
 #include <random>
+#include <string>
+#include <vector>
 
 #include "gst.hpp"
+#include "suffix_array.hpp"
 #include "data_generator.hpp"
 
 
@@ -61,7 +64,7 @@ std::ostream& operator<<(std::ostream& os, const Result& res) {
 }
 
 template<class T>
-Result bench_match_strings(const TestArgs<T>& args) {
+Result bench_match_strings(const TestArgs<T>& args, bool suffix_array = false) {
     const auto init_search_length = std::min(20lu, args.pattern_size);
     auto iterations = args.iterations;
     Result res;
@@ -71,7 +74,11 @@ Result bench_match_strings(const TestArgs<T>& args) {
         const std::string pattern = random_string_copy(text, args.random_copy_prob);
 
         auto start = std::chrono::high_resolution_clock::now();
-        const auto& tiles = match_strings(pattern, text, init_search_length);
+        const auto& tiles = suffix_array
+            ? match_suffix_array(
+                pattern.data(), pattern.size(), text.data(), text.size(), init_search_length,
+                { "", 0, false }, { "", 0, false })
+            : match_strings(pattern, text, init_search_length);
         auto end = std::chrono::high_resolution_clock::now();
 
         std::chrono::duration<double> elapsed = end - start;
@@ -97,9 +104,96 @@ Result bench_match_strings(const TestArgs<T>& args) {
     return res;
 }
 
+/*
+ * Pairs of inputs known to make matching slow.
+ */
+struct PathologicalCase {
+    const char* name;
+    std::string pattern;
+    std::string pattern_marks;
+    std::string text;
+    std::string text_marks;
+    match_length_t init_search_length;
+};
+
+std::string periodic_marks(std::size_t size, std::size_t period) {
+    std::string marks(size, '0');
+    for (std::size_t i = 0; i < size; i += period) {
+        marks[i] = '1';
+    }
+    return marks;
+}
+
+std::string repeat(const std::string& s, std::size_t count) {
+    std::string repeated;
+    while (count-- > 0) {
+        repeated += s;
+    }
+    return repeated;
+}
+
+std::vector<PathologicalCase> pathological_cases() {
+    return {
+        // Long runs of one character broken by marks with different periods,
+        // every unmarked pattern substring matches every unmarked text substring
+        { "runs with marks", std::string(20000, 'a'), periodic_marks(20000, 9),
+            std::string(20000, 'a'), periodic_marks(20000, 7), 3 },
+        // Periodic strings with a shifted copy, which used to loop until the 10 repeats guard in match_strings
+        { "shifted periods", repeat("kjnjnjnjnnjnhnjn", 1000), "",
+            "njn" + repeat("kjnjnjnjnnjnhnjn", 1000), "", 1 },
+        { "two characters", repeat("ab", 10000), periodic_marks(20000, 5),
+            repeat("ba", 10000), periodic_marks(20000, 11), 2 },
+    };
+}
+
+void bench_pathological(const MatchBudget& budget) {
+    for (const auto& c : pathological_cases()) {
+        bool partial = false;
+        auto start = std::chrono::high_resolution_clock::now();
+        const auto& tiles = match_strings(
+                c.pattern.data(), c.pattern.size(),
+                c.text.data(), c.text.size(),
+                c.init_search_length,
+                { c.pattern_marks.data(), c.pattern_marks.size(), false },
+                { c.text_marks.data(), c.text_marks.size(), false },
+                budget,
+                partial);
+        auto end = std::chrono::high_resolution_clock::now();
+        std::chrono::duration<double> elapsed = end - start;
+
+        for (auto& tile : tiles) {
+            if (c.pattern.substr(tile.pattern_index, tile.match_length)
+                    != c.text.substr(tile.text_index, tile.match_length)) {
+                std::cerr << "FALSE MATCH in " << c.name << std::endl;
+                assert(false);
+            }
+        }
+        std::cout << std::setw(table_width + 5) << c.name
+                  << std::setw(table_width) << c.pattern.size()
+                  << std::setw(table_width) << tiles.size()
+                  << std::setw(table_width) << (partial ? "partial" : "complete")
+                  << std::setw(table_width) << std::setprecision(4) << elapsed.count()
+                  << std::endl;
+    }
+}
+
 int main() {
 
     std::cout << "\nBENCHMARKING\n" << std::endl;
+    std::cout << "Pathological inputs with a budget of 10^7 probes" << std::endl;
+    {
+        std::cout << std::setw(table_width + 5) << "input"
+                  << std::setw(table_width) << "string length"
+                  << std::setw(table_width) << "total matches"
+                  << std::setw(table_width) << "result"
+                  << std::setw(table_width) << "time (s)"
+                  << std::endl;
+        MatchBudget budget;
+        budget.max_probes = 10000000;
+        bench_pathological(budget);
+        std::cout << std::endl;
+    }
+
     std::cout << "Tiny random strings" << std::endl;
     {
         double total_time = 0;
@@ -154,6 +248,24 @@ int main() {
         std::cout << std::endl;
     }
 
+    std::cout << "Long random strings, suffix array matching" << std::endl;
+    {
+        double total_time = 0;
+        constexpr auto iterations = 25;
+        constexpr auto text_len = 50000;
+        constexpr auto pattern_len = text_len;
+        dump_result_header(std::cout);
+        for (auto p = 0; p <= 4; ++p) {
+            const float copy_prob = 0.5f + p / 8.0f;
+            const TestArgs<match_length_t> args{ iterations, text_len, pattern_len, copy_prob};
+            auto res = bench_match_strings(args, true);
+            std::cout << res  << std::endl;
+            total_time += res.total_time;
+        }
+        std::cout << "5 * " << iterations << " iterations, total (sec): " << std::setprecision(2) << total_time << std::endl;
+        std::cout << std::endl;
+    }
+
     std::cout << "Very long random strings" << std::endl;
     {
         double total_time = 0;
@@ -1,9 +1,11 @@
 import logging
 from django.conf import settings
-from matcher.greedy_string_tiling.matchlib.util import TokenMatch
+from django.db import transaction
+from matcher.greedy_string_tiling.matchlib.util import TokenMatch, pack_int_rows
+from matcher.helper import swap_positions
 import radar.config as config_loaders
 
-from data.models import Comparison
+from data.models import Comparison, Submission
 
 logger = logging.getLogger("radar.matcher")
 
@@ -16,10 +18,14 @@ def top_marks(length, top):
     return '1' * top + '0' * (length - top)
 
 
-def update_submission(submission_a, similarity, submission_b):
+# Submission fields modified by set_matched
+MATCHED_SUBMISSION_FIELDS = ["matched", "matching_start_time", "invalid", "max_similarity", "max_with"]
+
+
+def set_matched(submission_a, similarity, submission_b):
     """
-    After matching a submission, update all flags and set new max similarity if the resulting similarity is highest
-     so far.
+    Update all flags of a matched submission and set new max similarity if the resulting similarity is highest
+     so far, without saving the submission.
     """
     submission_a.matched = True
     submission_a.matching_start_time = None
@@ -27,6 +33,14 @@ def update_submission(submission_a, similarity, submission_b):
     if submission_a.max_similarity < similarity:
         submission_a.max_similarity = similarity
         submission_a.max_with = submission_b
+
+
+def update_submission(submission_a, similarity, submission_b):
+    """
+    After matching a submission, update all flags and set new max similarity if the resulting similarity is highest
+     so far.
+    """
+    set_matched(submission_a, similarity, submission_b)
     submission_a.save()
 
     # We don't need auto pause anymore because all matching tasks are started manually
@@ -39,14 +53,71 @@ def update_submission(submission_a, similarity, submission_b):
     #             submission.exercise.save()
 
 
+def store_match_results(results):
+    """
+    Create Comparison instances in both directions for a batch of matchlib results and update the max similarities
+    of all compared submissions.
+    Every result is a list of [id_a, id_b, match_indexes, similarity_a, similarity_b].
+    Pairs of the same submission or the same student are skipped.
+    All submissions are fetched with one query, and the Comparisons and submission updates are written in bulk.
+    The submissions are locked until the batch is stored, so that concurrently stored batches do not overwrite
+    each other's max similarities.
+    Return the set of ids of the submissions that were updated.
+    """
+    submission_ids = {r[0] for r in results} | {r[1] for r in results}
+    comparisons = []
+    updated = {}
+
+    with transaction.atomic():
+        # Rows are locked in the order of their ids to avoid deadlocks between concurrent batches
+        submissions = {
+            s.pk: s for s in Submission.objects.select_for_update().filter(pk__in=submission_ids).order_by("pk")
+        }
+        for id_a, id_b, match_indexes, similarity_a, similarity_b in results:
+            a, b = submissions.get(id_a), submissions.get(id_b)
+            if a is None or b is None:
+                logger.warning("Submission %s or %s no longer exists, skipping match result", id_a, id_b)
+                continue
+            if a == b or a.student_id == b.student_id:
+                continue
+
+            # Create Comparison instances for both submissions
+            comparisons.append(Comparison(
+                submission_a=a,
+                submission_b=b,
+                similarity=similarity_a,
+                matches_packed=pack_int_rows(match_indexes, 3),
+            ))
+            comparisons.append(Comparison(
+                submission_a=b,
+                submission_b=a,
+                similarity=similarity_b,
+                matches_packed=pack_int_rows(swap_positions([list(m) for m in match_indexes]), 3),
+            ))
+
+            # Update max similarity for both submissions, in the order the results were received
+            set_matched(a, similarity_a, b)
+            set_matched(b, similarity_b, a)
+            updated[a.id] = a
+            updated[b.id] = b
+
+        Comparison.objects.bulk_create(comparisons, batch_size=settings.MATCH_STORE_BATCH_SIZE)
+        Submission.objects.bulk_update(
+            updated.values(), MATCHED_SUBMISSION_FIELDS, batch_size=settings.MATCH_STORE_BATCH_SIZE
+        )
+
+    return set(updated)
+
+
 def match_against_template(submission):
     """
     Match submission against the exercise template.
+    Return the template comparison and update the template marks of the submission, without saving either.
     """
     logger.debug("Match %s vs template", submission.student.key)
     # Template comparisons are defined as Comparison objects where the other (b) submission is null
     comparison = Comparison(
-        submission_a=submission, submission_b=None, similarity=0.0, matches_json="[]"
+        submission_a=submission, submission_b=None, similarity=0.0, matches_packed=pack_int_rows([], 3)
     )
 
     submission_tokens, template_tokens = (
@@ -69,7 +140,7 @@ def match_against_template(submission):
     template_marks = top_marks(len(template_tokens), template_head_match_count)
 
     # Import similarity function and do comparison
-    similarity_function = config_loaders.named_function(settings.MATCH_ALGORITHM)
+    similarity_function = config_loaders.named_function(config_loaders.match_algorithm(submission.exercise.tokenizer))
     matches = similarity_function(
         submission_tokens,
         submission_marks,
@@ -82,6 +153,10 @@ def match_against_template(submission):
         matches.add_non_overlapping(TokenMatch(0, 0, template_head_match_count))
 
     comparison.similarity = safe_div(matches.token_count(), len(submission_tokens))
-    comparison.matches_json = matches.json()
+    template_matches = matches.match_list()
+    comparison.set_matches(template_matches)
+
+    # Store the template marks so they need not be recomputed on every matching run
+    submission.set_template_marks(template_matches)
 
     return comparison
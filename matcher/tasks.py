@@ -1,12 +1,16 @@
+import datetime
+
 from django.conf import settings
 import celery
 from celery.utils.log import get_task_logger
 # Matchlib can also be deployed to a Kubernetes node, easing the task load by allowing elastic parallel task processing
 from matcher.greedy_string_tiling.matchlib.tasks import match_all_combinations
+from matcher.greedy_string_tiling.matchlib.matcher import match_new_to_others, result_batches
+from matcher.greedy_string_tiling.matchlib import store
 from matcher import matcher
-from matcher.helper import swap_positions
+import radar.config as config_loaders
 
-from data.models import Exercise, Submission, Comparison, TaskError
+from data.models import Exercise, Submission, TaskError
 
 logger = get_task_logger(__name__)
 
@@ -38,6 +42,74 @@ def match_against_template(submission_id):
         submission.invalid = True
 
     template_comparison.save()
+    submission.save(update_fields=[
+        "invalid", "template_marks_packed", "authored_token_count", "longest_authored_tile"
+    ])
+
+
+@celery.shared_task(ignore_result=True)
+def match_new_submissions(exercise_id):
+    """
+    Incrementally match all valid, yet unmatched submissions of an exercise against the already matched submissions.
+    Existing Comparisons are kept and the max similarities of the matched submissions are updated in place,
+    so the cost of this task grows with the amount of new submissions instead of the square of all submissions.
+    Each new submission is also compared to the new submissions created before it.
+    The exercise is marked as being matched for the duration of the task, so that overlapping runs
+    do not compare the same new submissions twice.
+    """
+    exercise = Exercise.objects.get(pk=exercise_id)
+    run_timestamp = "incremental " + datetime.datetime.utcnow().isoformat()
+    if not Exercise.objects.filter(pk=exercise_id, matching_start_time__isnull=True).update(
+        matching_start_time=run_timestamp
+    ):
+        logger.warning("Exercise %s is currently being matched, skipping incremental matching", exercise)
+        return
+    try:
+        _match_new_submissions(exercise)
+    finally:
+        # A full matching run started meanwhile has replaced the timestamp and is left untouched
+        Exercise.objects.filter(pk=exercise_id, matching_start_time=run_timestamp).update(matching_start_time=None)
+
+
+def _match_new_submissions(exercise):
+    new_submissions = exercise.valid_unmatched_submissions
+    matched_submissions = exercise.valid_matched_submissions
+    if not exercise.use_staff_submissions:
+        new_submissions = new_submissions.exclude(student__is_staff=True)
+        matched_submissions = matched_submissions.exclude(student__is_staff=True)
+    new_submissions = list(new_submissions.order_by("created"))
+    logger.info("Incrementally matching %d new submissions to exercise %s", len(new_submissions), exercise)
+    if not new_submissions:
+        return
+
+    new_list = []
+    for submission in new_submissions:
+        if submission.template_comparison is None:
+            match_against_template(submission.id)
+            submission.refresh_from_db()
+        if not submission.invalid:
+            new_list.append(submission)
+
+    compare_list = [
+        s.as_dict()
+        for s in matched_submissions.exclude(longest_authored_tile__lt=exercise.minimum_match_tokens)
+    ]
+    student_ids = {s.id: s.student_id for s in matched_submissions.only("id", "student")}
+    student_ids.update((s.id, s.student_id) for s in new_list)
+    # All new submissions are compared in one run, starting the worker pool only once
+    matches = match_new_to_others(
+        match_config(exercise), [s.as_dict() for s in new_list], compare_list, student_ids
+    )
+    matcher.store_match_results(matches)
+    # Submissions without any similar matched submissions are matched as well
+    Submission.objects.filter(pk__in=[s.pk for s in new_list], matched=False).update(
+        matched=True, matching_start_time=None
+    )
+
+    # Similarity is no longer valid because there are new matches
+    exercise.course.similarity_graph_json = ''
+    exercise.course.clusters_json = ''
+    exercise.course.save()
 
 
 @celery.shared_task(ignore_result=True)
@@ -47,6 +119,8 @@ def match_all_new_submissions_to_exercise(exercise_id, delay=True):
     The exercise and all its submissions must have their matching_start_time timestamps synchronized before
     this task is started, otherwise this does nothing. Also matches every submission to the exercise template.
     The resulting matching task is JSON serializable and can be consumed by any deployed matchlib instance.
+    If MATCH_TOKEN_STORE_DIRECTORY is set, the submissions are written into the shared token store
+    and the task contains only a reference to them.
     """
     logger.info("Matching all submissions to exercise with id %d", exercise_id)
     exercise = Exercise.objects.get(pk=exercise_id)
@@ -55,22 +129,28 @@ def match_all_new_submissions_to_exercise(exercise_id, delay=True):
             "Exercise %s has a None matching_start_time timestamp. E.g. the exercise does not expect results."
         )
         return
-    config = {
-        "minimum_match_length": exercise.minimum_match_tokens,
-        "minimum_similarity": settings.MATCH_STORE_MIN_SIMILARITY,
-        "similarity_precision": settings.SIMILARITY_PRECISION,
-        "exercise_id": exercise_id,
-        # This timestamp is used as a checksum of expected results when the results come in
-        "matching_start_time": exercise.matching_start_time,
-    }
+    config = match_config(exercise)
     # JSON serializable list of submissions
     compare_list = [s.as_dict() for s in exercise.get_submissions]
-    # Match all, then handle results when all matches are available
-    if delay:
+    # Match all and store the results in batches, finishing the matching when all batches are stored
+    if delay and settings.MATCH_TOKEN_STORE_DIRECTORY:
+        # Send only a reference to the submissions written into the shared token store
+        store.prune_blobs(settings.MATCH_TOKEN_STORE_DIRECTORY, settings.MATCH_TOKEN_STORE_MAX_AGE)
+        config["token_store"] = store.write_run(
+            settings.MATCH_TOKEN_STORE_DIRECTORY, exercise_id, exercise.matching_start_time, compare_list
+        )
+        match_all_combinations.delay(config, None, delay)
+    elif delay:
         match_all_combinations.delay(config, compare_list, delay)
     else:
-        matches = match_all_combinations(config, compare_list)
-        handle_match_results(matches)
+        # Store the matches in batches as soon as they are completed, so that memory use does not grow
+        # with the amount of submission pairs
+        config["exercise_name"] = exercise.name
+        config["course_name"] = exercise.course.name
+        submissions_updated = set()
+        for results in result_batches(config, compare_list):
+            submissions_updated |= matcher.store_match_results(results)
+        finish_match_results(exercise, config, submissions_updated)
 
 
 @celery.shared_task(ignore_result=True)
@@ -105,53 +185,33 @@ def handle_match_results(matches: dict[str, any]):
         return
 
     # Get keys for the matchlib results
-    submissions_updated = set()
     meta = matches["meta"]
-    id_a_key = meta.index("id_a")
-    id_b_key = meta.index("id_b")
-    similarity_key_a = meta.index("similarity_a")
-    similarity_key_b = meta.index("similarity_b")
-    matches_json_key = meta.index("match_indexes")
-
-    # Update max similarity for every submission
-    for match in matches["results"]:
-        a = Submission.objects.get(pk=match[id_a_key])
-        b = Submission.objects.get(pk=match[id_b_key])
-        if a == b or a.student == b.student:
-            continue
-        submissions_updated.add(id_a_key)
-        submissions_updated.add(id_b_key)
-        similarity_a = match[similarity_key_a]
-        similarity_b = match[similarity_key_b]
-        matches_json = match[matches_json_key]
-
-        # Create Comparison instances for both submissions
-        Comparison.objects.create(
-            submission_a=a,
-            submission_b=b,
-            similarity=similarity_a,
-            matches_json=matches_json,
-        )
-        Comparison.objects.create(
-            submission_a=b,
-            submission_b=a,
-            similarity=similarity_b,
-            matches_json=swap_positions(matches_json),
-        )
+    keys = [meta.index(key) for key in ("id_a", "id_b", "match_indexes", "similarity_a", "similarity_b")]
 
-        # Update max similarity for both submissions
-        matcher.update_submission(a, similarity_a, b)
-        matcher.update_submission(b, similarity_b, a)
+    # Create Comparisons and update max similarity for every submission
+    submissions_updated = matcher.store_match_results(
+        [[match[key] for key in keys] for match in matches["results"]]
+    )
 
+    finish_match_results(exercise, matches["config"], submissions_updated)
+
+
+def finish_match_results(exercise, config, submissions_updated):
+    """
+    Finish matching all submissions of an exercise after all results have been stored.
+    Set zero max similarity for all submissions that were not in results but were expecting results,
+    and clear the matching timestamp of the exercise.
+    """
     logger.info("Match results processed for %d submissions", len(submissions_updated))
 
+    expected_result_count = exercise.get_submissions.count()
     if len(submissions_updated) < expected_result_count:
         num_missing = expected_result_count - len(submissions_updated)
-        if "minimum_similarity" in matches["config"]:
+        if "minimum_similarity" in config:
             logger.info(
                 "Assuming missing %d submissions had a similarity lower than %.2f",
                 num_missing,
-                matches["config"]["minimum_similarity"],
+                config["minimum_similarity"],
             )
         else:
             logger.warning(
@@ -168,6 +228,36 @@ def handle_match_results(matches: dict[str, any]):
     exercise.save()
 
 
+def match_config(exercise):
+    """
+    Return the matchlib configuration for matching the submissions of an exercise.
+    """
+    return {
+        "minimum_match_length": exercise.minimum_match_tokens,
+        "match_algorithm": config_loaders.match_algorithm(exercise.tokenizer),
+        "minimum_similarity": settings.MATCH_STORE_MIN_SIMILARITY,
+        "similarity_precision": settings.SIMILARITY_PRECISION,
+        "pair_selection": settings.MATCH_PAIR_SELECTION,
+        "fingerprint_kgram_length": settings.MATCH_FINGERPRINT_KGRAM_LENGTH,
+        "fingerprint_minimum_shared": settings.MATCH_FINGERPRINT_MIN_SHARED,
+        "similarity_prefilter": settings.MATCH_SIMILARITY_PREFILTER,
+        "prefilter_ngram_length": settings.MATCH_PREFILTER_NGRAM_LENGTH,
+        "block_size": settings.MATCH_BLOCK_SIZE,
+        "backend": settings.MATCH_BACKEND,
+        "native_threads": settings.MATCH_NATIVE_THREADS,
+        "index_max_matches": settings.MATCH_INDEX_MAX_MATCHES,
+        "max_probes": settings.MATCH_PAIR_MAX_PROBES,
+        "max_milliseconds": settings.MATCH_PAIR_MAX_MILLISECONDS,
+        "pair_cache_path": settings.MATCH_PAIR_CACHE_PATH,
+        "pair_cache_max_entries": settings.MATCH_PAIR_CACHE_MAX_ENTRIES,
+        "result_batch_size": settings.MATCH_STORE_BATCH_SIZE,
+        "slow_batch_seconds": settings.MATCH_SLOW_BATCH_SECONDS,
+        "exercise_id": exercise.id,
+        # This timestamp is used as a checksum of expected results when the results come in
+        "matching_start_time": exercise.matching_start_time,
+    }
+
+
 def write_error(message, namespace):
     logger.error(message)
     TaskError(package="matcher", namespace=namespace, error_string=message).save()
@@ -1,10 +1,22 @@
-from django.test import TestCase
-from data.models import Student, Course, Submission
-from matcher import tasks
+import os
+import tempfile
+from random import Random
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from data.models import Comparison, Course, Exercise, MatchingRun, Student, Submission
+from matcher import matcher, tasks
+from matcher.greedy_string_tiling.matchlib.fingerprints import candidate_pairs
+from matcher.greedy_string_tiling.matchlib.prefilter import similar_pairs
+from matcher.greedy_string_tiling.matchlib import matcher as matchlib_matcher
+from matcher.greedy_string_tiling.matchlib import matchers
+from matcher.greedy_string_tiling.matchlib import paircache
+from matcher.greedy_string_tiling.matchlib.util import TokenMatch, TokenMatchSet
 from aplus_client.django.models import ApiNamespace
 
 TOKENS1 = "ABCD, Testing"
 TOKENS2 = "123123 Test"
+SHARED_TOKENS = "ABCDEFGHIJKLMNOPQRST"
 
 
 # Test for matcher calls
@@ -49,5 +61,312 @@ class TestMatcher(TestCase):
         self.assertTrue(submission_a in exercise.valid_matched_submissions)
         self.assertTrue(submission_b in exercise.valid_matched_submissions)
 
+    # Test incremental matching to see that new submissions are matched without clearing existing comparisons
+    def test_run_match_new_submissions(self):
+        site = ApiNamespace(601)
+        site.save()
+
+        course = Course(id=601, api_id=601, namespace_id=601)
+        course.save()
+
+        exercise = course.get_exercise("TestCourse")
+
+        student_a = Student(key=5000, course=course)
+        student_b = Student(key=6000, course=course)
+        student_c = Student(key=6001, course=course)
+        student_a.save()
+        student_b.save()
+        student_c.save()
+        submission_a = Submission(
+            key=5000,
+            exercise=exercise,
+            student=student_a,
+            matched=False,
+            tokens=SHARED_TOKENS + "abcdefghijklmnopqrst",
+            source_checksum="a",
+        )
+        submission_c = Submission(
+            key=6001,
+            exercise=exercise,
+            student=student_c,
+            matched=False,
+            tokens=SHARED_TOKENS + "0123456789!#%&/()=?@",
+            source_checksum="c",
+        )
+        submission_a.save()
+        submission_c.save()
+
+        exercise.touch_all_timestamps()
+        tasks.match_exercise(exercise.pk, delay=False)
+        comparisons = Comparison.objects.filter(submission_a__exercise=exercise)
+        first_comparisons = set(comparisons.filter(submission_b__isnull=False).values_list("pk", flat=True))
+        self.assertTrue(first_comparisons)
+        submission_a.refresh_from_db()
+        self.assertEqual(submission_a.max_with, submission_c)
+
+        submission_b = Submission(
+            key=6000,
+            exercise=exercise,
+            student=student_b,
+            matched=False,
+            tokens=SHARED_TOKENS + "abcdefghijklmnopqrst",
+            source_checksum="a",
+        )
+        submission_b.save()
+
+        # Overlapping runs are skipped while the exercise is being matched
+        Exercise.objects.filter(pk=exercise.pk).update(matching_start_time="2024-01-01T00:00:00")
+        tasks.match_new_submissions(exercise.pk)
+        self.assertFalse(submission_b in exercise.valid_matched_submissions)
+        Exercise.objects.filter(pk=exercise.pk).update(matching_start_time=None)
+
+        tasks.match_new_submissions(exercise.pk)
+
+        exercise.refresh_from_db()
+        self.assertIsNone(exercise.matching_start_time)
+        self.assertTrue(submission_a in exercise.valid_matched_submissions)
+        self.assertTrue(submission_b in exercise.valid_matched_submissions)
+        # The comparisons of the first run are kept
+        self.assertTrue(first_comparisons.issubset(set(comparisons.values_list("pk", flat=True))))
+        self.assertTrue(comparisons.filter(submission_a=submission_b, submission_b=submission_a).exists())
+        self.assertTrue(comparisons.filter(submission_a=submission_a, submission_b=submission_b).exists())
+        # The identical submissions are now the most similar ones of each other
+        submission_a.refresh_from_db()
+        submission_b.refresh_from_db()
+        self.assertEqual(submission_a.max_with, submission_b)
+        self.assertEqual(submission_b.max_with, submission_a)
+        self.assertEqual(submission_a.max_similarity, 1.0)
+        self.assertEqual(submission_b.max_similarity, 1.0)
+
+
+# Tests for storing batches of match results
+class TestStoreMatchResults(TestCase):
+
+    def test_overlapping_batches_keep_the_highest_similarity(self):
+        site = ApiNamespace(603)
+        site.save()
+        course = Course(id=603, api_id=603, namespace_id=603)
+        course.save()
+        exercise = course.get_exercise("TestCourse")
+        submissions = []
+        for key in (8000, 8001, 8002, 8003):
+            student = Student(key=key, course=course)
+            student.save()
+            submission = Submission(key=key, exercise=exercise, student=student, tokens=TOKENS1)
+            submission.save()
+            submissions.append(submission)
+        a, b, c, d = submissions
+
+        matcher.store_match_results([[a.id, b.id, [[0, 0, 10]], 0.9, 0.8]])
+        # The second batch overlaps the first one at submission a, with a lower similarity
+        matcher.store_match_results([[a.id, c.id, [[0, 0, 5]], 0.5, 0.4]])
+
+        a.refresh_from_db()
+        b.refresh_from_db()
+        c.refresh_from_db()
+        self.assertEqual((a.max_similarity, a.max_with), (0.9, b))
+        self.assertEqual((b.max_similarity, b.max_with), (0.8, a))
+        self.assertEqual((c.max_similarity, c.max_with), (0.4, a))
+
+        # A later batch with a higher similarity replaces the max similarity
+        matcher.store_match_results([[d.id, a.id, [[0, 0, 12]], 0.95, 0.99]])
+        a.refresh_from_db()
+        self.assertEqual((a.max_similarity, a.max_with), (0.99, d))
+        self.assertEqual(Comparison.objects.filter(submission_a=a, submission_b__isnull=False).count(), 3)
+
+
+# Tests for finalizing delayed matching runs after their result batches have been stored
+class TestDelayedMatchingRun(TestCase):
+
+    def test_run_is_finalized_once_after_all_batches(self):
+        site = ApiNamespace(602)
+        site.save()
+        course = Course(id=602, api_id=602, namespace_id=602)
+        course.save()
+        exercise = course.get_exercise("TestCourse")
+        for key, tokens in ((7000, TOKENS1 * 3), (7001, TOKENS1 * 3 + "X"), (7002, TOKENS1 * 3 + "YY")):
+            student = Student(key=key, course=course)
+            student.save()
+            Submission(key=key, exercise=exercise, student=student, tokens=tokens).save()
+        for submission in exercise.submissions.all():
+            tasks.match_against_template(submission.id)
+        exercise.touch_all_timestamps()
+
+        config = tasks.match_config(exercise)
+        config["minimum_similarity"] = 0
+        # Every pair is compared in a block of its own and stored in a batch of its own
+        config["block_size"] = 1
+        config["result_batch_size"] = 1
+        compare_list = [s.as_dict() for s in exercise.get_submissions]
+        sent = []
+        with mock.patch.object(
+            matchlib_matcher.handle_celery_match_result, "delay", lambda results, config: sent.append(results)
+        ):
+            matchlib_matcher.match_all_combinations(config, compare_list, delay=True)
+        self.assertEqual(len(sent), 3)
+
+        finalizations = []
+        finalize = matchlib_matcher._finalize_if_completed
+        with mock.patch.object(
+            matchlib_matcher, "_finalize_if_completed", lambda config: finalizations.append(finalize(config))
+        ):
+            for results in sent:
+                exercise.refresh_from_db()
+                self.assertIsNotNone(exercise.matching_start_time)
+                matchlib_matcher.handle_celery_match_result(results, config)
+            # Batches delivered again after the run was finalized are not counted
+            matchlib_matcher.handle_celery_match_result([], config)
+
+        self.assertEqual(finalizations, [False, False, True])
+        exercise.refresh_from_db()
+        self.assertIsNone(exercise.matching_start_time)
+        self.assertFalse(exercise.submissions.filter(matching_start_time__isnull=False).exists())
+        self.assertFalse(MatchingRun.objects.filter(exercise=exercise).exists())
+
+
+# Tests for the fingerprint index used for selecting submission pairs to compare
+class TestFingerprintIndex(SimpleTestCase):
+
+    def test_pairs_with_long_common_substring_are_selected(self):
+        shared = "abcdefghijklmnopqrst"
+        string_data = [
+            {"tokens": "xxxxx" + shared},
+            {"tokens": shared + "yyyyy"},
+            {"tokens": "zzzzzzzzzzzzzzzzzzzz"},
+        ]
+        self.assertEqual(candidate_pairs(string_data, 15), [(0, 1)])
+
+    def test_marked_tokens_are_ignored(self):
+        shared = "abcdefghijklmnopqrst"
+        string_data = [
+            {"tokens": shared, "ignore_marks": "1" * len(shared)},
+            {"tokens": shared, "ignore_marks": "0" * len(shared)},
+        ]
+        self.assertEqual(candidate_pairs(string_data, 15), [])
+
+
+# Tests for the similarity pre-filter used for dropping submission pairs that cannot be similar enough
+class TestSimilarityPrefilter(SimpleTestCase):
+
+    def test_pairs_that_cannot_be_similar_enough_are_dropped(self):
+        shared = "abcdefghijklmnopqrst"
+        string_data = [
+            {"tokens": shared, "authored_token_count": 20},
+            {"tokens": shared + "uvwxyz", "authored_token_count": 26},
+            {"tokens": "zyxwvutsrq" + shared[:10], "authored_token_count": 20},
+        ]
+        self.assertEqual(similar_pairs(string_data, 10, 0.5), [(0, 1)])
+        self.assertEqual(similar_pairs(string_data, 10, 0.2), [(0, 1), (0, 2), (1, 2)])
+
+    def test_pairs_with_equal_checksums_are_kept(self):
+        string_data = [
+            {"tokens": "abcdefghij", "ignore_marks": "1" * 10, "authored_token_count": 0, "checksum": "a"},
+            {"tokens": "abcdefghij", "ignore_marks": "1" * 10, "authored_token_count": 0, "checksum": "a"},
+        ]
+        self.assertEqual(similar_pairs(string_data, 10, 0.5), [(0, 1)])
+
+
+# Tests for comparing identical submissions only once
+class TestEquivalenceClasses(SimpleTestCase):
+
+    def test_identical_submissions_share_results(self):
+        string_data = [
+            {"id": 1, "tokens": "abcdefghij", "checksum": "a"},
+            {"id": 2, "tokens": "abcdefghij", "checksum": "a"},
+            {"id": 3, "tokens": "abcdefghij", "checksum": "b"},
+            {"id": 4, "tokens": "abcdefghij", "checksum": "a", "ignore_marks": "1111100000"},
+        ]
+        representatives, member_ids = matchlib_matcher._equivalence_classes(string_data)
+        self.assertEqual([data["id"] for data in representatives], [1, 3, 4])
+        self.assertEqual(member_ids, {1: [1, 2], 3: [3], 4: [4]})
+        results = [[1, 3, [[0, 0, 10]], 1.0, 1.0]]
+        self.assertEqual(
+            list(matchlib_matcher._fan_out(results, member_ids)),
+            [[1, 3, [[0, 0, 10]], 1.0, 1.0], [2, 3, [[0, 0, 10]], 1.0, 1.0]],
+        )
+
+
+# Tests for comparing new submissions to the matched ones in one run
+class TestMatchNewToOthers(SimpleTestCase):
+
+    def test_new_data_is_compared_to_all_but_its_own_group(self):
+        def data(id, tokens):
+            return {"id": id, "tokens": tokens, "authored_token_count": 20, "longest_authored_tile": 20}
+
+        others = [data(1, SHARED_TOKENS), data(2, SHARED_TOKENS[::-1])]
+        new = [data(3, SHARED_TOKENS), data(4, SHARED_TOKENS)]
+        config = {"minimum_match_length": 15, "minimum_similarity": 0.5, "backend": "native"}
+        groups = {1: "x", 2: "y", 3: "z", 4: "x"}
+        expected = [(1, 3), (3, 4)]
+        matches = matchlib_matcher.match_new_to_others(config, new, others, groups)
+        self.assertEqual(sorted((m[0], m[1]) for m in matches), expected)
+        # The pairs are compared in a single process if the backend fails
+        with mock.patch.object(matchlib_matcher, "_compare_blocks", side_effect=RuntimeError):
+            matches = matchlib_matcher.match_new_to_others(config, new, others, groups)
+        self.assertEqual(sorted((m[0], m[1]) for m in matches), expected)
+
+
+class TestPairCache(SimpleTestCase):
+
+    def test_cached_pairs_are_not_compared_again(self):
+        string_data = [
+            {"id": 1, "tokens": "abcdefghijklmnop", "authored_token_count": 16, "longest_authored_tile": 16},
+            {"id": 2, "tokens": "xxabcdefghijklxx", "authored_token_count": 16, "longest_authored_tile": 16},
+            {"id": 3, "tokens": "ponmlkjihgfedcba", "authored_token_count": 16, "longest_authored_tile": 16},
+        ]
+        index_pairs = [(0, 1), (0, 2), (1, 2)]
+        config = {"minimum_match_length": 5, "minimum_similarity": -1}
+        expected = matchlib_matcher._match_pairs(config, string_data, index_pairs)
+        with tempfile.TemporaryDirectory() as directory:
+            config["pair_cache_path"] = os.path.join(directory, "pairs.sqlite3")
+            config["pair_cache_max_entries"] = 2
+            for _ in range(2):
+                self.assertEqual(
+                    matchlib_matcher._match_pairs(config, [dict(data) for data in string_data], index_pairs),
+                    expected,
+                )
+            cache = paircache.open_cache(config["pair_cache_path"], 2)
+            self.assertEqual(cache.stats(), {"hits": 2, "misses": 4, "entries": 2})
+
+
+# Tests for the tiles of the suffix array backend, which are valid and maximal but may differ from greedy string tiling
+class TestSuffixArrayTiling(SimpleTestCase):
+
+    def test_tiles_are_valid(self):
+        random = Random(14)
+        tokens = ["".join(random.choice("abc") for _ in range(random.randint(0, 60))) for _ in range(8)]
+        marks = ["".join(random.choice("0001") for _ in range(len(t))) for t in tokens]
+        minimum_length = 3
+        pair_matches = matchers.suffix_array_tiling_all(tokens, marks, minimum_length)
+        self.assertTrue(pair_matches)
+        for (i, j), matches in pair_matches.items():
+            self.assertLess(i, j)
+            tiled_a, tiled_b = set(), set()
+            for a, b, length in matches.match_list():
+                self.assertGreaterEqual(length, minimum_length)
+                self.assertLessEqual(a + length, len(tokens[i]))
+                self.assertLessEqual(b + length, len(tokens[j]))
+                self.assertEqual(tokens[i][a:a + length], tokens[j][b:b + length])
+                # Tiles do not overlap each other or marked tokens
+                self.assertTrue(tiled_a.isdisjoint(range(a, a + length)))
+                self.assertTrue(tiled_b.isdisjoint(range(b, b + length)))
+                tiled_a.update(range(a, a + length))
+                tiled_b.update(range(b, b + length))
+            self.assertNotIn("1", "".join(marks[i][a] for a in tiled_a))
+            self.assertNotIn("1", "".join(marks[j][b] for b in tiled_b))
+
+
+class TestTokenMatchSet(SimpleTestCase):
+
+    def test_non_overlapping_matches(self):
+        matches = TokenMatchSet((20, 0, 5, 0, 10, 5))
+        self.assertFalse(matches.add_non_overlapping(TokenMatch(4, 30, 3)))
+        self.assertFalse(matches.add_non_overlapping(TokenMatch(40, 12, 3)))
+        self.assertTrue(matches.add_non_overlapping(TokenMatch(5, 5, 5)))
+        self.assertEqual(matches.match_list(), [[0, 10, 5], [5, 5, 5], [20, 0, 5]])
+        self.assertEqual(matches.json(), "[[0,10,5],[5,5,5],[20,0,5]]")
+        self.assertEqual(matches.reverse().match_list(), [[0, 20, 5], [5, 5, 5], [10, 0, 5]])
+        self.assertEqual(matches.token_count(), 15)
+
 
 # TODO: Create more tests here
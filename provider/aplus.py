@@ -78,6 +78,17 @@ def recompare(exercise, config):
         matcher_tasks.match_exercise(exercise.id)
 
 
+def match_new_submissions(exercise, config):
+    """
+    Match the new submissions of given exercise incrementally against the already matched submissions.
+    """
+    logger.info("Matching new submissions for exercise %s", exercise)
+    if not DEBUG or CELERY_DEBUG:
+        matcher_tasks.match_new_submissions.delay(exercise.id)
+    else:
+        matcher_tasks.match_new_submissions(exercise.id)
+
+
 def get_api_client(course):
     """
     Return the AplusTokenClient of the radar robot user.
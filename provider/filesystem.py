@@ -1,16 +1,27 @@
+import concurrent.futures
+import itertools
 import os
 import logging
 
+from django.db import connections, transaction
+
 from data import files
+from data.models import Comparison, Submission
 from radar.config import tokenizer_config
-from provider.insert import submission_exists, insert_submission, prepare_submission
+from provider.insert import submission_exists, insert_submission, prepare_submission, source_checksum
 from provider import tasks
+from matcher import matcher
+from tokenizer.tokenizer import cache_tokens, cached_tokens, tokenize_source
 from matcher.tasks import match_exercise
+import matcher.tasks as matcher_tasks
 from radar.settings import DEBUG, CELERY_DEBUG
 
 
 logger = logging.getLogger("radar.provider")
 
+# Amount of submissions created in one transaction by load_submission_dirs
+BULK_BATCH_SIZE = 500
+
 
 def hook(request, course, config):
     logger.info("Ignored hook request for filesystem course %s", course)
@@ -33,6 +44,101 @@ def load_submission_dir(exercise, path):
     return submission
 
 
+def load_submission_dirs(exercise, paths, jobs=1, progress=None):
+    """
+    Inserts submissions from directories for a given exercise in bulk.
+    The directories are read in jobs threads and the sources missing from the tokenizer cache are tokenized
+    in jobs processes, which only run the tokenizer. The submissions and their template comparisons are created
+    with one query each for every BULK_BATCH_SIZE submissions.
+    Unlike load_submission_dir, which raises InsertError, a submission whose source cannot be tokenized
+    is saved as invalid without tokens and the remaining submissions are inserted.
+    If given, progress is called with the amounts of processed and all new submissions after every batch.
+    Returns the list of created submissions.
+    """
+    if not all(os.path.isdir(path) for path in paths):
+        raise NameError("Submissions to add need to be directories")
+    new_paths = {}
+    for path in paths:
+        submitter_id, submission_key = _path_name_to_submission(path)
+        if submission_key in new_paths:
+            logger.info('Skipping duplicate submission %s', submission_key)
+            continue
+        new_paths[submission_key] = (submitter_id, path)
+    keys = list(new_paths)
+    for i in range(0, len(keys), BULK_BATCH_SIZE):
+        existing = Submission.objects.filter(key__in=keys[i:i + BULK_BATCH_SIZE]).values_list("key", flat=True)
+        for submission_key in existing:
+            logger.info('Skipping existing submission %s', submission_key)
+            del new_paths[submission_key]
+
+    t_config = tokenizer_config(exercise.tokenizer)
+    students = {}
+    submissions = []
+    if jobs > 1:
+        # Forked worker processes must not inherit the database connections of this process
+        connections.close_all()
+        readers = concurrent.futures.ThreadPoolExecutor(jobs)
+        tokenizers = concurrent.futures.ProcessPoolExecutor(jobs)
+    else:
+        readers = tokenizers = None
+
+    try:
+        items = list(new_paths.items())
+        for i in range(0, len(items), BULK_BATCH_SIZE):
+            batch = items[i:i + BULK_BATCH_SIZE]
+            batch_paths = [path for _, (_, path) in batch]
+            texts = _map(readers, lambda path: files.join_files(_read_directory(path), t_config), batch_paths)
+            tokenized = cached_tokens(texts, exercise.tokenizer)
+            missing = [n for n, cached in enumerate(tokenized) if cached is None]
+            missing_texts = [texts[n] for n in missing]
+            missing_tokenized = _map(tokenizers, tokenize_source, missing_texts, itertools.repeat(t_config))
+            cache_tokens(missing_texts, exercise.tokenizer, missing_tokenized)
+            for n, result in zip(missing, missing_tokenized):
+                tokenized[n] = result
+            batch_submissions = []
+            comparisons = []
+            for (submission_key, (submitter_id, _)), text, (tokens, indexes) in zip(batch, texts, tokenized):
+                if submitter_id not in students:
+                    students[submitter_id] = exercise.course.get_student(str(submitter_id))
+                submission = Submission(key=submission_key, exercise=exercise, student=students[submitter_id])
+                batch_submissions.append(submission)
+                if not tokens:
+                    logger.error(
+                        "Tokenizer returned an empty token string for submission %s, marking it invalid",
+                        submission_key,
+                    )
+                    submission.invalid = True
+                    continue
+                submission.tokens = tokens
+                submission.set_indexes(indexes)
+                submission.source_checksum = source_checksum(text)
+                # Check if submission is the same as the exercise template
+                template_comparison = matcher.match_against_template(submission)
+                if template_comparison.similarity == 100.0:
+                    submission.invalid = True
+                comparisons.append(template_comparison)
+
+            with transaction.atomic():
+                Submission.objects.bulk_create(batch_submissions)
+                Comparison.objects.bulk_create(comparisons)
+            # Submission texts are stored by the primary keys of the submissions
+            _map(readers, lambda args: files.put_submission_text(*args), zip(batch_submissions, texts))
+            submissions.extend(batch_submissions)
+            if progress is not None:
+                progress(len(submissions), len(new_paths))
+    finally:
+        if readers is not None:
+            readers.shutdown()
+            tokenizers.shutdown()
+    return submissions
+
+
+def _map(executor, fn, *iterables):
+    if executor is None:
+        return list(map(fn, *iterables))
+    return list(executor.map(fn, *iterables, chunksize=16))
+
+
 def _path_name_to_submission(path):
     p = os.path.abspath(path)
     timestamp = os.path.basename(p)
@@ -74,6 +180,15 @@ def recompare(exercise, config):
         # matcher_tasks.match_exercise(exercise.id)
 
 
+def match_new_submissions(exercise, config):
+    logger.info("Matching new submissions for exercise %s", exercise)
+    if CELERY_DEBUG:
+        matcher_tasks.match_new_submissions.delay(exercise.pk)
+    elif DEBUG:
+        matcher_tasks.match_new_submissions(exercise.pk)
+    # Else matching proceeds with CLI command
+
+
 def recompare_all_unmatched(course):
     tasks.recompare_all_unmatched(course.id)
 
@@ -39,6 +39,14 @@ def remove_first_and_last_comment(text: str) -> str:
     return '\n'.join(lines)
 
 
+def source_checksum(submission_text):
+    """
+    Compute checksum of submitted source code for finding exact character matches quickly.
+    """
+    submission_text_without_newlines = remove_first_and_last_comment(submission_text)
+    return hashlib.md5(submission_text_without_newlines.encode("utf-8")).hexdigest()
+
+
 def prepare_submission(submission, matching_start_time=''):
 
     if matching_start_time:
@@ -59,7 +67,7 @@ def prepare_submission(submission, matching_start_time=''):
             "Failed to get submission text for submission %s" % submission
         )
 
-    tokens, json_indexes = tokenizer.tokenize_submission(
+    tokens, indexes = tokenizer.tokenize_submission(
         submission, submission_text, provider_config
     )
     if not tokens:
@@ -70,14 +78,11 @@ def prepare_submission(submission, matching_start_time=''):
             % submission
         )
     submission.tokens = tokens
-    submission.indexes_json = json_indexes
+    submission.set_indexes(indexes)
 
-    # Compute checksum of submitted source code for finding exact character matches quickly
     # This line will not be reached if submission_text contains data not encodable in utf-8,
     # since it is checked in tokenizer.tokenize_submission
-    submission_text_without_newlines = remove_first_and_last_comment(submission_text)
-    submission_hash = hashlib.md5(submission_text_without_newlines.encode("utf-8"))
-    submission.source_checksum = submission_hash.hexdigest()
+    submission.source_checksum = source_checksum(submission_text)
 
     # Check if submission is the same as the exercise template
     template_comparison = matcher.match_against_template(submission)
@@ -238,11 +238,19 @@ def get_full_course_config(api_user_id, course_id, has_radar_config=True):
 
 @celery.shared_task(ignore_result=True)
 def recompare_all_unmatched(course_id):
+    """
+    Match all unmatched submissions of a course.
+    Exercises that already have matched submissions are matched incrementally, other exercises from scratch.
+    """
     course = Course.objects.get(pk=course_id)
     p_config = config_loaders.provider_config(course.provider)
     recompare = config_loaders.configured_function(p_config, "recompare")
+    match_new_submissions = config_loaders.configured_function(p_config, "match_new_submissions")
     for exercise in course.exercises_with_unmatched_submissions:
-        recompare(exercise, p_config)
+        if exercise.valid_matched_submissions.exists():
+            match_new_submissions(exercise, p_config)
+        else:
+            recompare(exercise, p_config)
 
 
 @celery.shared_task(ignore_result=True)
@@ -23,6 +23,14 @@ def tokenizer_config(key):
     return settings.TOKENIZERS[key]
 
 
+def match_algorithm(tokenizer_key):
+    """
+    Return the dotted path of the match algorithm for token strings of the given tokenizer,
+    which may override the default MATCH_ALGORITHM.
+    """
+    return tokenizer_config(tokenizer_key).get("match_algorithm", settings.MATCH_ALGORITHM)
+
+
 def configured_function(config, key):
     if key not in config:
         raise ConfigError("Missing required configuration key: %s" % (key))
@@ -101,6 +101,13 @@ CACHES = {
         },
     },
 }
+# Store the tokens of submission sources in the database by the MD5 checksum of the source and the tokenizer version,
+# so that identical sources, e.g. resubmissions and sources reloaded from the provider, are not tokenized again.
+TOKENIZER_CACHE = True
+# When the table has more than TOKENIZER_CACHE_MAX_ENTRIES tokenized sources, the oldest ones are deleted.
+# The size is checked once in every TOKENIZER_CACHE_CULL_INTERVAL stored sources.
+TOKENIZER_CACHE_MAX_ENTRIES = 100000
+TOKENIZER_CACHE_CULL_INTERVAL = 1000
 
 # Short name and display name of available tokenizers.
 TOKENIZER_CHOICES = (
@@ -113,9 +120,18 @@ TOKENIZER_CHOICES = (
     ("c", "C"),
     ("cpp", "C++"),
     ("matlab", "MATLAB"),
+    ("java", "Java"),
+    ("c-ts", "C (tree-sitter)"),
+    ("cpp-ts", "C++ (tree-sitter)"),
+    ("js-ts", "JavaScript (tree-sitter)"),
+    ("py-ts", "Python (tree-sitter)"),
 )
 # Tokenizer functions and the separator string injected into the first line
-# of each file.
+# of each file. The tree-sitter tokenizers take the name of the grammar in the key "language",
+# see tokenizer/tree_sitter_lib/helpers.py.
+# The optional key "version" (default 1) is a part of the TOKENIZER_CACHE version of the tokenizer, together with
+# the code of its modules and the versions of the packages they use. It must be increased when the tokenizer starts
+# producing different tokens for other reasons, e.g. changed node scripts.
 TOKENIZERS = {
     "skip": {"tokenize": "tokenizer.skip.tokenize", "separator": "###### %s ######"},
     "scala": {
@@ -137,6 +153,14 @@ TOKENIZERS = {
     "c": {"tokenize": "tokenizer.c.tokenize", "separator": "/****** %s ******/"},
     "cpp": {"tokenize": "tokenizer.cpp.tokenize", "separator": "/****** %s ******/"},
     "matlab": {"tokenize": "tokenizer.matlab.tokenize", "separator": "%%%%%%%%%%%% %s %%%%%%%%%%%%"},
+    "c-ts": {"tokenize": "tokenizer.treesitter.tokenize", "language": "c", "separator": "/****** %s ******/"},
+    "cpp-ts": {"tokenize": "tokenizer.treesitter.tokenize", "language": "cpp", "separator": "/****** %s ******/"},
+    "js-ts": {
+        "tokenize": "tokenizer.treesitter.tokenize",
+        "language": "javascript",
+        "separator": "/****** %s ******/",
+    },
+    "py-ts": {"tokenize": "tokenizer.treesitter.tokenize", "language": "python", "separator": "###### %s ######"},
 }
 
 PROVIDER_CHOICES = (("a+", "A+"), ("filesystem", "File system"))
@@ -151,6 +175,8 @@ PROVIDERS = {
         "recompare": "provider.aplus.recompare",
         # Recompare all unmatched
         "recompare_unmatched": "provider.aplus.recompare_all_unmatched",
+        # Matches new submissions of an exercise incrementally against the matched submissions
+        "match_new_submissions": "provider.aplus.match_new_submissions",
         # Retrieves the contents of a submission from the provider API
         "get_submission_text": "data.aplus.get_submission_text",
         # Queues a read to the provider API that fetches all exercises in a course
@@ -170,6 +196,8 @@ PROVIDERS = {
         "recompare": "provider.filesystem.recompare",
         # Ignored, submissions must be matched from CLI
         "recompare_unmatched": "provider.filesystem.recompare_all_unmatched",
+        # Matches new submissions in DEBUG mode, otherwise they must be matched from CLI
+        "match_new_submissions": "provider.filesystem.match_new_submissions",
         # Retrieves the contents of a submission from filesystem
         "get_submission_text": "data.files.get_submission_text",
         # Ignored, exercises must be created from CLI
@@ -196,13 +224,21 @@ REVIEWS = (
     {"value": REVIEW_CHOICES[3][0], "name": REVIEW_CHOICES[3][1], "class": "warning"},
 )
 
+# Dotted path to the default function that matches two token strings, see MATCH_ALGORITHMS for the choices.
+# A tokenizer in TOKENIZERS may override it with the key "match_algorithm".
 MATCH_ALGORITHM = "matcher.greedy_string_tiling.matchlib.matchers.greedy_string_tiling"
 
 # Weigths are obsolete
 MATCH_ALGORITHMS = {
-    "jplag_ext": {
-        "description": "Greedy string tiling, longest matching substring",
-        "callable": "matcher.jplag_ext.match",
+    "greedy_string_tiling": {
+        "description": "Running Karp-Rabin greedy string tiling, longest matching substring",
+        "callable": "matcher.greedy_string_tiling.matchlib.matchers.greedy_string_tiling",
+        "tokenized_input": True,
+        "weight": 1.0,
+    },
+    "suffix_array_tiling": {
+        "description": "Greedy string tiling using a suffix array with LCP, longest matching substring",
+        "callable": "matcher.greedy_string_tiling.matchlib.matchers.suffix_array_tiling",
         "tokenized_input": True,
         "weight": 1.0,
     },
@@ -228,10 +264,64 @@ MATCH_ALGORITHMS = {
 }
 
 MATCH_STORE_MAX_COUNT = 10
+# Maximum amount of rows per query when writing match results in bulk
+MATCH_STORE_BATCH_SIZE = 1000
+# Storing a batch of match results taking longer than this many seconds is logged as a warning
+MATCH_SLOW_BATCH_SECONDS = 60
 # Minimum similarity for two submissions to be stored into the database as a Comparison instance
 MATCH_STORE_MIN_SIMILARITY = 0.2
 # Amount of float digits when serializing similarity
 SIMILARITY_PRECISION = 3
+# How the submission pairs to compare are selected when matching all submissions of an exercise.
+# "all" compares all pairs with greedy string tiling.
+# "fingerprint" compares only pairs that share at least MATCH_FINGERPRINT_MIN_SHARED winnowed k-gram fingerprints,
+# which with MATCH_FINGERPRINT_MIN_SHARED = 1 never drops a pair that has a match of at least the minimum match length.
+# Larger values trade recall for speed, dropping also pairs whose only matches share too few fingerprints.
+MATCH_PAIR_SELECTION = "all"
+# Length of the hashed k-grams in the fingerprint index, capped by the minimum match length of the exercise
+MATCH_FINGERPRINT_KGRAM_LENGTH = 5
+MATCH_FINGERPRINT_MIN_SHARED = 1
+# Drop the submission pairs whose upper bound of similarity, computed from shared token n-grams of all pairs at once,
+# does not exceed MATCH_STORE_MIN_SIMILARITY, since their matches would not be stored anyway.
+# Requires NumPy and SciPy, without them all selected pairs are compared.
+MATCH_SIMILARITY_PREFILTER = True
+# Length of the n-grams of the pre-filter, capped by the minimum match length of the exercise.
+# Longer n-grams share fewer n-grams by chance, but loosen the bound for minimum match lengths close to it.
+MATCH_PREFILTER_NGRAM_LENGTH = 5
+# Directory for sharing submission tokens with matchlib workers, instead of sending the tokens of all submissions
+# in the matching task message through the broker. Must be readable by the workers. None disables the token store.
+MATCH_TOKEN_STORE_DIRECTORY = None
+# Stored tokens unused by any matching run for this many seconds are deleted
+MATCH_TOKEN_STORE_MAX_AGE = 7 * 24 * 60 * 60
+# Maximum amount of submissions on each side of a block of submission pairs that a matchlib worker compares at once.
+# Smaller blocks are used when there are too few submissions to keep all worker processes busy.
+MATCH_BLOCK_SIZE = 64
+# How matchlib compares the blocks of submission pairs.
+# "process" compares the blocks in a pool of worker processes.
+# "thread" compares the blocks in a pool of threads, which share the submissions without copying them.
+# "native" compares each block with a single call to the C++ extension, which matches the pairs
+# on MATCH_NATIVE_THREADS native threads without holding the GIL. 0 uses one thread for each core.
+# "suffix_array" matches all pairs of an exercise at once from one suffix array of all submissions,
+# which is much faster than comparing each pair when many submissions are near-identical.
+# Its tiles are valid and maximal, but ties between equally long matches are broken differently than in greedy
+# string tiling, so the tiles and similarities of some pairs differ from the other backends. Switching to or from
+# "suffix_array" therefore changes the stored similarities of rematched exercises.
+# If the submissions have more than MATCH_INDEX_MAX_MATCHES maximal matches of minimum match length,
+# the pairs are compared as with "native" instead, 0 meaning no limit.
+MATCH_BACKEND = "process"
+MATCH_NATIVE_THREADS = 0
+MATCH_INDEX_MAX_MATCHES = 10000000
+# Work budget for matching one pair of submissions, 0 meaning no limit.
+# Matching a pair stops after this many hash table probes or milliseconds, keeping the matches found so far.
+# Pathological pairs, e.g. long runs of repeating tokens, could otherwise take minutes and gigabytes of memory.
+MATCH_PAIR_MAX_PROBES = 10000000
+MATCH_PAIR_MAX_MILLISECONDS = 60000
+# SQLite file caching the matches of compared submission pairs across matching runs, keyed by the tokens and marks
+# of both submissions, the minimum match length and the match algorithm. Recomparing an exercise then only compares
+# the pairs with new or changed submissions. Must be writable by the workers. None disables the pair cache.
+MATCH_PAIR_CACHE_PATH = None
+# Maximum amount of cached pairs, the least recently used pairs are evicted first. 0 means no limit.
+MATCH_PAIR_CACHE_MAX_ENTRIES = 1000000
 
 SUBMISSION_VIEW_HEIGHT = 50
 SUBMISSION_VIEW_WIDTH = 5
@@ -0,0 +1 @@
+c.c
\ No newline at end of file
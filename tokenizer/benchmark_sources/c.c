@@ -0,0 +1,43 @@
+#include <math.h>
+#include <stdio.h>
+
+#define NODES 10
+
+/* Dijkstra without a priority queue, fine for small graphs */
+static void shortest_paths(double weights[NODES][NODES], int source, double distances[NODES])
+{
+    int visited[NODES] = {0};
+    for (int i = 0; i < NODES; i++) {
+        distances[i] = INFINITY;
+    }
+    distances[source] = 0.0;
+    for (int round = 0; round < NODES; round++) {
+        int node = -1;
+        for (int i = 0; i < NODES; i++) {
+            if (!visited[i] && (node < 0 || distances[i] < distances[node])) {
+                node = i;
+            }
+        }
+        visited[node] = 1;
+        for (int i = 0; i < NODES; i++) {
+            if (weights[node][i] > 0 && distances[node] + weights[node][i] < distances[i]) {
+                distances[i] = distances[node] + weights[node][i];
+            }
+        }
+    }
+}
+
+int main(void)
+{
+    double weights[NODES][NODES] = {{0}};
+    double distances[NODES];
+    for (int i = 0; i < NODES; i++) {
+        int j = (i * 3 + 1) % NODES;
+        weights[i][j] = weights[j][i] = i / 2.0;
+    }
+    shortest_paths(weights, 0, distances);
+    for (int i = 0; i < NODES; i++) {
+        printf("%d: %f\n", i, distances[i]);
+    }
+    return 0;
+}
@@ -0,0 +1 @@
+cpp.cpp
\ No newline at end of file
@@ -0,0 +1,46 @@
+#include <iostream>
+#include <limits>
+#include <map>
+#include <set>
+
+// Undirected graph with weighted edges
+class Graph {
+public:
+    void add_edge(int a, int b, double weight = 1.0) {
+        edges[a][b] = weight;
+        edges[b][a] = weight;
+    }
+
+    // Dijkstra without a priority queue, fine for small graphs
+    std::map<int, double> shortest_paths(int source) const {
+        std::map<int, double> distances;
+        std::set<int> unvisited;
+        for (const auto& [node, _] : edges) {
+            distances[node] = std::numeric_limits<double>::infinity();
+            unvisited.insert(node);
+        }
+        distances[source] = 0.0;
+        while (!unvisited.empty()) {
+            int node = *unvisited.begin();
+            for (int other : unvisited) {
+                if (distances[other] < distances[node]) node = other;
+            }
+            unvisited.erase(node);
+            for (const auto& [neighbour, weight] : edges.at(node)) {
+                distances[neighbour] = std::min(distances[neighbour], distances[node] + weight);
+            }
+        }
+        return distances;
+    }
+
+private:
+    std::map<int, std::map<int, double>> edges;
+};
+
+int main() {
+    Graph graph;
+    for (int i = 0; i < 10; ++i) graph.add_edge(i, (i * 3 + 1) % 10, i / 2.0);
+    for (const auto& [node, distance] : graph.shortest_paths(0)) {
+        std::cout << node << ": " << distance << '\n';
+    }
+}
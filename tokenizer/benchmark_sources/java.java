@@ -0,0 +1,45 @@
+package exercises;
+
+import java.util.HashMap;
+import java.util.HashSet;
+import java.util.Map;
+import java.util.Set;
+
+/** Undirected graph with weighted edges. */
+public class Graph {
+    private final Map<Integer, Map<Integer, Double>> edges = new HashMap<>();
+
+    public void addEdge(int a, int b, double weight) {
+        edges.computeIfAbsent(a, k -> new HashMap<>()).put(b, weight);
+        edges.computeIfAbsent(b, k -> new HashMap<>()).put(a, weight);
+    }
+
+    // Dijkstra without a priority queue, fine for small graphs
+    public Map<Integer, Double> shortestPaths(int source) {
+        Map<Integer, Double> distances = new HashMap<>();
+        for (int node : edges.keySet()) {
+            distances.put(node, Double.POSITIVE_INFINITY);
+        }
+        distances.put(source, 0.0);
+        Set<Integer> unvisited = new HashSet<>(edges.keySet());
+        while (!unvisited.isEmpty()) {
+            int node = unvisited.stream().min((x, y) -> Double.compare(distances.get(x), distances.get(y))).get();
+            unvisited.remove(node);
+            for (Map.Entry<Integer, Double> edge : edges.get(node).entrySet()) {
+                double distance = distances.get(node) + edge.getValue();
+                if (distance < distances.get(edge.getKey())) {
+                    distances.put(edge.getKey(), distance);
+                }
+            }
+        }
+        return distances;
+    }
+
+    public static void main(String[] args) {
+        Graph graph = new Graph();
+        for (int i = 0; i < 10; i++) {
+            graph.addEdge(i, (i * 3 + 1) % 10, i / 2.0);
+        }
+        System.out.println(graph.shortestPaths(0));
+    }
+}
@@ -0,0 +1 @@
+js.js
\ No newline at end of file
@@ -0,0 +1,38 @@
+"use strict";
+
+/** Undirected graph with weighted edges. */
+class Graph {
+  constructor() {
+    this.edges = new Map();
+  }
+
+  addEdge(a, b, weight = 1.0) {
+    if (!this.edges.has(a)) this.edges.set(a, new Map());
+    if (!this.edges.has(b)) this.edges.set(b, new Map());
+    this.edges.get(a).set(b, weight);
+    this.edges.get(b).set(a, weight);
+  }
+
+  // Dijkstra without a priority queue, fine for small graphs
+  shortestPaths(source) {
+    const distances = new Map([...this.edges.keys()].map(node => [node, Infinity]));
+    distances.set(source, 0.0);
+    const unvisited = new Set(this.edges.keys());
+    while (unvisited.size > 0) {
+      const node = [...unvisited].reduce((x, y) => (distances.get(x) <= distances.get(y) ? x : y));
+      unvisited.delete(node);
+      for (const [neighbour, weight] of this.edges.get(node)) {
+        if (distances.get(node) + weight < distances.get(neighbour)) {
+          distances.set(neighbour, distances.get(node) + weight);
+        }
+      }
+    }
+    return distances;
+  }
+}
+
+const graph = new Graph();
+for (let i = 0; i < 10; i++) {
+  graph.addEdge(i, (i * 3 + 1) % 10, i / 2);
+}
+console.log(`Distances: ${[...graph.shortestPaths(0)].join(", ")}`);
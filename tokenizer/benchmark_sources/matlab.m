@@ -0,0 +1,28 @@
+function distances = shortest_paths(weights, source)
+% SHORTEST_PATHS Dijkstra without a priority queue, fine for small graphs.
+%   weights(i, j) is the weight of the edge between nodes i and j, or 0 without an edge.
+    n = size(weights, 1);
+    distances = inf(1, n);
+    distances(source) = 0;
+    visited = false(1, n);
+    for round = 1:n
+        candidates = distances;
+        candidates(visited) = inf;
+        [~, node] = min(candidates);
+        visited(node) = true;
+        for neighbour = find(weights(node, :) > 0)
+            distance = distances(node) + weights(node, neighbour);
+            if distance < distances(neighbour)
+                distances(neighbour) = distance;
+            end
+        end
+    end
+end
+
+weights = zeros(10);
+for i = 1:10
+    j = mod(i * 3 + 1, 10) + 1;
+    weights(i, j) = i / 2;
+    weights(j, i) = i / 2;
+end
+disp(shortest_paths(weights, 1));
@@ -0,0 +1 @@
+python.py
\ No newline at end of file
@@ -0,0 +1,35 @@
+import collections
+import math
+
+
+class Graph:
+    """
+    Undirected graph with weighted edges.
+    """
+
+    def __init__(self):
+        self.edges = collections.defaultdict(dict)
+
+    def add_edge(self, a, b, weight=1.0):
+        self.edges[a][b] = weight
+        self.edges[b][a] = weight
+
+    def shortest_paths(self, source):
+        # Dijkstra without a priority queue, fine for small graphs
+        distances = {node: math.inf for node in self.edges}
+        distances[source] = 0.0
+        unvisited = set(self.edges)
+        while unvisited:
+            node = min(unvisited, key=lambda n: distances[n])
+            unvisited.remove(node)
+            for neighbour, weight in self.edges[node].items():
+                if distances[node] + weight < distances[neighbour]:
+                    distances[neighbour] = distances[node] + weight
+        return distances
+
+
+if __name__ == "__main__":
+    graph = Graph()
+    for i in range(10):
+        graph.add_edge(i, (i * 3 + 1) % 10, weight=i / 2)
+    print(sorted(graph.shortest_paths(0).items()))
@@ -0,0 +1,36 @@
+package exercises
+
+import scala.collection.mutable
+
+/** Undirected graph with weighted edges. */
+class Graph {
+  private val edges = mutable.Map[Int, mutable.Map[Int, Double]]()
+
+  def addEdge(a: Int, b: Int, weight: Double = 1.0): Unit = {
+    edges.getOrElseUpdate(a, mutable.Map()) += b -> weight
+    edges.getOrElseUpdate(b, mutable.Map()) += a -> weight
+  }
+
+  // Dijkstra without a priority queue, fine for small graphs
+  def shortestPaths(source: Int): Map[Int, Double] = {
+    val distances = mutable.Map[Int, Double]().withDefaultValue(Double.PositiveInfinity)
+    distances(source) = 0.0
+    val unvisited = mutable.Set[Int]() ++= edges.keys
+    while (unvisited.nonEmpty) {
+      val node = unvisited.minBy(distances)
+      unvisited -= node
+      for ((neighbour, weight) <- edges(node)) {
+        if (distances(node) + weight < distances(neighbour)) {
+          distances(neighbour) = distances(node) + weight
+        }
+      }
+    }
+    distances.toMap
+  }
+}
+
+object Main extends App {
+  val graph = new Graph
+  for (i <- 0 until 10) graph.addEdge(i, (i * 3 + 1) % 10, i / 2.0)
+  println(graph.shortestPaths(0).toSeq.sorted.mkString(", "))
+}
@@ -1,6 +1,6 @@
 import logging
-import json
 
+import tokenizer.node_pool as node_pool
 import tokenizer.util as util
 
 logger = logging.getLogger("radar.tokenizer")
@@ -12,14 +12,13 @@ def tokenize_no_string(source):
     """
     css.tokenize but return a list of tokens in place of the token string.
     """
-    parsed = util.run(("node", "tokenizer/node_scripts/cssTokenizer.js"), source)
-    data = json.loads(parsed.decode("utf-8"))
+    data = node_pool.tokenize(("node", "tokenizer/node_scripts/cssTokenizer.js"), source)
     return data["tokens"], data["indexes"]
 
 
 def tokenize(source, config):
     """
-    Runs the CSS tokenizer with Node.js in a subprocess and returns the token string and token index pairs.
+    Runs the CSS tokenizer in a long-lived Node.js worker and returns the token string and token index pairs.
     """
     try:
         tokens, indexes = tokenize_no_string(source)
@@ -1,12 +1,9 @@
-import logging
+import tokenizer.tree_sitter_lib.helpers as helpers
 
-logger = logging.getLogger("radar.tokenizer")
 
-
-def tokenize(source, config):
+def tokenize(source: str, config=None) -> tuple[str, list]:
     """
-    Tokenizes Java code to a sequence of high level structural tokens
-    that are independent from names or values.
-
+    Tokenizes Java code by replacing all leaf nodes of its tree-sitter syntax tree with a single character.
+    Returns the tokenized string and index mappings of the tokens to the original string.
     """
-    logger.error("Missing Java tokenizer")
+    return helpers.tokenize_code(source, "java")
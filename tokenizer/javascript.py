@@ -1,6 +1,6 @@
 import logging
-import json
 
+import tokenizer.node_pool as node_pool
 import tokenizer.util as util
 
 logger = logging.getLogger("radar.tokenizer")
@@ -12,14 +12,13 @@ def tokenize_no_string(source):
     """
     javascript.tokenize but return a list of tokens in place of the token string.
     """
-    parsed = util.run(("nodejs", "tokenizer/node_scripts/jsTokenizer.js"), source)
-    data = json.loads(parsed.decode("utf-8"))
+    data = node_pool.tokenize(("nodejs", "tokenizer/node_scripts/jsTokenizer.js"), source)
     return data["tokens"], data["indexes"]
 
 
 def tokenize(source, config):
     """
-    Runs the JavaScript tokenizer with Node.js in a subprocess and returns the token string and token index pairs.
+    Runs the JavaScript tokenizer in a long-lived Node.js worker and returns the token string and token index pairs.
     """
     try:
         tokens, indexes = tokenize_no_string(source)
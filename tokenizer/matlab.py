@@ -6,4 +6,4 @@ def tokenize(source: str, config=None) -> tuple[str, list]:
     Tokenizes MATLAB code by replacing all token strings with a single character.
     Returns the tokenized string and index mappings (as a JSON string) of the tokens to the original string.
     """
-    return helpers.tokenize_code(source, lexer=MatlabLexer())
+    return helpers.tokenize_code(source, lexer=helpers.shared_lexer(MatlabLexer))
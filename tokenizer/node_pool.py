@@ -0,0 +1,140 @@
+"""
+Pools of long-lived Node.js processes running the tokenizer scripts in server mode.
+
+Starting Node.js takes 50-100 ms, which dominated tokenizing HTML submissions when a new process was started
+for every embedded script and style element. A worker reads one JSON request per line from stdin and writes
+one JSON response per line to stdout, and is reused for later requests. Workers that have exited or do not
+respond are replaced with new ones, and idle workers are pinged before they are reused.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import select
+import subprocess
+import threading
+import time
+
+from tokenizer.util import RunError
+
+logger = logging.getLogger("radar.tokenizer")
+
+# Maximum amount of concurrent workers for one script in one process
+MAX_WORKERS = 4
+# Seconds to wait for a response before the worker is considered hung and replaced
+TIMEOUT = 60
+# Workers idle for more seconds than this are pinged before they are reused
+HEALTH_CHECK_INTERVAL = 60
+HEALTH_CHECK_TIMEOUT = 5
+
+# Pools by command, created when first used in each process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class NodeWorker:
+
+    def __init__(self, command):
+        self.process = subprocess.Popen(
+            (*command, "--server"), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        self.last_used = time.monotonic()
+
+    def request(self, message, timeout=TIMEOUT):
+        """
+        Send a JSON request and return the JSON response, or raise RunError if the worker did not respond.
+        """
+        try:
+            self.process.stdin.write(json.dumps(message).encode("ascii") + b"\n")
+            self.process.stdin.flush()
+        except OSError as e:
+            raise RunError(f"Node worker exited with code {self.process.poll()}") from e
+        # Every response is a single line, so nothing remains buffered after reading the previous one
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            raise RunError(f"Node worker did not respond in {timeout} seconds")
+        line = self.process.stdout.readline()
+        if not line:
+            raise RunError(f"Node worker exited with code {self.process.wait()}")
+        self.last_used = time.monotonic()
+        return json.loads(line)
+
+    def healthy(self):
+        if self.process.poll() is not None:
+            return False
+        if time.monotonic() - self.last_used < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            return self.request({"ping": True}, HEALTH_CHECK_TIMEOUT).get("pong") is True
+        except (RunError, ValueError):
+            return False
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+
+class NodeWorkerPool:
+
+    def __init__(self, command, size=MAX_WORKERS):
+        self.command = tuple(command)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _checkout(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return NodeWorker(self.command)
+            if worker.healthy():
+                return worker
+            logger.warning("Replacing an unresponsive Node worker of %s", " ".join(self.command))
+            worker.close()
+
+    def request(self, message):
+        """
+        Send a JSON request to an idle worker and return the JSON response.
+        Raise RunError if the script returned an error or the worker failed, in which case the worker is closed.
+        """
+        with self._slots:
+            worker = self._checkout()
+            try:
+                response = worker.request(message)
+            except (RunError, ValueError):
+                worker.close()
+                raise
+            self._idle.put(worker)
+        if "error" in response:
+            raise RunError(response["error"])
+        return response
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _pool(command):
+    # Workers started by a parent process are not shared with forked child processes
+    key = (os.getpid(), tuple(command))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = NodeWorkerPool(command)
+            atexit.register(pool.close)
+    return pool
+
+
+def tokenize(command, source):
+    """
+    Tokenize source with the tokenizer script run by command, e.g. ("node", "script.js"),
+    and return the tokenized data of the response.
+    """
+    return _pool(command).request({"source": source})
@@ -1,5 +1,6 @@
 /**
  * Node script that reads CSS source code from stdin, and outputs tokens and indexes of the source code to stdout.
+ * With --server, the script keeps serving requests of newline-delimited JSON, see serve.
  * Input is parsed with the CSS parser used by csslint.net:
  * https://github.com/CSSLint/parser-lib/tree/v1.1.1
  *
@@ -97,9 +98,30 @@ function main() {
   return JSON.stringify(tokenizedData);
 };
 
+// Serve tokenizing requests until stdin is closed, reading one JSON request per line from stdin,
+// e.g. {"source": "..."}, and writing one JSON response per line to stdout,
+// either the tokenized data or {"error": "..."}. A request {"ping": true} is answered with {"pong": true}.
+function serve() {
+  const lines = require('readline').createInterface({input: process.stdin, crlfDelay: Infinity});
+  lines.on('line', line => {
+    let response;
+    try {
+      const request = JSON.parse(line);
+      response = request.ping ? {pong: true} : tokenize(request.source, tokenTypes);
+    } catch (e) {
+      response = {error: String(e)};
+    }
+    process.stdout.write(JSON.stringify(response) + "\n");
+  });
+};
+
 
 if (require.main === module) {
-  console.log(main());
+  if (process.argv.includes("--server")) {
+    serve();
+  } else {
+    console.log(main());
+  }
 }
 
 module.exports = {
@@ -1,6 +1,8 @@
+import functools
 import logging
 import tokenizer.pygments_lib.token_type as token_type
 from pygments.lexer import RegexLexer
+from pygments.token import STANDARD_TYPES, _TokenType
 
 logger = logging.getLogger("radar.tokenizer")
 
@@ -24,46 +26,54 @@ def token_type_to_chr(token_type: int) -> str:
     return chr(token_type + 33)
 
 
+def _token_char(pygments_token_type: _TokenType):
+    """
+    Returns the character of a Pygments token type, or None if the token type is dropped from the tokenized string.
+    """
+    # Convert token type to the name of the token type constant
+    token_type_clean = str(pygments_token_type).replace('.', '_').upper()
+
+    # Skip tokens that do not change the semantics of the code
+    if token_type_clean in SKIP_TOKENS:
+        return None
+    try:
+        return token_type_to_chr(token_type.__dict__[token_type_clean])
+    except KeyError:
+        logger.error('Unknown token type: %s', token_type_clean)
+        raise
+
+
+# Characters of Pygments token types, precomputed for the standard token types
+# and filled in for other token types created by lexers when first seen
+TOKEN_CHARS = {t: _token_char(t) for t in STANDARD_TYPES}
+
+
+@functools.cache
+def shared_lexer(lexer_class: type[RegexLexer]) -> RegexLexer:
+    """
+    Returns a shared instance of a lexer class, lexers keep no state between calls to get_tokens_unprocessed.
+    """
+    return lexer_class()
+
+
 def tokenize_code(source: str, lexer: RegexLexer) -> tuple[str, list]:
     """
     Tokenizes code based on the lexer given by replacing all token strings with a single character.
     Returns the tokenized string and index mappings (as a JSON string) of the tokens to the original string.
     """
-
+    chars = []
     indexes = []
-    # utf-8 is default for the str-type
-    tokenized_source = ""
-
-    # Get tokens from the lexer
-    tokens = lexer.get_tokens_unprocessed(source)
-
-    # Process tokens
-    for token in tokens:
-        # Convert token type to the name of the token type constant
-        token_type_clean = str(token[1]).replace('.', '_').upper()
-
-        # Skip tokens that do not change the semantics of the code
-        if token_type_clean not in SKIP_TOKENS:
-            try:
-                token_type_value = token_type.__dict__[token_type_clean]
-
-                # Check for lexer error
-                if token_type_value == 4:
-                    #raise Exception("Token type is not supported")
-                    #logger.error("Token type is not supported")
-                    pass
-
-                # Convert token type to a single character
-                tokenized_source += token_type_to_chr(token_type_value)
-
-            except KeyError:
-                logger.error('Unknown token type: %s', token_type_clean)
-                raise
-            except Exception as e:
-                logger.error('Error tokenizing source code: %s', e)
-                raise
-
-            # Save the start and end index of the token
-            indexes.append([token[0], token[0] + len(token[2])])
-
-    return tokenized_source, indexes
+    token_chars = TOKEN_CHARS
+
+    for index, pygments_token_type, value in lexer.get_tokens_unprocessed(source):
+        try:
+            char = token_chars[pygments_token_type]
+        except KeyError:
+            char = token_chars[pygments_token_type] = _token_char(pygments_token_type)
+        if char is None:
+            continue
+        chars.append(char)
+        # Save the start and end index of the token
+        indexes.append([index, index + len(value)])
+
+    return "".join(chars), indexes
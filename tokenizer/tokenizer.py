@@ -1,7 +1,16 @@
-import json
+import functools
+import hashlib
+import importlib.metadata
 import logging
+import sys
+import types
 
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from matcher.greedy_string_tiling.matchlib.util import pack_int_rows, unpack_int_rows
 from radar.config import tokenizer_config, configured_function
+from tokenizer.tree_sitter_lib.helpers import GRAMMARS
 
 
 logger = logging.getLogger("radar.tokenizer")
@@ -13,10 +22,123 @@ def tokenize_submission(submission, submission_text, p_config):
 
     """
     logger.info("Tokenizing submission %s", submission)
-    tokens, indexes = tokenize_source(
-        submission_text, tokenizer_config(submission.exercise.tokenizer)
-    )
-    return tokens, json.dumps(indexes)
+    return tokenize_cached(submission_text, submission.exercise.tokenizer)
+
+
+def tokenize_cached(source, tokenizer_key):
+    """
+    Tokenizes source string with the tokenizer of the given key.
+    Identical sources, e.g. resubmissions and copied templates, are tokenized only once,
+    if settings.TOKENIZER_CACHE is set.
+
+    """
+    cached = cached_tokens([source], tokenizer_key)[0]
+    if cached is not None:
+        return cached
+    tokenized = tokenize_source(source, tokenizer_config(tokenizer_key))
+    cache_tokens([source], tokenizer_key, [tokenized])
+    return tokenized
+
+
+def cached_tokens(sources, tokenizer_key):
+    """
+    Returns a list with the cached tokens and indexes of each source tokenized with the tokenizer of the given key,
+    or None for the sources that are not cached. All sources are looked up with one query.
+    """
+    if not settings.TOKENIZER_CACHE:
+        return [None] * len(sources)
+    # data.models imports this module
+    from data.models import TokenizedSource
+
+    hashes = [_source_hash(source) for source in sources]
+    found = {}
+    for source_hash, tokens, packed_indexes in TokenizedSource.objects.filter(
+        source_hash__in=set(hashes), tokenizer=tokenizer_key, version=tokenizer_version(tokenizer_key)
+    ).values_list("source_hash", "tokens", "indexes_packed"):
+        found[source_hash] = (tokens, unpack_int_rows(bytes(packed_indexes), 2))
+    return [found.get(source_hash) for source_hash in hashes]
+
+
+def cache_tokens(sources, tokenizer_key, tokenized):
+    """
+    Stores the tokens and indexes of sources tokenized with the tokenizer of the given key, if settings.TOKENIZER_CACHE
+    is set. Failed tokenizations are not stored, so that they are retried.
+    """
+    if not settings.TOKENIZER_CACHE:
+        return
+    from data.models import TokenizedSource
+
+    version = tokenizer_version(tokenizer_key)
+    rows = {}
+    for source, (tokens, indexes) in zip(sources, tokenized):
+        if tokens:
+            source_hash = _source_hash(source)
+            rows[source_hash] = TokenizedSource(
+                source_hash=source_hash,
+                tokenizer=tokenizer_key,
+                version=version,
+                tokens=tokens,
+                indexes_packed=pack_int_rows(indexes, 2),
+            )
+    if not rows:
+        return
+    try:
+        with transaction.atomic():
+            TokenizedSource.objects.bulk_create(rows.values())
+    except IntegrityError:
+        # Some of the sources were tokenized concurrently
+        TokenizedSource.objects.bulk_create(rows.values(), ignore_conflicts=True)
+        return
+    # Counting the rows is slow in large tables, so the oldest rows are deleted only in every interval of inserts
+    interval = settings.TOKENIZER_CACHE_CULL_INTERVAL
+    if any(row.pk is not None and row.pk % interval == 0 for row in rows.values()):
+        max_entries = settings.TOKENIZER_CACHE_MAX_ENTRIES
+        oldest_kept = TokenizedSource.objects.order_by("-pk").values_list("pk", flat=True)[max_entries - 1:max_entries]
+        if oldest_kept:
+            TokenizedSource.objects.filter(pk__lt=oldest_kept[0]).delete()
+
+
+def _source_hash(source):
+    return hashlib.md5(source.encode("utf-8")).hexdigest()
+
+
+@functools.cache
+def tokenizer_version(tokenizer_key):
+    """
+    Returns a checksum of the version of a tokenizer, which changes with the "version" of the tokenizer settings,
+    the code of the tokenizer modules and the versions of the packages they use, e.g. Pygments and tree-sitter.
+    """
+    t_config = tokenizer_config(tokenizer_key)
+    tokenize = configured_function(t_config, "tokenize")
+    # Find the modules of the tokenizer package used by the tokenizer and the top level packages used by them
+    modules = {}
+    packages = set()
+    pending = [sys.modules[tokenize.__module__]]
+    if "language" in t_config:
+        packages.add(GRAMMARS[t_config["language"]])
+    while pending:
+        module = pending.pop()
+        if module.__name__ in modules:
+            continue
+        modules[module.__name__] = module
+        for value in vars(module).values():
+            name = value.__name__ if isinstance(value, types.ModuleType) else getattr(value, "__module__", None)
+            if not isinstance(name, str):
+                continue
+            if name.split(".")[0] == __name__.split(".")[0]:
+                if name in sys.modules:
+                    pending.append(sys.modules[name])
+            else:
+                packages.add(name.split(".")[0])
+
+    checksum = hashlib.md5(str(t_config.get("version", 1)).encode("utf-8"))
+    for name in sorted(modules):
+        with open(modules[name].__file__, "rb") as f:
+            checksum.update(f.read())
+    distributions = importlib.metadata.packages_distributions()
+    for distribution in sorted({d for package in packages for d in distributions.get(package, ())}):
+        checksum.update(("%s==%s" % (distribution, importlib.metadata.version(distribution))).encode("utf-8"))
+    return checksum.hexdigest()
 
 
 def tokenize_source(source, t_config):
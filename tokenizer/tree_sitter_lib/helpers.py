@@ -0,0 +1,351 @@
+"""
+Tokenizing with tree-sitter parsers, which run in-process and are several times faster than the regex driven
+Pygments lexers on large sources.
+
+Every leaf node of the syntax tree is a token. Strings and character literals are single tokens and comments are
+dropped. The grammars have a few hundred leaf node types, so the node types are grouped into token classes,
+each of which is replaced with a single printable ASCII character in the tokenized string. Keywords, brackets and
+operators that change the structure of the code have classes of their own, while e.g. all names, all numbers and
+all declaration modifiers share one class.
+
+The tree-sitter package and the grammar packages (e.g. tree-sitter-java) are optional,
+without them the tree-sitter tokenizers log an error and return an empty token string.
+"""
+import functools
+import importlib
+import logging
+import threading
+
+try:
+    import tree_sitter
+except ImportError:
+    tree_sitter = None
+
+logger = logging.getLogger("radar.tokenizer")
+
+# Token classes in the order of their characters, starting from '!'
+TOKEN_CLASSES = (
+    # Leaves carrying names and values
+    "identifier", "type_identifier", "field_identifier", "primitive_type", "number", "string", "character",
+    "constant", "this",
+    # Punctuation
+    "(", ")", "[", "]", "{", "}", ",", ";", ".", ":", "::", "?", "->", "=>", "...", "@",
+    # Operators
+    "=", "augmented_assignment", "+", "-", "*", "/", "%", "**", "++", "--",
+    "==", "!=", "<", ">", "<=", ">=", "&&", "||", "!", "&", "|", "^", "~", "<<", ">>",
+    # Control flow
+    "if", "else", "for", "while", "do", "switch", "case", "default", "break", "continue", "return",
+    "goto", "try", "catch", "finally", "throw", "yield", "await", "with", "assert",
+    # Declarations
+    "class", "struct", "interface", "enum", "function", "lambda", "var", "typedef", "modifier", "template",
+    "package", "import", "new", "delete", "in", "is", "sizeof",
+    # Preprocessor
+    "include", "define", "preprocessor",
+    # Leaves of other types
+    "keyword", "operator", "other",
+)
+assert len(TOKEN_CLASSES) <= 94, "Token classes must fit in the printable ASCII characters"
+
+# Named node types which belong to a token class of another name
+NAMED_TOKEN_CLASS_ALIASES = {
+    "property_identifier": "field_identifier",
+    "shorthand_property_identifier": "field_identifier",
+    "shorthand_property_identifier_pattern": "field_identifier",
+    "private_property_identifier": "field_identifier",
+    "namespace_identifier": "identifier",
+    "statement_identifier": "identifier",
+    "scoped_identifier": "identifier",
+    "integer": "number",
+    "float": "number",
+    "number_literal": "number",
+    "decimal_integer_literal": "number",
+    "hex_integer_literal": "number",
+    "octal_integer_literal": "number",
+    "binary_integer_literal": "number",
+    "decimal_floating_point_literal": "number",
+    "hex_floating_point_literal": "number",
+    "string_literal": "string",
+    "raw_string_literal": "string",
+    "concatenated_string": "string",
+    "system_lib_string": "string",
+    "template_string": "string",
+    "text_block": "string",
+    "regex": "string",
+    "character_literal": "character",
+    "char_literal": "character",
+    "true": "constant",
+    "false": "constant",
+    "null": "constant",
+    "null_literal": "constant",
+    "nullptr": "constant",
+    "undefined": "constant",
+    "none": "constant",
+    "super": "this",
+    "ellipsis": "...",
+    "preproc_arg": "other",
+}
+
+# Anonymous node types, i.e. token spellings, which belong to a token class of another name
+TOKEN_CLASS_ALIASES = {
+    # Types
+    "auto": "primitive_type",
+    "bool": "primitive_type",
+    "boolean": "primitive_type",
+    "byte": "primitive_type",
+    "char": "primitive_type",
+    "double": "primitive_type",
+    "float": "primitive_type",
+    "int": "primitive_type",
+    "long": "primitive_type",
+    "short": "primitive_type",
+    "signed": "primitive_type",
+    "unsigned": "primitive_type",
+    "void": "primitive_type",
+    # Literals
+    "true": "constant",
+    "false": "constant",
+    "null": "constant",
+    "nullptr": "constant",
+    "NULL": "constant",
+    "None": "constant",
+    "True": "constant",
+    "False": "constant",
+    # Operators
+    ":=": "=",
+    "+=": "augmented_assignment",
+    "-=": "augmented_assignment",
+    "*=": "augmented_assignment",
+    "/=": "augmented_assignment",
+    "//=": "augmented_assignment",
+    "%=": "augmented_assignment",
+    "**=": "augmented_assignment",
+    "@=": "augmented_assignment",
+    "&=": "augmented_assignment",
+    "|=": "augmented_assignment",
+    "^=": "augmented_assignment",
+    "<<=": "augmented_assignment",
+    ">>=": "augmented_assignment",
+    ">>>=": "augmented_assignment",
+    "&&=": "augmented_assignment",
+    "||=": "augmented_assignment",
+    "??=": "augmented_assignment",
+    "and_eq": "augmented_assignment",
+    "or_eq": "augmented_assignment",
+    "xor_eq": "augmented_assignment",
+    "//": "/",
+    "===": "==",
+    "!==": "!=",
+    "<>": "!=",
+    "not_eq": "!=",
+    "and": "&&",
+    "or": "||",
+    "??": "||",
+    "not": "!",
+    "bitand": "&",
+    "bitor": "|",
+    "xor": "^",
+    "compl": "~",
+    ">>>": ">>",
+    ".*": ".",
+    "->*": "->",
+    "?.": ".",
+    "instanceof": "is",
+    "is not": "is",
+    "not in": "in",
+    # Keywords
+    "elif": "else",
+    "co_return": "return",
+    "co_yield": "yield",
+    "co_await": "await",
+    "except": "catch",
+    "raise": "throw",
+    "throws": "throw",
+    "def": "function",
+    "function": "function",
+    "let": "var",
+    "const": "modifier",
+    "constexpr": "modifier",
+    "consteval": "modifier",
+    "constinit": "modifier",
+    "volatile": "modifier",
+    "static": "modifier",
+    "extern": "modifier",
+    "register": "modifier",
+    "inline": "modifier",
+    "virtual": "modifier",
+    "override": "modifier",
+    "explicit": "modifier",
+    "friend": "modifier",
+    "mutable": "modifier",
+    "restrict": "modifier",
+    "public": "modifier",
+    "private": "modifier",
+    "protected": "modifier",
+    "final": "modifier",
+    "abstract": "modifier",
+    "native": "modifier",
+    "synchronized": "modifier",
+    "transient": "modifier",
+    "strictfp": "modifier",
+    "sealed": "modifier",
+    "non-sealed": "modifier",
+    "async": "modifier",
+    "global": "modifier",
+    "nonlocal": "modifier",
+    "get": "modifier",
+    "set": "modifier",
+    "union": "struct",
+    "record": "class",
+    "del": "delete",
+    "typeof": "sizeof",
+    "alignof": "sizeof",
+    "decltype": "sizeof",
+    "typename": "template",
+    "namespace": "package",
+    "module": "package",
+    "from": "import",
+    "export": "import",
+    "using": "import",
+    "exports": "import",
+    "requires": "import",
+    "#include": "include",
+    "#define": "define",
+    "#if": "preprocessor",
+    "#ifdef": "preprocessor",
+    "#ifndef": "preprocessor",
+    "#elif": "preprocessor",
+    "#elifdef": "preprocessor",
+    "#elifndef": "preprocessor",
+    "#else": "preprocessor",
+    "#endif": "preprocessor",
+}
+
+# Node types which are single tokens although they have child nodes
+ATOMIC_NODE_TYPES = {
+    "string", "string_literal", "raw_string_literal", "concatenated_string", "template_string",
+    "character_literal", "char_literal", "text_block", "regex", "system_lib_string",
+}
+
+# Node types which are dropped from the tokenized string
+SKIP_NODE_TYPES = {"comment", "line_comment", "block_comment"}
+
+# Grammar packages of the supported languages
+GRAMMARS = {
+    "c": "tree_sitter_c",
+    "cpp": "tree_sitter_cpp",
+    "java": "tree_sitter_java",
+    "javascript": "tree_sitter_javascript",
+    "python": "tree_sitter_python",
+}
+
+TOKEN_CHARS = {name: chr(i + 33) for i, name in enumerate(TOKEN_CLASSES)}
+
+
+def _node_type_char(node_type: str, named: bool):
+    """
+    Returns the character of a node type, or None if nodes of this type are dropped from the tokenized string.
+    """
+    if node_type in SKIP_NODE_TYPES or node_type.isspace():
+        return None
+    if named:
+        name = NAMED_TOKEN_CLASS_ALIASES.get(node_type, node_type)
+    else:
+        name = TOKEN_CLASS_ALIASES.get(node_type, node_type)
+    if name not in TOKEN_CHARS:
+        if named:
+            name = "other"
+        elif node_type.replace("_", "").isalpha():
+            name = "keyword"
+        else:
+            name = "operator"
+    return TOKEN_CHARS[name]
+
+
+class Grammar:
+    """
+    A tree-sitter language with parsers for each thread and the characters of its node types.
+    """
+
+    def __init__(self, language: "tree_sitter.Language"):
+        self.language = language
+        # Characters and atomicity of nodes by their numeric node type
+        self.chars = []
+        self.atomic = []
+        for kind_id in range(self.language.node_kind_count):
+            node_type = self.language.node_kind_for_id(kind_id) or ""
+            self.chars.append(_node_type_char(node_type, self.language.node_kind_is_named(kind_id)))
+            self.atomic.append(node_type in ATOMIC_NODE_TYPES)
+        self._local = threading.local()
+
+    def parser(self):
+        # Parsers are not thread safe, but can be reused for any amount of sources
+        parser = getattr(self._local, "parser", None)
+        if parser is None:
+            parser = self._local.parser = tree_sitter.Parser(self.language)
+        return parser
+
+
+@functools.cache
+def grammar(language_name: str):
+    """
+    Returns the shared Grammar of a language in GRAMMARS, or None if its packages are not installed.
+    """
+    if tree_sitter is None:
+        logger.error("Missing tree-sitter, cannot tokenize %s", language_name)
+        return None
+    module_name = GRAMMARS[language_name]
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError:
+        logger.error("Missing tree-sitter grammar %s, cannot tokenize %s", module_name, language_name)
+        return None
+    return Grammar(tree_sitter.Language(module.language()))
+
+
+def _char_offsets(source: str):
+    """
+    Returns a list mapping UTF-8 byte offsets of source to its character offsets.
+    """
+    offsets = []
+    for i, c in enumerate(source):
+        offsets.extend([i] * len(c.encode("utf-8")))
+    offsets.append(len(source))
+    return offsets
+
+
+def tokenize_code(source: str, language_name: str) -> tuple[str, list]:
+    """
+    Tokenizes code of the given language by replacing all leaf nodes of its syntax tree with a single character.
+    Returns the tokenized string and index mappings of the tokens to the original string.
+    """
+    g = grammar(language_name)
+    if g is None:
+        return "", []
+    data = source.encode("utf-8")
+    tree = g.parser().parse(data)
+    # Node positions are in bytes, which equal characters in ASCII sources
+    offsets = None if len(data) == len(source) else _char_offsets(source)
+
+    chars = []
+    indexes = []
+    node_chars = g.chars
+    atomic = g.atomic
+    cursor = tree.walk()
+    while True:
+        node = cursor.node
+        kind_id = node.kind_id
+        # Descend into nodes until a leaf or an atomic node is reached
+        if atomic[kind_id] or not cursor.goto_first_child():
+            char = node_chars[kind_id]
+            start, end = node.start_byte, node.end_byte
+            # Nodes inserted by error recovery are empty
+            if char is not None and start < end:
+                chars.append(char)
+                if offsets is None:
+                    indexes.append([start, end])
+                else:
+                    indexes.append([offsets[start], offsets[end]])
+            # Continue from the next sibling of the closest ancestor which has one
+            while not cursor.goto_next_sibling():
+                if not cursor.goto_parent():
+                    return "".join(chars), indexes
@@ -0,0 +1,10 @@
+import tokenizer.tree_sitter_lib.helpers as helpers
+
+
+def tokenize(source: str, config: dict) -> tuple[str, list]:
+    """
+    Tokenizes code of the language given by the tokenizer configuration key "language", e.g. "cpp",
+    by replacing all leaf nodes of its tree-sitter syntax tree with a single character.
+    Returns the tokenized string and index mappings of the tokens to the original string.
+    """
+    return helpers.tokenize_code(source, config["language"])